@@ -1,5 +1,7 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_out
 from django.core.management import call_command
+from django.db.models.signals import post_delete, post_save
 
 from npm_mjs.signals import post_npm_install
 
@@ -13,3 +15,8 @@ class BaseConfig(AppConfig):
 
     def ready(self):
         post_npm_install.connect(bundle_mathlive)
+        from django.contrib.auth.models import User
+        from .auth_cache import clear_user_auth
+        user_logged_out.connect(clear_user_auth)
+        post_save.connect(clear_user_auth, sender=User)
+        post_delete.connect(clear_user_auth, sender=User)
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from django.conf import settings
+
+from base.servers.invalidation import invalidation
+
+
+class AuthCache(object):
+    """
+    The users that websocket connections have recently been authenticated as,
+    by session key or digest of the Basic auth credentials, so that clients
+    reconnecting at once do not each load the session or hash the password
+    anew. Entries expire after WS_AUTH_CACHE_TIME seconds and the least
+    recently used ones are dropped once there are more than
+    WS_AUTH_CACHE_SIZE. Sessions without a user are cached as well, but failed
+    Basic auth logins are not, as the password may be changed to the one that
+    was tried. It is used from the database threads.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        # Returns a tuple (found, user).
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            user, expires = entry
+            if expires < time():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, user
+
+    def set(self, key, user):
+        if not settings.WS_AUTH_CACHE_TIME:
+            return
+        with self.lock:
+            self.entries[key] = (user, time() + settings.WS_AUTH_CACHE_TIME)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.WS_AUTH_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear_user(self, user_id):
+        with self.lock:
+            for key in [
+                key for key, (user, expires) in self.entries.items()
+                if user is not None and user.id == user_id
+            ]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+auth_cache = AuthCache()
+
+
+@invalidation
+def clear_user(user_id):
+    auth_cache.clear_user(user_id)
+
+
+def clear_user_auth(sender, user=None, instance=None, **kwargs):
+    # Called when a user logs out or is changed, for example because of a new
+    # password.
+    if instance is not None:
+        user = instance
+    if user is not None:
+        clear_user(user.id)
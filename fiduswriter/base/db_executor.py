@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from tornado.ioloop import IOLoop
+
+executor = None
+
+
+def call(function, args, kwargs):
+    try:
+        return function(*args, **kwargs)
+    finally:
+        # Each thread keeps its own database connection, which is closed
+        # once it is older than CONN_MAX_AGE or has become unusable.
+        close_old_connections()
+
+
+def run_in_db_thread(function, *args, **kwargs):
+    # Runs a function that accesses the database in the database thread pool,
+    # so that the websocket connections on the IOLoop are not held up by it.
+    # Returns a future to await on the IOLoop.
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.WS_DB_THREADS,
+            thread_name_prefix='websocket-db'
+        )
+    return IOLoop.current().run_in_executor(
+        executor,
+        call,
+        function,
+        args,
+        kwargs
+    )
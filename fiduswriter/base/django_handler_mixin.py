@@ -3,20 +3,57 @@ import base64
 from builtins import object
 from django.contrib import auth
 from django.conf import settings
+from django.utils.crypto import salted_hmac
 from importlib import import_module
 
+from .auth_cache import auth_cache
+
 
 class DjangoHandlerMixin(object):
     def get_django_session(self):
         if not hasattr(self, '_session'):
             engine = \
-                import_module(settings.SESSION_ENGINE)
+                import_module(
+                    settings.WS_SESSION_ENGINE or settings.SESSION_ENGINE
+                )
             session_key = \
                 self.get_cookie(settings.SESSION_COOKIE_NAME)
             self._session = engine.SessionStore(session_key)
         return self._session
 
     def get_current_user(self):
+        session_key = self.get_cookie(settings.SESSION_COOKIE_NAME)
+        if session_key:
+            found, user = auth_cache.get(('session', session_key))
+            if not found:
+                user = self.get_session_user()
+                # Logging in changes the session key, so sessions without a
+                # user can be cached as well.
+                auth_cache.set(('session', session_key), user)
+            if user is not None:
+                return user
+        # try basic auth
+        if 'Authorization' not in self.request.headers:
+            return None
+        (kind, data) = self.request.headers['Authorization'].split(' ')
+        if kind != 'Basic':
+            return None
+        # The credentials are only kept as a digest.
+        key = ('basic', salted_hmac('ws-basic-auth', data).hexdigest())
+        found, user = auth_cache.get(key)
+        if found:
+            return user
+        data += "=" * ((4 - len(data) % 4) % 4)
+        (username, password) = base64.b64decode(
+            data
+        ).decode('utf-8').split(':')
+        user = auth.authenticate(username=username, password=password)
+        if user is None or not user.is_authenticated:
+            return None
+        auth_cache.set(key, user)
+        return user
+
+    def get_session_user(self):
         # get_user needs a django request object, but only looks at the session
 
         class Dummy(object):
@@ -27,18 +64,4 @@ class DjangoHandlerMixin(object):
         user = auth.get_user(django_request)
         if user.is_authenticated:
             return user
-        else:
-            # try basic auth
-            if 'Authorization' not in self.request.headers:
-                return None
-            (kind, data) = self.request.headers['Authorization'].split(' ')
-            if kind != 'Basic':
-                return None
-            data += "=" * ((4 - len(data) % 4) % 4)
-            (username, password) = base64.b64decode(
-                data
-            ).decode('utf-8').split(':')
-            user = auth.authenticate(username=username, password=password)
-            if user is not None and user.is_authenticated:
-                return user
-            return None
+        return None
@@ -0,0 +1,86 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class StandardCodec(object):
+    """
+    JSON codec of the standard library. Values that JSON has no type for, such
+    as dates, are encoded the way Django does it.
+    """
+
+    def encode(self, value):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    def encode_bytes(self, value):
+        return self.encode(value).encode('utf-8')
+
+    def decode(self, value):
+        return json.loads(value)
+
+
+class OrjsonCodec(object):
+    """
+    JSON codec using orjson, which is several times faster than the standard
+    library. Its output has no whitespace and characters outside of ASCII are
+    not escaped. Dates and other values it has no type for are encoded the way
+    Django does it.
+    """
+
+    def __init__(self):
+        self.default = DjangoJSONEncoder().default
+        self.option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode(self, value):
+        return self.encode_bytes(value).decode('utf-8')
+
+    def encode_bytes(self, value):
+        return orjson.dumps(value, default=self.default, option=self.option)
+
+    def decode(self, value):
+        return orjson.loads(value)
+
+
+CODECS = {
+    'json': StandardCodec,
+    'orjson': OrjsonCodec
+}
+
+
+def get_codec(name):
+    if name == 'auto':
+        name = 'json' if orjson is None else 'orjson'
+    if name not in CODECS:
+        raise ImproperlyConfigured('Unknown JSON_CODEC: %s' % name)
+    if name == 'orjson' and orjson is None:
+        raise ImproperlyConfigured('JSON_CODEC is orjson, which is missing.')
+    return CODECS[name]()
+
+
+codec = get_codec(settings.JSON_CODEC)
+json_encode = codec.encode
+json_encode_bytes = codec.encode_bytes
+json_decode = codec.decode
+
+
+class JsonResponse(HttpResponse):
+    """
+    Django's JsonResponse, encoded with the configured codec.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=json_encode_bytes(data), **kwargs)
@@ -44,6 +44,13 @@ class Command(BaseCommand):
             'addrport', nargs='?',
             help='Optional port number, or ipaddr:port'
         )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help=(
+                'Number of server processes. All connections to a document '
+                'are handled by the same process.'
+            )
+        )
 
     def handle(self, *args, **options):
         if options['addrport']:
@@ -61,6 +68,8 @@ class Command(BaseCommand):
             self.port = self.default_port
         if not self.port.isdigit():
             raise CommandError("%r is not a valid port number." % self.port)
+        if options['workers'] < 1:
+            raise CommandError("There needs to be at least one worker.")
         self.inner_run(*args, **options)
 
     def inner_run(self, *args, **options):
@@ -98,7 +107,7 @@ class Command(BaseCommand):
         # in the "--noreload" case).
         translation.activate(settings.LANGUAGE_CODE)
 
-        run_server(self.port)
+        run_server(self.port, options['workers'])
 
     def get_setup_server(self):
         # Start a tornado server to run while the compile is happening
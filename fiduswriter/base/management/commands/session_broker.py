@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from base.servers.session_broker import run as run_broker
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the session broker that lets several server processes share '
+        'collaboration sessions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            dest='socket',
+            default=settings.WS_SESSION_BROKER_SOCKET,
+            help='Path of the Unix socket to listen on.',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            'Session broker is listening on %s\n' % options['socket']
+        )
+        run_broker(options['socket'])
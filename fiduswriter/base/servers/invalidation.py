@@ -0,0 +1,89 @@
+import logging
+import socket
+from functools import wraps
+
+from tornado.ioloop import IOLoop
+
+from base.json_codec import json_decode, json_encode_bytes
+
+logger = logging.getLogger(__name__)
+
+# The functions that clear caches in the memory of a server process, by name
+# (see invalidation).
+invalidations = dict()
+
+
+def invalidation(function):
+    """
+    Decorates a function that clears a cache in the memory of this server
+    process, so that it is called in the other server processes started by
+    base.servers.workers as well. Its arguments need to be JSON serializable.
+    """
+    name = '%s.%s' % (function.__module__, function.__qualname__)
+    invalidations[name] = function
+
+    @wraps(function)
+    def invalidate(*args):
+        function(*args)
+        if InvalidationChannel.current is not None:
+            InvalidationChannel.current.broadcast(name, args)
+    return invalidate
+
+
+def bind_invalidation_socket():
+    invalidation_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    invalidation_socket.bind(('127.0.0.1', 0))
+    invalidation_socket.setblocking(False)
+    return invalidation_socket
+
+
+class InvalidationChannel(object):
+    """
+    Passes the invalidations of one server process on to the others. Each
+    process receives them as datagrams on a UDP port on localhost.
+    """
+    # The channel of this process, if there are several server processes.
+    current = None
+
+    def __init__(self, ports, index, invalidation_socket):
+        self.ports = ports
+        self.index = index
+        self.socket = invalidation_socket
+
+    def listen(self):
+        InvalidationChannel.current = self
+        IOLoop.current().add_handler(
+            self.socket.fileno(),
+            self.receive,
+            IOLoop.READ
+        )
+
+    def stop(self):
+        if InvalidationChannel.current is self:
+            InvalidationChannel.current = None
+        IOLoop.current().remove_handler(self.socket.fileno())
+
+    def broadcast(self, name, args):
+        # Called from any thread.
+        data = json_encode_bytes([name, args])
+        for index, port in enumerate(self.ports):
+            if index == self.index:
+                continue
+            try:
+                self.socket.sendto(data, ('127.0.0.1', port))
+            except OSError:
+                logger.exception(
+                    'Cannot send invalidation to port %d.' % port
+                )
+
+    def receive(self, fd, events):
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except BlockingIOError:
+                return
+            name, args = json_decode(data)
+            try:
+                invalidations[name](*args)
+            except Exception:
+                logger.exception('Cannot handle invalidation %s.' % name)
@@ -0,0 +1,427 @@
+import logging
+import os
+import socket
+import uuid
+from collections import deque
+from datetime import timedelta
+from functools import partial
+from itertools import count
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.netutil import bind_unix_socket
+from tornado.tcpserver import TCPServer
+
+from base.json_codec import json_decode, json_encode_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class SessionBroker(TCPServer):
+    """
+    Shares collaboration sessions between several server processes.
+
+    For every channel (an open document) the broker keeps the version
+    counter, the most recent diffs and the roster of participants. Server
+    processes talk to the broker through a Unix socket using newline
+    delimited JSON. Each process opens one connection, on which it sends its
+    requests and on which the broker answers them in order and pushes the
+    messages published by the other processes. Answers carry the id of their
+    request.
+    """
+
+    def __init__(self, history_length=1000):
+        super().__init__()
+        self.history_length = history_length
+        self.channels = dict()
+        self.subscribers = dict()
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        client_id = None
+        while True:
+            try:
+                line = yield stream.read_until(b'\n')
+            except StreamClosedError:
+                break
+            request = json_decode(line)
+            if request['op'] == 'subscribe':
+                client_id = request['client']
+                self.subscribers[client_id] = stream
+                response = {'ok': True}
+            else:
+                response = self.handle_request(request)
+            if 'id' in request:
+                response['id'] = request['id']
+            try:
+                yield stream.write(json_encode_bytes(response) + b'\n')
+            except StreamClosedError:
+                break
+        if client_id is not None:
+            # The connection is only closed if the process stopped or lost
+            # its connection. In the latter case it joins again when it has
+            # reconnected.
+            self.drop_client(client_id)
+
+    def handle_request(self, request):
+        op = request['op']
+        client_id = request['client']
+        channel_id = str(request.get('channel'))
+        channel = self.channels.get(channel_id)
+        if op == 'open':
+            if channel is None:
+                channel = {
+                    'version': request['version'],
+                    'diffs': deque(maxlen=self.history_length),
+                    'clients': set(),
+                    'participants': dict(),
+                    'next_session_id': 0
+                }
+                self.channels[channel_id] = channel
+            channel['clients'].add(client_id)
+            return {
+                'version': channel['version'],
+                'diffs': [
+                    diff for diff in channel['diffs']
+                    if diff['v'] >= request['version']
+                ]
+            }
+        if channel is None:
+            return {'error': 'unknown channel'}
+        if op == 'close':
+            channel['clients'].discard(client_id)
+            self.remove_participants(channel_id, client_id)
+            if len(channel['clients']) == 0:
+                del self.channels[channel_id]
+            return {}
+        elif op == 'submit':
+            if channel['version'] != request['version']:
+                return {'accepted': False, 'version': channel['version']}
+            channel['version'] += 1
+            channel['diffs'].append(request['message'])
+            self.publish(channel_id, client_id, {
+                'kind': 'diff',
+                'message': request['message'],
+                'user': request.get('user')
+            })
+            return {'accepted': True, 'version': channel['version']}
+        elif op == 'publish':
+            self.publish(channel_id, client_id, {
+                'kind': 'update',
+                'message': request['message'],
+                'sender': request.get('sender'),
+                'user': request.get('user')
+            })
+            return {}
+        elif op == 'join':
+            # A process that reconnects asks for the session ids its
+            # participants had before.
+            session_id = request.get('session_id')
+            if session_id is None or session_id in channel['participants']:
+                session_id = channel['next_session_id']
+            channel['next_session_id'] = max(
+                channel['next_session_id'],
+                session_id + 1
+            )
+            info = request.get('info')
+            if info is not None:
+                info['session_id'] = session_id
+            channel['participants'][session_id] = {
+                'client': client_id,
+                'info': info
+            }
+            if info is not None:
+                self.publish(channel_id, client_id, {
+                    'kind': 'join',
+                    'info': info
+                })
+            return {'session_id': session_id}
+        elif op == 'leave':
+            participant = channel['participants'].pop(
+                request['session_id'],
+                None
+            )
+            if participant is not None and participant['info'] is not None:
+                self.publish(channel_id, client_id, {
+                    'kind': 'leave',
+                    'session_id': request['session_id']
+                })
+            return {}
+        elif op == 'participants':
+            return {
+                'participants': [
+                    participant['info'] for session_id, participant in
+                    sorted(channel['participants'].items())
+                    if participant['info'] is not None
+                ]
+            }
+        return {'error': 'unknown operation'}
+
+    def remove_participants(self, channel_id, client_id):
+        channel = self.channels[channel_id]
+        session_ids = [
+            session_id for session_id, participant in
+            channel['participants'].items()
+            if participant['client'] == client_id
+        ]
+        for session_id in session_ids:
+            participant = channel['participants'].pop(session_id)
+            if participant['info'] is not None:
+                self.publish(channel_id, client_id, {
+                    'kind': 'leave',
+                    'session_id': session_id
+                })
+
+    def drop_client(self, client_id):
+        logger.debug('Session broker client %s gone' % client_id)
+        self.subscribers.pop(client_id, None)
+        for channel_id, channel in list(self.channels.items()):
+            if client_id not in channel['clients']:
+                continue
+            channel['clients'].discard(client_id)
+            self.remove_participants(channel_id, client_id)
+            if len(channel['clients']) == 0:
+                del self.channels[channel_id]
+
+    def publish(self, channel_id, origin, publication):
+        publication['channel'] = channel_id
+        data = json_encode_bytes(publication) + b'\n'
+        for client_id in self.channels[channel_id]['clients']:
+            if client_id == origin or client_id not in self.subscribers:
+                continue
+            stream = self.subscribers[client_id]
+            if stream.closed():
+                continue
+            stream.write(data)
+
+
+class SessionBrokerClient(object):
+    """
+    Connection of one server process to the session broker. Requests and the
+    publications of other processes travel over the same connection, so they
+    arrive in the order in which the broker handled them. Requests are sent
+    in the order in which they are made and return a future of the answer of
+    the broker, matched to the request by its id. Publications are handed to
+    `receive`.
+
+    If the connection is lost, it is opened again. The requests returned by
+    `registrations` are sent before any others, so that a broker that has
+    been restarted, or that has dropped this process, learns about the open
+    documents and their participants again.
+    """
+
+    def __init__(self, path, receive, registrations=None, timeout=5):
+        self.path = path
+        self.receive = receive
+        self.registrations = registrations
+        self.timeout = timeout
+        self.client_id = uuid.uuid4().hex
+        self.request_ids = count()
+        self.stream = None
+        self.connecting = False
+        self.connected = False
+        self.closed = False
+        self.queue = []
+        self.waiting = dict()
+        self.reconnect_delay = 0.1
+        self.reconnect_timeout = None
+
+    def prepare(self, op, kwargs):
+        request_id = next(self.request_ids)
+        kwargs['op'] = op
+        kwargs['client'] = self.client_id
+        kwargs['id'] = request_id
+        future = Future()
+        timeout = IOLoop.current().call_later(
+            self.timeout,
+            self.time_out,
+            request_id
+        )
+        self.waiting[request_id] = (future, timeout)
+        return future, json_encode_bytes(kwargs) + b'\n'
+
+    def request(self, op, **kwargs):
+        # Returns a future of the answer. It fails with a ConnectionError if
+        # the broker cannot be reached or does not answer in time.
+        future, data = self.prepare(op, kwargs)
+        if self.stream is None:
+            self.queue.append(data)
+            self.start_connecting()
+        else:
+            self.write(data)
+        return future
+
+    def send(self, op, **kwargs):
+        # Makes a request whose answer is not needed. Failures are logged.
+        IOLoop.current().add_future(
+            self.request(op, **kwargs),
+            self.check_answer
+        )
+
+    def check_answer(self, future):
+        try:
+            response = future.result()
+        except ConnectionError as error:
+            logger.warning('Session broker request failed: %s' % error)
+            return
+        if 'error' in response:
+            logger.debug('Session broker error: %s' % response['error'])
+
+    def write(self, data):
+        try:
+            self.stream.write(data)
+        except StreamClosedError:
+            self.lost()
+
+    def start_connecting(self):
+        if self.connecting:
+            return
+        self.connecting = True
+        IOLoop.current().spawn_callback(self.connect)
+
+    async def connect(self):
+        stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+        try:
+            await gen.with_timeout(
+                timedelta(seconds=self.timeout),
+                stream.connect(self.path)
+            )
+        except (OSError, StreamClosedError, gen.TimeoutError):
+            stream.close()
+            self.connecting = False
+            self.fail('Cannot connect to session broker.')
+            self.schedule_reconnect()
+            return
+        if self.connected:
+            logger.info('Reconnected to session broker.')
+        self.connected = True
+        self.connecting = False
+        self.closed = False
+        self.reconnect_delay = 0.1
+        self.stream = stream
+        IOLoop.current().spawn_callback(self.listen, stream)
+        self.write(self.prepare('subscribe', {})[1])
+        if self.registrations is not None:
+            for op, kwargs, callback in self.registrations():
+                future, data = self.prepare(op, kwargs)
+                IOLoop.current().add_future(
+                    future,
+                    partial(self.registered, callback)
+                )
+                self.write(data)
+        queue = self.queue
+        self.queue = []
+        for data in queue:
+            self.write(data)
+
+    def registered(self, callback, future):
+        try:
+            response = future.result()
+        except ConnectionError as error:
+            logger.warning('Session broker registration failed: %s' % error)
+            return
+        if 'error' in response:
+            logger.error(
+                'Session broker registration failed: %s' % response['error']
+            )
+        elif callback is not None:
+            callback(response)
+
+    async def listen(self, stream):
+        while True:
+            try:
+                line = await stream.read_until(b'\n')
+            except StreamClosedError:
+                break
+            message = json_decode(line)
+            if 'id' in message:
+                request_id = message.pop('id')
+                if request_id not in self.waiting:
+                    continue
+                future, timeout = self.waiting.pop(request_id)
+                IOLoop.current().remove_timeout(timeout)
+                future.set_result(message)
+            else:
+                # Publications are handled after the coroutines that
+                # waited for the answers that came before them.
+                IOLoop.current().add_callback(self.deliver, message)
+        if stream is self.stream:
+            logger.error('Lost connection to session broker.')
+            self.lost()
+
+    def deliver(self, message):
+        try:
+            self.receive(message)
+        except Exception:
+            logger.exception('Cannot handle session broker message.')
+
+    def time_out(self, request_id):
+        future, timeout = self.waiting.pop(request_id)
+        future.set_exception(
+            ConnectionError('Session broker did not answer in time.')
+        )
+        # Later answers would be out of step with the state of this process,
+        # so the connection is started afresh.
+        if self.stream is not None:
+            logger.error('Session broker did not answer in time.')
+            self.lost()
+
+    def fail(self, reason):
+        self.queue = []
+        waiting = self.waiting
+        self.waiting = dict()
+        for future, timeout in waiting.values():
+            IOLoop.current().remove_timeout(timeout)
+            future.set_exception(ConnectionError(reason))
+            # Not every request is waited for.
+            future.exception()
+
+    def lost(self):
+        stream = self.stream
+        self.stream = None
+        if stream is not None:
+            stream.close()
+        self.fail('Lost connection to session broker.')
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        if self.closed or self.reconnect_timeout is not None:
+            return
+        self.reconnect_timeout = IOLoop.current().call_later(
+            self.reconnect_delay,
+            self.reconnect
+        )
+        self.reconnect_delay = min(self.reconnect_delay * 2, self.timeout)
+
+    def reconnect(self):
+        self.reconnect_timeout = None
+        if self.stream is None:
+            self.start_connecting()
+
+    def close(self):
+        # Closes the connection without reconnecting. The next request opens
+        # it again.
+        self.closed = True
+        if self.reconnect_timeout is not None:
+            IOLoop.current().remove_timeout(self.reconnect_timeout)
+            self.reconnect_timeout = None
+        stream = self.stream
+        self.stream = None
+        if stream is not None:
+            stream.close()
+        self.fail('Connection to session broker closed.')
+
+
+def make_broker_server(path, history_length=1000):
+    if os.path.exists(path):
+        os.remove(path)
+    broker = SessionBroker(history_length=history_length)
+    broker.add_socket(bind_unix_socket(path))
+    return broker
+
+
+def run(path, history_length=1000):
+    make_broker_server(path, history_length)
+    IOLoop.current().start()
@@ -6,13 +6,22 @@ from django.core.wsgi import get_wsgi_application
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 from tornado.web import Application, FallbackHandler, StaticFileHandler
-from tornado.wsgi import WSGIContainer
 
 from base.handlers import DjangoStaticFilesHandler, HelloHandler, RobotsHandler
+from base.servers import workers as worker_processes
+from base.servers.wsgi import StreamingWSGIContainer, ThreadedWSGIContainer
 
 
-def make_tornado_server():
-    wsgi_app = WSGIContainer(get_wsgi_application())
+def make_tornado_server(workers=None):
+    # workers: the Workers if this is one of several server processes.
+    if settings.WSGI_THREADS:
+        wsgi_app = ThreadedWSGIContainer(
+            get_wsgi_application(),
+            settings.WSGI_THREADS,
+            settings.WSGI_MAX_QUEUED
+        )
+    else:
+        wsgi_app = StreamingWSGIContainer(get_wsgi_application())
     tornado_url_list = [
         (r'/static/(.*)', DjangoStaticFilesHandler, {'default_filename':
                                                      'none.img'}),
@@ -38,15 +47,22 @@ def make_tornado_server():
         except ImportError:
             pass
         else:
-            tornado_url_list += [
-                ('/ws/%s/([^?]*)' % app_name, ws_module.WebSocket)
-            ]
+            path = '/ws/%s/([^?]*)' % app_name
+            if workers is not None and hasattr(
+                ws_module.WebSocket,
+                'get_affinity'
+            ):
+                tornado_url_list += workers.routes(path, ws_module.WebSocket)
+            else:
+                tornado_url_list += [(path, ws_module.WebSocket)]
     tornado_url_list += [
         ('.*', FallbackHandler, dict(fallback=wsgi_app))
     ]
     tornado_app = Application(
         tornado_url_list,
         debug=settings.DEBUG,
+        # Reloading is not possible with several processes.
+        autoreload=settings.DEBUG and workers is None,
         websocket_ping_interval=settings.WEBSOCKET_PING_INTERVAL,
         compress_response=True
     )
@@ -55,6 +71,9 @@ def make_tornado_server():
     return server
 
 
-def run(port):
+def run(port, workers=1):
+    if workers > 1:
+        worker_processes.run(port, workers, make_tornado_server)
+        return
     make_tornado_server().listen(int(port))
     IOLoop.current().start()
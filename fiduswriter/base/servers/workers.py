@@ -0,0 +1,184 @@
+import asyncio
+import logging
+
+from django.db import connections
+from tornado.escape import url_unescape
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+from tornado.routing import PathMatches, Rule
+from tornado.websocket import (
+    WebSocketClosedError,
+    WebSocketHandler,
+    websocket_connect
+)
+
+from base.servers.invalidation import InvalidationChannel, \
+    bind_invalidation_socket
+from base.ws_handler import origin_matches_host
+
+logger = logging.getLogger(__name__)
+
+# Headers of the websocket handshake that are set anew when the connection is
+# forwarded.
+HANDSHAKE_HEADERS = [
+    'Connection',
+    'Upgrade',
+    'Sec-Websocket-Key',
+    'Sec-Websocket-Version',
+    'Sec-Websocket-Extensions'
+]
+
+
+class Workers(object):
+    """
+    The server processes started by `run`. Each of them also listens on a
+    port of its own on localhost. Websocket connections with an affinity, such
+    as those to a document, are handled by the worker that is chosen by the
+    affinity, so that all of them share the state in its memory. If such a
+    connection reaches another worker, it is forwarded to that port. The
+    caches in memory are cleared in all workers (see
+    base.servers.invalidation).
+    """
+
+    def __init__(self, ports, index):
+        self.ports = ports
+        self.index = index
+
+    def get_worker(self, affinity):
+        return affinity % len(self.ports)
+
+    def routes(self, path, handler):
+        return [
+            Rule(AffinityMatches(path, handler.get_affinity, self), handler),
+            (path, WebSocketForwarder, {
+                'get_affinity': handler.get_affinity,
+                'workers': self
+            })
+        ]
+
+
+class AffinityMatches(PathMatches):
+    # Matches the requests to the path that are handled by this worker.
+
+    def __init__(self, path_pattern, get_affinity, workers):
+        super().__init__(path_pattern)
+        self.get_affinity = get_affinity
+        self.workers = workers
+
+    def match(self, request):
+        result = super().match(request)
+        if result is None:
+            return None
+        try:
+            affinity = self.get_affinity(*[
+                url_unescape(arg, plus=False) for arg in result['path_args']
+            ])
+        except ValueError:
+            # The handler rejects the connection.
+            return result
+        if self.workers.get_worker(affinity) != self.workers.index:
+            return None
+        return result
+
+
+class WebSocketForwarder(WebSocketHandler):
+    # Relays the messages of a websocket connection to and from the worker
+    # that handles it.
+
+    def initialize(self, get_affinity, workers):
+        self.get_affinity = get_affinity
+        self.workers = workers
+        self.upstream = None
+
+    def check_origin(self, origin):
+        return origin_matches_host(origin, self.request.headers.get('Host'))
+
+    async def open(self, *args):
+        port = self.workers.ports[
+            self.workers.get_worker(self.get_affinity(*args))
+        ]
+        headers = self.request.headers.copy()
+        for header in HANDSHAKE_HEADERS:
+            headers.pop(header, None)
+        headers['X-Real-Ip'] = self.request.remote_ip
+        try:
+            self.upstream = await websocket_connect(
+                HTTPRequest(
+                    'ws://127.0.0.1:%d%s' % (port, self.request.uri),
+                    headers=headers
+                ),
+                on_message_callback=self.on_upstream_message
+            )
+        except Exception:
+            logger.exception('Cannot forward websocket to port %d.' % port)
+            self.close()
+            return
+        if self.ws_connection is None:
+            # The client has gone away in the meantime.
+            self.upstream.close()
+
+    def on_upstream_message(self, message):
+        if message is None:
+            if self.upstream is None:
+                self.close()
+            else:
+                self.close(
+                    self.upstream.close_code,
+                    self.upstream.close_reason
+                )
+            return
+        try:
+            self.write_message(message, isinstance(message, bytes))
+        except (WebSocketClosedError, StreamClosedError):
+            pass
+
+    def on_message(self, message):
+        try:
+            self.upstream.write_message(message, isinstance(message, bytes))
+        except (WebSocketClosedError, StreamClosedError):
+            pass
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+def run(port, workers, make_server):
+    # Forks the workers, which share the listening socket. make_server
+    # returns the server of a worker given the Workers.
+    sockets = bind_sockets(int(port))
+    worker_sockets = [
+        bind_sockets(0, '127.0.0.1') for index in range(workers)
+    ]
+    ports = [
+        own_sockets[0].getsockname()[1] for own_sockets in worker_sockets
+    ]
+    invalidation_sockets = [
+        bind_invalidation_socket() for index in range(workers)
+    ]
+    # Database connections cannot be shared between processes.
+    connections.close_all()
+    index = fork_processes(workers)
+    # The event loop of the parent may have been used already.
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    for other_index, own_sockets in enumerate(worker_sockets):
+        if other_index != index:
+            for own_socket in own_sockets:
+                own_socket.close()
+    InvalidationChannel(
+        [
+            invalidation_socket.getsockname()[1]
+            for invalidation_socket in invalidation_sockets
+        ],
+        index,
+        invalidation_sockets[index]
+    ).listen()
+    for other_index, invalidation_socket in enumerate(invalidation_sockets):
+        if other_index != index:
+            invalidation_socket.close()
+    server = make_server(Workers(ports, index))
+    server.add_sockets(sockets + worker_sockets[index])
+    IOLoop.current().start()
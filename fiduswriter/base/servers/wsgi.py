@@ -0,0 +1,265 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain
+
+import tornado
+from tornado import escape, httputil
+from tornado.concurrent import chain_future, is_future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Semaphore
+from tornado.wsgi import WSGIContainer
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingWSGIContainer(WSGIContainer):
+    """
+    Runs the Django WSGI application on the tornado server like tornado's
+    WSGIContainer, which collects the whole response body before sending it.
+    The body of streaming responses (StreamingHttpResponse) is instead sent
+    in chunks as it is produced, so that it never needs to be held in memory
+    as a whole.
+    """
+
+    def __call__(self, request):
+        data = {}
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = headers
+            return response.append
+
+        app_response = self.wsgi_application(
+            WSGIContainer.environ(request), start_response
+        )
+        streaming = False
+        try:
+            if not data:
+                raise Exception("WSGI app did not call start_response")
+            if getattr(app_response, 'streaming', False):
+                # The response is closed by stream.
+                streaming = True
+                IOLoop.current().spawn_callback(
+                    self.stream,
+                    request,
+                    data,
+                    response,
+                    app_response
+                )
+                return
+            response.extend(app_response)
+            body = b"".join(response)
+        finally:
+            if not streaming and hasattr(app_response, "close"):
+                app_response.close()
+        self.write_response(request, data, body)
+
+    def write_response(self, request, data, body):
+        status_code, reason, headers = self.get_headers(data)
+        body = escape.utf8(body)
+        header_set = set(key.lower() for key in headers)
+        if status_code != 304:
+            if "content-length" not in header_set:
+                headers.add("Content-Length", str(len(body)))
+            if "content-type" not in header_set:
+                headers.add("Content-Type", "text/html; charset=UTF-8")
+        request.connection.write_headers(
+            httputil.ResponseStartLine("HTTP/1.1", status_code, reason),
+            headers,
+            chunk=body
+        )
+        request.connection.finish()
+        self._log(status_code, request)
+
+    async def stream(self, request, data, response, app_response):
+        # Without a Content-Length, the body is sent with chunked transfer
+        # encoding. Each chunk is only produced once the previous one has
+        # been written, so a slow client slows down the response instead of
+        # filling the write buffer.
+        status_code, reason, headers = self.get_headers(data)
+        try:
+            await request.connection.write_headers(
+                httputil.ResponseStartLine("HTTP/1.1", status_code, reason),
+                headers
+            )
+            for chunk in chain(response, app_response):
+                await request.connection.write(escape.utf8(chunk))
+        except StreamClosedError:
+            logger.debug('Client closed the connection.')
+            return
+        except Exception:
+            logger.exception('Cannot stream response.')
+            self.abort(request, True)
+            return
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+        request.connection.finish()
+        self._log(status_code, request)
+
+    def abort(self, request, headers_sent):
+        # Answers a request that has failed with 500 Internal Server Error.
+        # If the response has been started already, the connection is closed
+        # instead, so that the client does not take the part it has received
+        # for the whole response.
+        if not headers_sent:
+            try:
+                self.write_response(
+                    request,
+                    {'status': '500 Internal Server Error', 'headers': []},
+                    b''
+                )
+                return
+            except Exception:
+                logger.exception('Cannot send error response.')
+        request.connection.close()
+
+    def get_headers(self, data):
+        status_code, reason = data["status"].split(" ", 1)
+        headers = httputil.HTTPHeaders()
+        for key, value in data["headers"]:
+            headers.add(key, value)
+        if "Server" not in headers:
+            headers.add("Server", "TornadoServer/%s" % tornado.version)
+        return int(status_code), reason, headers
+
+
+class ThreadedWSGIContainer(StreamingWSGIContainer):
+    """
+    Runs the WSGI application in a pool of threads, so that slow requests do
+    not hold up the IOLoop and with it the websocket connections. At most
+    `threads` requests are handled at the same time. Further requests wait
+    on the IOLoop. If `max_queued` requests are waiting already, new requests
+    are answered with 503 Service Unavailable.
+    """
+
+    def __init__(self, wsgi_application, threads, max_queued=None):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix='wsgi'
+        )
+        self.slots = Semaphore(threads)
+        self.max_queued = max_queued
+        self.queued = 0
+
+    def __call__(self, request):
+        IOLoop.current().spawn_callback(self.handle, request)
+
+    async def handle(self, request):
+        if self.max_queued is not None and self.queued >= self.max_queued:
+            self.write_response(
+                request,
+                {'status': '503 Service Unavailable', 'headers': []},
+                b''
+            )
+            return
+        self.queued += 1
+        await self.slots.acquire()
+        self.queued -= 1
+        loop = IOLoop.current()
+        # Whether the response has been started.
+        state = {'headers_sent': False}
+        try:
+            result = await loop.run_in_executor(
+                self.executor,
+                self.run,
+                request,
+                loop,
+                state
+            )
+            if result is not None:
+                state['headers_sent'] = True
+                self.write_response(request, *result)
+        except StreamClosedError:
+            logger.debug('Client closed the connection.')
+        except Exception:
+            logger.exception('Cannot handle request.')
+            self.abort(request, state['headers_sent'])
+        finally:
+            self.slots.release()
+
+    def run(self, request, loop, state):
+        # Runs in a thread of the pool. Everything that touches the
+        # connection is handed to the IOLoop. Returns the status and headers
+        # and the body of the response, unless it has been streamed.
+        data = {}
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            data["status"] = status
+            data["headers"] = headers
+            return response.append
+
+        app_response = self.wsgi_application(
+            WSGIContainer.environ(request), start_response
+        )
+        try:
+            if not data:
+                raise Exception("WSGI app did not call start_response")
+            if getattr(app_response, 'streaming', False):
+                self.stream_from_thread(
+                    loop,
+                    request,
+                    data,
+                    response,
+                    app_response,
+                    state
+                )
+                return None
+            response.extend(app_response)
+            body = b"".join(response)
+        finally:
+            if hasattr(app_response, "close"):
+                app_response.close()
+        return data, body
+
+    def stream_from_thread(
+        self,
+        loop,
+        request,
+        data,
+        response,
+        app_response,
+        state
+    ):
+        # Each chunk is only produced once the previous one has been written,
+        # so a slow client slows down the response instead of filling the
+        # write buffer.
+        status_code, reason, headers = self.get_headers(data)
+        state['headers_sent'] = True
+        self.call_on_loop(
+            loop,
+            request.connection.write_headers,
+            httputil.ResponseStartLine("HTTP/1.1", status_code, reason),
+            headers
+        )
+        for chunk in chain(response, app_response):
+            self.call_on_loop(
+                loop,
+                request.connection.write,
+                escape.utf8(chunk)
+            )
+        self.call_on_loop(loop, request.connection.finish)
+        self._log(status_code, request)
+
+    def call_on_loop(self, loop, callback, *args):
+        # Runs the callback on the IOLoop and waits for it and the future it
+        # may return.
+        future = Future()
+
+        def call():
+            try:
+                result = callback(*args)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if is_future(result):
+                chain_future(result, future)
+            else:
+                future.set_result(result)
+
+        loop.add_callback(call)
+        return future.result()
@@ -7,7 +7,7 @@ export class WebSocketConnector {
         anythingToSend = () => false, // required argument
         messagesElement = () => false, // element in which to show connection messages
         initialMessage = () => ({type: 'subscribe'}),
-        resubScribed = () => {}, // Cleanup when the client connects a second or subsequent time
+        resubScribed = _resumed => {}, // Cleanup when the client connects a second or subsequent time
         restartMessage = () => ({type: 'restart'}), // Too many messages have been lost and we need to restart
         warningNotAllSent = gettext('Warning! Some data is unsaved'), // Info to show while disconnected WITH unsaved data
         infoDisconnected = gettext('Disconnected. Attempting to reconnect...'), // Info to show while disconnected WITHOUT unsaved data
@@ -36,6 +36,10 @@ export class WebSocketConnector {
         /* 1 = first connection established, etc. */
         this.connectionCount = 0
         this.recentlySent = false
+        /* Token with which the server lets the client resume the current connection */
+        this.resumeToken = false
+        /* The token and the number of the last server message of the last connection */
+        this.resumeFrom = false
     }
 
     init() {
@@ -120,6 +124,13 @@ export class WebSocketConnector {
 
         this.ws.onclose = () => {
             this.connected = false
+            if (this.resumeToken) {
+                this.resumeFrom = {
+                    token: this.resumeToken,
+                    s: this.messages.server
+                }
+                this.resumeToken = false
+            }
             window.setTimeout(() => {
                 this.createWSConnection()
             }, 2000)
@@ -157,9 +168,11 @@ export class WebSocketConnector {
         this.send(() => (message))
     }
 
-    subscribed() {
+    subscribed(data) {
+        this.resumeToken = data.resume
+        this.resumeFrom = false
         if (this.connectionCount > 1) {
-            this.resubScribed()
+            this.resubScribed(data.resumed)
             while (this.oldMessages.length > 0) {
                 this.send(this.oldMessages.shift())
             }
@@ -221,7 +234,7 @@ export class WebSocketConnector {
                 this.open()
                 break
             case 'subscribed':
-                this.subscribed()
+                this.subscribed(data)
                 break
             case 'access_denied':
                 window.location.href = '/'
@@ -0,0 +1,100 @@
+import base64
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from base.auth_cache import auth_cache
+from base.django_handler_mixin import DjangoHandlerMixin
+
+
+class Handler(DjangoHandlerMixin):
+    # The parts of a websocket handler that authentication looks at.
+
+    def __init__(self, headers=None, cookies=None):
+        self.request = SimpleNamespace(headers=headers or {})
+        self.cookies = cookies or {}
+
+    def get_cookie(self, name):
+        return self.cookies.get(name)
+
+
+def basic_auth(username, password):
+    return {
+        'Authorization': 'Basic %s' % base64.b64encode(
+            ('%s:%s' % (username, password)).encode()
+        ).decode()
+    }
+
+
+class AuthCacheTest(TestCase):
+
+    def setUp(self):
+        auth_cache.clear()
+        self.user = User.objects.create_user(
+            username='Writer',
+            password='secret'
+        )
+
+    def tearDown(self):
+        auth_cache.clear()
+
+    def test_basic_auth_burst(self):
+        with patch(
+            'base.django_handler_mixin.auth.authenticate',
+            wraps=auth.authenticate
+        ) as authenticate:
+            # Many clients reconnect at once.
+            for number in range(20):
+                handler = Handler(basic_auth('Writer', 'secret'))
+                self.assertEqual(handler.get_current_user(), self.user)
+                self.assertIsNone(
+                    Handler(basic_auth('Writer', 'wrong')).get_current_user()
+                )
+            # The right password has only been checked once. Failed logins
+            # are checked each time.
+            self.assertEqual(authenticate.call_count, 21)
+            # A new password takes effect immediately, also if it has been
+            # tried before.
+            self.assertIsNone(
+                Handler(basic_auth('Writer', 'new')).get_current_user()
+            )
+            self.user.set_password('new')
+            self.user.save()
+            self.assertIsNone(
+                Handler(basic_auth('Writer', 'secret')).get_current_user()
+            )
+            self.assertEqual(
+                Handler(basic_auth('Writer', 'new')).get_current_user(),
+                self.user
+            )
+            self.assertEqual(authenticate.call_count, 24)
+
+    def test_session(self):
+        self.client.force_login(self.user)
+        cookies = {
+            settings.SESSION_COOKIE_NAME:
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        }
+        handler = Handler(cookies=cookies)
+        self.assertEqual(handler.get_current_user(), self.user)
+        with self.assertNumQueries(0):
+            for number in range(20):
+                self.assertEqual(
+                    Handler(cookies=cookies).get_current_user(),
+                    self.user
+                )
+        self.client.logout()
+        self.assertIsNone(Handler(cookies=cookies).get_current_user())
+
+    def test_size(self):
+        with self.settings(WS_AUTH_CACHE_SIZE=2):
+            for number in range(3):
+                auth_cache.set(('session', str(number)), self.user)
+        self.assertEqual(
+            list(auth_cache.entries),
+            [('session', '1'), ('session', '2')]
+        )
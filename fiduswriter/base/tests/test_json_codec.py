@@ -0,0 +1,55 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import skipIf
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse as DjangoJsonResponse
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+
+from base.json_codec import JsonResponse, get_codec, orjson
+
+DATA = {
+    'title': 'Caf\xe9 </script>',
+    'added': datetime.datetime(2020, 1, 2, 3, 4, 5, 678901),
+    'version': Decimal('3.1'),
+    'label': gettext_lazy('Title'),
+    'content': [{'type': 'paragraph', 'attrs': {'level': 1}}, None, True]
+}
+
+
+class JsonCodecTest(SimpleTestCase):
+
+    def check_codec(self, codec):
+        # The values are encoded as by Django's JsonResponse.
+        expected = json.loads(DjangoJsonResponse(DATA).content)
+        self.assertEqual(codec.decode(codec.encode(DATA)), expected)
+        self.assertEqual(codec.decode(codec.encode_bytes(DATA)), expected)
+        self.assertEqual(codec.decode(codec.encode({1: 'a'})), {'1': 'a'})
+
+    def test_standard(self):
+        self.check_codec(get_codec('json'))
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson(self):
+        self.check_codec(get_codec('orjson'))
+
+    def test_unknown(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_codec('yaml')
+
+    def test_response(self):
+        response = JsonResponse(DATA, status=201)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(
+            json.loads(response.content),
+            json.loads(DjangoJsonResponse(DATA).content)
+        )
+        with self.assertRaises(TypeError):
+            JsonResponse([])
+        self.assertEqual(
+            json.loads(JsonResponse([1], safe=False).content),
+            [1]
+        )
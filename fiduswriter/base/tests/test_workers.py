@@ -0,0 +1,145 @@
+from tornado.escape import json_decode, json_encode
+from tornado.gen import sleep
+from tornado.httpclient import HTTPClientError, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, \
+    bind_unused_port, gen_test
+from tornado.web import Application
+from tornado.websocket import WebSocketHandler, websocket_connect
+
+from base.servers.invalidation import InvalidationChannel, \
+    bind_invalidation_socket, invalidation
+from base.servers.workers import Workers
+
+invalidated = []
+
+
+@invalidation
+def record_invalidation(key):
+    invalidated.append(key)
+
+
+def make_handler(index):
+
+    class DocumentHandler(WebSocketHandler):
+        # Tells which worker handles the connection.
+
+        @staticmethod
+        def get_affinity(arg):
+            return int(arg.split('/')[0])
+
+        def check_origin(self, origin):
+            return True
+
+        def on_message(self, data):
+            if data == 'close':
+                self.close()
+                return
+            self.write_message(json_encode({
+                'worker': index,
+                'message': data,
+                'cookie': self.request.headers.get('Cookie'),
+                'ip': self.request.remote_ip
+            }))
+
+    return DocumentHandler
+
+
+class WorkersTest(AsyncHTTPTestCase):
+    """
+    Two workers in one process. Document connections reaching the wrong
+    worker are forwarded.
+    """
+
+    def get_app(self):
+        sock, port = bind_unused_port()
+        ports = [self.get_http_port(), port]
+        self.other_server = HTTPServer(self.make_app(Workers(ports, 1)))
+        self.other_server.add_sockets([sock])
+        return self.make_app(Workers(ports, 0))
+
+    def make_app(self, workers):
+        return Application(workers.routes(
+            '/ws/document/([^?]*)',
+            make_handler(workers.index)
+        ))
+
+    def tearDown(self):
+        self.other_server.stop()
+        super().tearDown()
+
+    def connect(self, document_id, origin='http://127.0.0.1'):
+        return websocket_connect(HTTPRequest(
+            'ws://127.0.0.1:%d/ws/document/%d/' % (
+                self.get_http_port(),
+                document_id
+            ),
+            headers={'Cookie': 'sessionid=abc', 'Origin': origin}
+        ))
+
+    async def ask(self, connection, data):
+        connection.write_message(data)
+        return json_decode(await connection.read_message())
+
+    @gen_test
+    async def test_affinity(self):
+        for document_id in range(4):
+            connection = await self.connect(document_id)
+            for number in range(3):
+                response = await self.ask(connection, str(number))
+                self.assertEqual(response['worker'], document_id % 2)
+                self.assertEqual(response['message'], str(number))
+                self.assertEqual(response['cookie'], 'sessionid=abc')
+                self.assertEqual(response['ip'], '127.0.0.1')
+            connection.close()
+
+    @gen_test
+    async def test_close(self):
+        connection = await self.connect(1)
+        connection.write_message('close')
+        self.assertIsNone(await connection.read_message())
+
+    @gen_test
+    async def test_origin(self):
+        # The connection is only forwarded if its origin is the host,
+        # whatever the port.
+        connection = await self.connect(1, 'http://127.0.0.1:8000')
+        response = await self.ask(connection, 'origin')
+        self.assertEqual(response['worker'], 1)
+        connection.close()
+        with self.assertRaises(HTTPClientError) as context:
+            await self.connect(1, 'http://example.com')
+        self.assertEqual(context.exception.code, 403)
+
+
+class InvalidationTest(AsyncTestCase):
+    """
+    Caches are cleared in all workers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        sockets = [bind_invalidation_socket() for index in range(2)]
+        ports = [sock.getsockname()[1] for sock in sockets]
+        self.channels = [
+            InvalidationChannel(ports, index, sock)
+            for index, sock in enumerate(sockets)
+        ]
+        # The channel listening last is the one of this worker.
+        self.channels[1].listen()
+        self.channels[0].listen()
+        del invalidated[:]
+
+    def tearDown(self):
+        for channel in self.channels:
+            channel.stop()
+            channel.socket.close()
+        super().tearDown()
+
+    @gen_test
+    async def test_broadcast(self):
+        record_invalidation('owner')
+        self.assertEqual(invalidated, ['owner'])
+        await sleep(0.05)
+        # The other worker has received it as well.
+        self.assertEqual(invalidated, ['owner', 'owner'])
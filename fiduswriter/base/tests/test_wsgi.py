@@ -0,0 +1,232 @@
+import threading
+import time
+
+from tornado.escape import json_decode, json_encode
+from tornado.httpclient import AsyncHTTPClient
+from tornado.gen import multi, sleep
+from tornado.simple_httpclient import HTTPStreamClosedError
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, FallbackHandler
+from tornado.websocket import WebSocketHandler, websocket_connect
+
+from base.servers.wsgi import StreamingWSGIContainer, ThreadedWSGIContainer
+
+
+class SlowApp(object):
+    """
+    A slow Django view. It counts the requests it has started and finished.
+    Once release is set to an Event, requests wait for it instead.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.finished = 0
+        self.release = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.started += 1
+        if self.release is None:
+            time.sleep(0.3)
+        else:
+            self.release.wait(10)
+        with self.lock:
+            self.finished += 1
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'done']
+
+
+class DiffHandler(WebSocketHandler):
+
+    def on_message(self, data):
+        message = json_decode(data)
+        self.write_message(json_encode({
+            'type': 'confirm_diff',
+            'rid': message['rid']
+        }))
+
+
+class WSGIContainerLatencyTest(AsyncHTTPTestCase):
+    """
+    Websocket diffs are confirmed while slow HTTP requests are handled.
+    """
+    threads = 4
+
+    def get_app(self):
+        self.app = SlowApp()
+        if self.threads:
+            self.container = ThreadedWSGIContainer(self.app, self.threads, 2)
+        else:
+            self.container = StreamingWSGIContainer(self.app)
+        return Application([
+            ('/ws/', DiffHandler),
+            ('.*', FallbackHandler, dict(fallback=self.container))
+        ])
+
+    def connect(self):
+        return websocket_connect(
+            'ws://127.0.0.1:%d/ws/' % self.get_http_port()
+        )
+
+    def get(self, path):
+        return AsyncHTTPClient().fetch(
+            self.get_url(path),
+            raise_error=False
+        )
+
+    async def wait_for(self, condition):
+        while not condition():
+            await sleep(0.01)
+
+    @gen_test(timeout=10)
+    async def test_latency(self):
+        self.app.release = threading.Event()
+        connection = await self.connect()
+        requests = [self.get('/%d' % number) for number in range(6)]
+        await self.wait_for(lambda: self.app.started == self.threads)
+        # All threads are busy with requests, but diffs are still confirmed.
+        for rid in range(15):
+            connection.write_message(json_encode({'type': 'diff', 'rid': rid}))
+            await connection.read_message()
+        self.assertEqual(self.app.finished, 0)
+        connection.close()
+        self.app.release.set()
+        responses = await multi(requests)
+        self.assertEqual(
+            [response.code for response in responses],
+            [200] * 6
+        )
+
+    @gen_test(timeout=10)
+    async def test_queue_limit(self):
+        # Four requests are handled at once and two are queued. Further
+        # requests are turned away.
+        self.app.release = threading.Event()
+        requests = [self.get('/%d' % number) for number in range(8)]
+        await self.wait_for(
+            lambda: len([request for request in requests if request.done()])
+            == 2
+        )
+        self.app.release.set()
+        responses = await multi(requests)
+        self.assertEqual(
+            sorted(response.code for response in responses),
+            [200] * 6 + [503] * 2
+        )
+
+
+class BlockingWSGIContainerLatencyTest(AsyncHTTPTestCase):
+    """
+    Without threads, the diffs wait for the HTTP requests.
+    """
+
+    get_app = WSGIContainerLatencyTest.get_app
+    connect = WSGIContainerLatencyTest.connect
+    get = WSGIContainerLatencyTest.get
+    threads = 0
+
+    @gen_test(timeout=10)
+    async def test_latency(self):
+        connection = await self.connect()
+        requests = [self.get('/%d' % number) for number in range(2)]
+        # Diffs are sent until the requests are done. The client runs on the
+        # same IOLoop as the server, so the requests are handled while it
+        # waits for confirmations, but it never runs during a request.
+        held_up = 0
+        rid = 0
+        while self.app.finished < 2:
+            finished = self.app.finished
+            connection.write_message(json_encode({'type': 'diff', 'rid': rid}))
+            await connection.read_message()
+            self.assertEqual(self.app.started, self.app.finished)
+            if self.app.finished > finished:
+                held_up += 1
+            rid += 1
+        self.assertGreater(held_up, 0)
+        connection.close()
+        await multi(requests)
+
+
+class StreamingResponse(object):
+    # Stands in for the response of a StreamingHttpResponse.
+    streaming = True
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingTest(AsyncHTTPTestCase):
+    """
+    Streamed responses are written chunk by chunk.
+    """
+    threads = 0
+
+    def get_app(self):
+        self.responses = []
+
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            response = StreamingResponse(
+                b'%06d\n' % number for number in range(20000)
+            )
+            self.responses.append(response)
+            return response
+
+        if self.threads:
+            container = ThreadedWSGIContainer(streaming_app, self.threads)
+        else:
+            container = StreamingWSGIContainer(streaming_app)
+        return Application([('.*', FallbackHandler, dict(fallback=container))])
+
+    def test_stream(self):
+        response = self.fetch('/')
+        self.assertEqual(response.code, 200)
+        lines = response.body.splitlines()
+        self.assertEqual(len(lines), 20000)
+        self.assertEqual(lines[-1], b'019999')
+        self.assertTrue(self.responses[0].closed)
+
+
+class ThreadedStreamingTest(StreamingTest):
+    threads = 2
+
+
+def failing_app(environ, start_response):
+    if environ['PATH_INFO'] == '/early':
+        # Fails before the response has been started.
+        return []
+
+    def chunks():
+        yield b'part'
+        raise ValueError('Broken')
+
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return StreamingResponse(chunks())
+
+
+class FailingResponseTest(AsyncHTTPTestCase):
+    """
+    A failed request is answered with 500 Internal Server Error or, if its
+    response has been started, the connection is closed.
+    """
+
+    def get_app(self):
+        container = ThreadedWSGIContainer(failing_app, 2)
+        return Application([('.*', FallbackHandler, dict(fallback=container))])
+
+    def test_failures(self):
+        with self.assertLogs('base.servers.wsgi', 'ERROR'):
+            response = self.fetch('/early')
+        self.assertEqual(response.code, 500)
+        # The body is incomplete.
+        with self.assertLogs('base.servers.wsgi', 'ERROR'):
+            with self.assertRaises(HTTPStreamClosedError):
+                self.fetch('/late')
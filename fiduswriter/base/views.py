@@ -2,7 +2,8 @@ from django.shortcuts import render
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.sites.shortcuts import get_current_site
 from django.contrib.flatpages.models import FlatPage
-from django.http import JsonResponse
+
+from .json_codec import JsonResponse
 
 
 @ensure_csrf_cookie
@@ -1,32 +1,91 @@
+from collections import OrderedDict
+from itertools import count
 from urllib.parse import urlparse
 from tornado.websocket import WebSocketHandler
 from tornado.websocket import WebSocketClosedError
 from tornado.iostream import StreamClosedError
 import tornado
+from django.conf import settings
 from django.db import connection
 import logging
 from logging import info, debug
 from tornado.ioloop import IOLoop
-from tornado.escape import json_decode
 
+from .db_executor import run_in_db_thread
+from .json_codec import json_decode, json_encode
 from .django_handler_mixin import DjangoHandlerMixin
 
 logger = logging.getLogger(__name__)
 
 
+def origin_matches_host(origin, host):
+    # Whether the origin of a websocket connection is the host it connects to,
+    # excluding ports.
+    origin = urlparse(origin).netloc
+    # remove port if present
+    origin = origin.split(':')[0].lower()
+    # remove port if present
+    host = host.split(':')[0]
+    return origin == host
+
+
+def encode_message(message):
+    # Encodes a message that is sent to several connections once. The message
+    # counters of the connections are added by send_message.
+    return json_encode({
+        key: value for key, value in message.items() if key not in ['c', 's']
+    })
+
+
+def resend_entry(message, encoded):
+    # The entry of a sent message in the list of recent messages. Documents
+    # and other large messages are not kept, only their type. A client that
+    # has missed one is sent the whole document anew.
+    if (
+        message['type'] == 'doc_data' or
+        len(encoded) > settings.WS_RESEND_MESSAGE_BYTES
+    ):
+        return ({'type': message['type']}, None)
+    return (message, encoded)
+
+
+def messages_since(messages, from_no):
+    # Returns the recently sent messages that follow the server message
+    # number from_no or None if they are no longer all kept. The messages
+    # that have not been kept have None for their encoding.
+    to_send = messages['server'] - from_no
+    if to_send < 0 or to_send > len(messages['recent']):
+        return None
+    return messages['recent'][len(messages['recent']) - to_send:]
+
+
 class BaseWebSocketHandler(DjangoHandlerMixin, WebSocketHandler):
+    # The messages waiting to be written to the connection are kept in the
+    # outbox. They are numbered when they are written, so that superseded
+    # messages can be dropped from it.
+    outbox_bytes = 0
+    outbox_keys = count()
+    write_future = None
+    # Whether the client has fallen too far behind and is sent everything
+    # anew.
+    resyncing = False
 
-    def open(self, arg):
+    async def open(self, arg):
+        # open and on_message are coroutines, so tornado only hands the next
+        # message of the connection to on_message once they have finished.
         self.set_nodelay(True)
         logger.debug('Websocket opened')
         self.id = 0
-        self.user = self.get_current_user()
         self.args = arg.split("/")
         self.messages = {
             'server': 0,
             'client': 0,
-            'last_ten': []
+            # The last WS_RESEND_MESSAGES messages sent, in case the client
+            # has missed them.
+            'recent': []
         }
+        self.outbox = OrderedDict()
+        self.user = await run_in_db_thread(self.get_current_user)
         if self.user is None:
             self.access_denied()
             return
@@ -44,10 +103,10 @@ class BaseWebSocketHandler(DjangoHandlerMixin, WebSocketHandler):
     def do_close(self):
         self.close()
 
-    def on_message(self, data):
+    async def on_message(self, data):
         message = json_decode(data)
         if message["type"] == 'request_resend':
-            self.resend_messages(message["from"])
+            await self.resend_messages(message["from"])
             return
         if 'c' not in message and 's' not in message:
             self.send({
@@ -75,70 +134,124 @@ class BaseWebSocketHandler(DjangoHandlerMixin, WebSocketHandler):
             # Resend the messages the client missed.
             logger.debug('SIMULTANEOUS')
             self.messages["client"] += 1
-            self.resend_messages(message["s"])
+            await self.resend_messages(message["s"])
             self.reject_message(message)
             return
         # Message order is correct. We continue processing the data.
         self.messages["client"] += 1
-        self.handle_message(message)
+        await self.handle_message(message)
 
-    def handle_message(message):
+    async def handle_message(self, message):
         pass
 
     def reject_message(message):
         pass
 
-    def send_message(self, message):
-        self.messages['server'] += 1
-        message['c'] = self.messages['client']
-        message['s'] = self.messages['server']
-        self.messages['last_ten'].append(message)
-        self.messages['last_ten'] = self.messages['last_ten'][-10:]
-        logger.debug("Sending: Type %s, Server: %d, Client: %d, id: %d" % (
-            message["type"],
-            message['s'],
-            message['c'],
-            self.id
-        ))
-        self.send(message)
+    def coalesce_key(self, message):
+        # Messages with the same key supersede each other. Only the newest of
+        # them is sent if several are waiting in the outbox.
+        return None
+
+    def send_message(self, message, encoded=None, first=False):
+        # encoded: the message as returned by encode_message. The message is
+        # not modified, so it can be shared between connections.
+        # first: whether the message is sent before all waiting messages.
+        if self.resyncing:
+            return
+        if encoded is None:
+            encoded = encode_message(message)
+        key = None if first else self.coalesce_key(message)
+        if key is None:
+            key = next(self.outbox_keys)
+        elif key in self.outbox:
+            self.outbox_bytes -= len(self.outbox.pop(key)[1])
+        self.outbox[key] = (message, encoded)
+        self.outbox_bytes += len(encoded)
+        if first:
+            self.outbox.move_to_end(key, last=False)
+        if len(self.outbox) > 1 and (
+            len(self.outbox) > settings.WS_OUTBOX_MESSAGES or
+            self.outbox_bytes > settings.WS_OUTBOX_BYTES
+        ):
+            # The client cannot keep up.
+            logger.debug('Outbox full, id: %d' % self.id)
+            self.outbox.clear()
+            self.outbox_bytes = 0
+            self.resyncing = True
+            IOLoop.current().spawn_callback(self.resync)
+            return
+        if self.write_future is None:
+            self.write_messages()
+
+    def write_messages(self):
+        # Writes the messages in the outbox one after the other.
+        while len(self.outbox):
+            message, encoded = self.outbox.popitem(last=False)[1]
+            self.outbox_bytes -= len(encoded)
+            self.messages['server'] += 1
+            client_no = self.messages['client']
+            server_no = self.messages['server']
+            self.messages['recent'].append(resend_entry(message, encoded))
+            del self.messages['recent'][:-settings.WS_RESEND_MESSAGES]
+            logger.debug(
+                "Sending: Type %s, Server: %d, Client: %d, id: %d" % (
+                    message["type"],
+                    server_no,
+                    client_no,
+                    self.id
+                )
+            )
+            future = self.send(
+                '{"c": %d, "s": %d, %s' % (client_no, server_no, encoded[1:])
+            )
+            if future is not None and not future.done():
+                # The next message is written once the client has taken this
+                # one.
+                self.write_future = future
+                IOLoop.current().add_future(future, self.on_written)
+                return
+
+    def on_written(self, future):
+        self.write_future = None
+        self.write_messages()
+
+    async def resync(self):
+        # Called when the client has fallen too far behind. The connection is
+        # closed, so that the client connects anew.
+        self.close()
 
     @tornado.gen.coroutine
     def send(self, message):
+        if isinstance(message, dict):
+            message = json_encode(message)
         try:
             yield self.write_message(message)
         except (WebSocketClosedError, StreamClosedError):
             pass
 
-    def resend_messages(self, from_no):
-        to_send = self.messages["server"] - from_no
-        logger.debug('resending messages: %d' % to_send)
+    async def resend_messages(self, from_no):
         logger.debug(
             'Server: %d, from: %d' % (
                 self.messages["server"],
                 from_no
             )
         )
-        if to_send > len(self.messages['last_ten']):
-            # Too many messages requested. We have to abort.
+        to_send = messages_since(self.messages, from_no)
+        if to_send is None or None in [
+            encoded for message, encoded in to_send
+        ]:
+            # Too many messages requested or some of them were not kept. We
+            # have to abort.
             logger.debug('cannot fix it')
-            self.send_document()
+            await self.send_document()
             return
-        self.messages['server'] -= to_send
-        for message in self.messages['last_ten'][0-to_send:]:
-            self.send_message(message)
+        logger.debug('resending messages: %d' % len(to_send))
+        self.messages['server'] -= len(to_send)
+        for message, encoded in reversed(to_send):
+            self.send_message(message, encoded, first=True)
 
     def check_origin(self, origin):
-        parsed_origin = urlparse(origin)
-        origin = parsed_origin.netloc
-        # remove port if present
-        origin = origin.split(':')[0]
-        origin = origin.lower()
-
-        host = self.request.headers.get("Host")
-        # remove port if present
-        host = host.split(':')[0]
-        # Check to see that origin matches host directly, EXCLUDING ports
-        return origin == host
+        return origin_matches_host(origin, self.request.headers.get("Host"))
 
     def allow_draft76(self):
         # for iOS 5.0 Safari
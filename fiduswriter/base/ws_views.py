@@ -1,11 +1,11 @@
-from base.ws_handler import BaseWebSocketHandler
+from base.ws_handler import BaseWebSocketHandler, encode_message
 
 
 class WebSocket(BaseWebSocketHandler):
     sessions = dict()
     admin_sessions = dict()
 
-    def handle_message(self, message):
+    async def handle_message(self, message):
         if message["type"] == 'subscribe':
             self.subscribe()
             return
@@ -51,13 +51,15 @@ class WebSocket(BaseWebSocketHandler):
 
     @classmethod
     def send_message_to_users(cls, message):
+        encoded = encode_message(message)
         for waiter in list(cls.sessions.values()):
-            waiter.send_message(message)
+            waiter.send_message(message, encoded)
 
     @classmethod
     def send_message_to_admins(cls, message):
+        encoded = encode_message(message)
         for waiter in list(cls.admin_sessions.values()):
-            waiter.send_message(message)
+            waiter.send_message(message, encoded)
 
     def on_close(self):
         if not hasattr(self, 'type'):
@@ -1,12 +1,11 @@
 import time
-import json
 from builtins import range
 
-from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.db.models import Max, Count
 from django.core.serializers.python import Serializer
 
+from base.json_codec import JsonResponse, json_decode
 from bibliography.models import (
     Entry,
     EntryCategory
@@ -78,7 +77,7 @@ def save(request):
     response = {}
     status = 405
     if request.is_ajax() and request.method == 'POST':
-        bibs = json.loads(request.POST['bibs'])
+        bibs = json_decode(request.POST['bibs'])
         status = 200
         response['id_translations'] = []
         for b_id in list(bibs.keys()):
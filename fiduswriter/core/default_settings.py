@@ -303,9 +303,109 @@ LOGGING = {
 AVATAR_GRAVATAR_BACKUP = False
 AVATAR_DEFAULT_URL = 'img/default_avatar.png'
 AVATAR_MAX_AVATARS_PER_USER = 1
+# Seconds for which the avatar of a user is cached. Uploading or deleting an
+# avatar clears the cache of the user in all server processes.
+AVATAR_URL_CACHE_TIME = 60 * 60
 
 WEBSOCKET_PING_INTERVAL = 55
 
+# Messages to a websocket client wait in an outbox until the client has taken
+# the previous ones. A client that has WS_OUTBOX_MESSAGES messages or
+# WS_OUTBOX_BYTES bytes waiting is sent the whole document anew instead.
+WS_OUTBOX_MESSAGES = 1000
+WS_OUTBOX_BYTES = 16 * 1024 * 1024
+
+# Number of messages that are kept after they have been sent to a websocket
+# client, so that they can be sent again if the client has missed them. They
+# are kept for WS_RESUME_TIME seconds after a client of a document has lost
+# its connection, so that it is only sent what it has missed when it
+# reconnects. Messages larger than WS_RESEND_MESSAGE_BYTES and the document
+# itself are not kept; a client that has missed one is sent the whole
+# document anew.
+WS_RESEND_MESSAGES = 100
+WS_RESEND_MESSAGE_BYTES = 64 * 1024
+WS_RESUME_TIME = 60
+
+# Number of threads that handle the Django (non-websocket) requests. With 0,
+# they are handled on the event loop that also serves the websockets, so a
+# slow request holds up the collaboration on all open documents. At most
+# WSGI_MAX_QUEUED requests wait for a free thread, further requests are
+# answered with "503 Service Unavailable". Set it to None for no limit.
+WSGI_THREADS = 0
+WSGI_MAX_QUEUED = 1000
+
+# How JSON is encoded and decoded in websocket messages, AJAX responses and
+# saved documents. 'json' uses the standard library, 'orjson' the faster orjson
+# package (pip install fiduswriter[orjson]). 'auto' uses orjson if it is
+# installed.
+JSON_CODEC = 'auto'
+
+# Websocket connections that are opened again within WS_AUTH_CACHE_TIME
+# seconds are authenticated without loading the session or checking the
+# password again. At most WS_AUTH_CACHE_SIZE logins are kept in each server
+# process. Set WS_AUTH_CACHE_TIME to 0 to turn this off. The session of a
+# websocket connection is loaded with WS_SESSION_ENGINE, which defaults to
+# SESSION_ENGINE. 'django.contrib.sessions.backends.cached_db' reads the
+# sessions through the cache.
+WS_AUTH_CACHE_TIME = 60
+WS_AUTH_CACHE_SIZE = 10000
+WS_SESSION_ENGINE = None
+
+# The owners and access rights of DOC_ACCESS_CACHE_SIZE recently opened
+# documents are cached for at most DOC_ACCESS_CACHE_TIME seconds. Changes made
+# through any of the workers of this server take effect immediately, those
+# made on other hosts after that time. Set DOC_ACCESS_CACHE_TIME to 0 to turn
+# this off.
+DOC_ACCESS_CACHE_SIZE = 10000
+DOC_ACCESS_CACHE_TIME = 60
+
+# Number of threads in which the websocket connections access the database,
+# so that slow queries do not hold up the event loop.
+WS_DB_THREADS = 4
+
+# Where the collaboration sessions of open documents are kept. With 'local'
+# they live in the memory of the server process, so all collaborators on a
+# document need to connect to the same process. With 'broker' they are shared
+# between several server processes through the session broker, which is
+# started with "./manage.py session_broker".
+WS_SESSION_BACKEND = 'local'
+WS_SESSION_BROKER_SOCKET = '/tmp/fiduswriter-session-broker.sock'
+
+# Documents that are being edited are written to the database by a
+# background thread. The confirmed diffs of a document are added to its diff
+# journal once there are DOC_SAVE_VERSIONS unsaved diffs, but at the latest
+# DOC_SAVE_DELAY seconds after the first unsaved diff. The whole document is
+# saved every DOC_SNAPSHOT_VERSIONS versions and when it is closed, and by the
+# document list, export and admin if they read a document with newer diffs in
+# its journal. Journal entries are kept for DOC_JOURNAL_LENGTH versions after a
+# snapshot. A document that is loaded again waits up to DOC_SAVE_FLUSH_TIMEOUT
+# seconds for its queued changes to be written, before they are taken from
+# the queue. On shutdown, the server waits up to DOC_SAVE_SHUTDOWN_TIMEOUT
+# seconds for all documents to be written.
+DOC_SAVE_VERSIONS = 10
+DOC_SAVE_DELAY = 5
+DOC_SNAPSHOT_VERSIONS = 100
+DOC_JOURNAL_LENGTH = 10000
+DOC_SAVE_FLUSH_TIMEOUT = 5
+DOC_SAVE_SHUTDOWN_TIMEOUT = 60
+
+# The contents, comments, bibliography and last diffs of documents are stored
+# compressed with zlib at this level, from 1 (fastest) to 9 (smallest).
+DOC_BODY_COMPRESSION_LEVEL = 6
+
+# The contents of open documents that have not been used for DOC_IDLE_TIME
+# seconds are saved and removed from memory until they are used again. If the
+# open documents take up more than DOC_SESSIONS_MAX_SIZE bytes (measured as
+# JSON), the least recently used ones are removed from memory as well. Set
+# either to None to disable it.
+DOC_IDLE_TIME = 30 * 60
+DOC_SESSIONS_MAX_SIZE = 256 * 1024 * 1024
+
+# The selections of the participants of a document are sent to the others
+# every DOC_SELECTION_INTERVAL seconds. Only the newest selection of each
+# participant is sent. Set it to 0 to send every selection right away.
+DOC_SELECTION_INTERVAL = 0.1
+
 ADMIN_SITE_TITLE = gettext('Fidus Writer Admin')
 ADMIN_SITE_HEADER = gettext('Fidus Writer Administration Site')
 ADMIN_INDEX_TITLE = gettext('Welcome to the Fidus Writer Administration Site')
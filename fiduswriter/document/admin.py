@@ -3,9 +3,23 @@ from django.shortcuts import render
 from django.urls import path
 from django.utils.translation import ugettext as _
 from . import models
+from .helpers.persistence import compact_journal
+
+
+class DocumentBodyInline(admin.StackedInline):
+    model = models.DocumentBody
+    can_delete = False
 
 
 class DocumentAdmin(admin.ModelAdmin):
+    inlines = [DocumentBodyInline]
+
+    def change_view(self, request, object_id, *args, **kwargs):
+        # Diffs of the collaboration server that are only in the journal.
+        if request.method == 'GET' and object_id.isdigit():
+            compact_journal(int(object_id))
+        return super().change_view(request, object_id, *args, **kwargs)
+
     def get_urls(self):
         urls = super().get_urls()
         extra_urls = [
@@ -18,7 +32,11 @@ class DocumentAdmin(admin.ModelAdmin):
         return urls
 
     def maintenance_view(self, request):
-        response = {}
+        from .ws_views import WebSocket
+        response = {
+            # Of the documents edited through this server process.
+            'persistence': WebSocket.persistence.stats()
+        }
         return render(request, 'admin/document/maintenance.html', response)
 
 
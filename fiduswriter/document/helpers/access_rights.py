@@ -0,0 +1,151 @@
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from time import time
+
+from django.conf import settings
+
+from base.servers.invalidation import invalidation
+from document.models import AccessRight, Document
+
+# What a user may do with a document. rights is 'write' for the owner and None
+# for users without access.
+DocumentAccess = namedtuple(
+    'DocumentAccess',
+    ['id', 'owner_id', 'doc_version', 'rights']
+)
+
+
+class AccessRightsCache(object):
+    """
+    The owners of recently accessed documents and the rights of their users.
+    Only the columns needed are loaded, not the contents of the documents. The
+    entry of a document is removed through signals when its access rights or
+    its owner change, in all workers (see clear_document_access). It expires
+    after DOC_ACCESS_CACHE_TIME seconds in any case, as the server processes
+    of other hosts do not receive these signals. At most
+    DOC_ACCESS_CACHE_SIZE documents are kept, least recently used ones are
+    dropped first.
+    """
+
+    def __init__(self):
+        self.documents = OrderedDict()
+        # The number of lookups running for each document and how often its
+        # entry has been removed since they started, so that rights looked up
+        # before a change are not cached.
+        self.lookups = dict()
+        self.lock = Lock()
+
+    def get(self, document_id, user_id):
+        # Returns the DocumentAccess of the user or None if the document does
+        # not exist.
+        with self.lock:
+            entry = self.documents.get(document_id)
+            if entry is not None and entry['expires'] < time():
+                del self.documents[document_id]
+                entry = None
+            if entry is not None:
+                self.documents.move_to_end(document_id)
+                if user_id in entry['rights']:
+                    return self.make_access(entry, user_id)
+            lookup = self.lookups.setdefault(
+                document_id,
+                {'count': 0, 'generation': 0}
+            )
+            lookup['count'] += 1
+            generation = lookup['generation']
+        result = None
+        try:
+            result = self.look_up(document_id, user_id, entry)
+        finally:
+            with self.lock:
+                lookup['count'] -= 1
+                if lookup['count'] == 0:
+                    del self.lookups[document_id]
+                if result is not None and lookup['generation'] == generation:
+                    self.add(result[0], user_id, result[1])
+        if result is None:
+            return None
+        entry, rights = result
+        return DocumentAccess(
+            entry['id'],
+            entry['owner_id'],
+            entry['doc_version'],
+            rights
+        )
+
+    @staticmethod
+    def look_up(document_id, user_id, entry):
+        # Returns the entry of the document, a new one if entry is None, and
+        # the rights of the user or None if the document does not exist.
+        if entry is None:
+            document = Document.objects.filter(id=document_id).values(
+                'owner_id',
+                'doc_version'
+            ).first()
+            if document is None:
+                return None
+            entry = {
+                'id': document_id,
+                'owner_id': document['owner_id'],
+                'doc_version': document['doc_version'],
+                'rights': {},
+                'expires': time() + settings.DOC_ACCESS_CACHE_TIME
+            }
+        if entry['owner_id'] == user_id:
+            rights = 'write'
+        else:
+            rights = AccessRight.objects.filter(
+                document_id=document_id,
+                user_id=user_id
+            ).values_list('rights', flat=True).first()
+        return entry, rights
+
+    def add(self, entry, user_id, rights):
+        # Called with the lock held.
+        entry['rights'][user_id] = rights
+        if settings.DOC_ACCESS_CACHE_TIME:
+            self.documents[entry['id']] = entry
+            self.documents.move_to_end(entry['id'])
+            while len(self.documents) > settings.DOC_ACCESS_CACHE_SIZE:
+                self.documents.popitem(last=False)
+
+    @staticmethod
+    def make_access(entry, user_id):
+        return DocumentAccess(
+            entry['id'],
+            entry['owner_id'],
+            entry['doc_version'],
+            entry['rights'][user_id]
+        )
+
+    def clear_document(self, document_id, owner_id=None, doc_version=None):
+        # Removes the entry of a document. If an owner and doc_version are
+        # given, it is only removed if they have changed.
+        with self.lock:
+            entry = self.documents.get(document_id)
+            if (
+                entry is not None and
+                owner_id is not None and
+                entry['owner_id'] == owner_id and
+                float(entry['doc_version']) == float(doc_version)
+            ):
+                return
+            if document_id in self.lookups:
+                self.lookups[document_id]['generation'] += 1
+            self.documents.pop(document_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+access_rights_cache = AccessRightsCache()
+
+
+@invalidation
+def clear_document_access(document_id, owner_id=None, doc_version=None):
+    access_rights_cache.clear_document(document_id, owner_id, doc_version)
+
+
+def get_document_access(document_id, user):
+    return access_rights_cache.get(int(document_id), user.id)
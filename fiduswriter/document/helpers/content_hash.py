@@ -0,0 +1,63 @@
+import json
+import re
+from zlib import crc32
+
+# Paths of json diff operations within a top-level part of the contents.
+PART_PATH = re.compile(r'^/content/(\d+)/')
+
+
+def canonical(value):
+    # JavaScript does not distinguish integers from floats.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    elif isinstance(value, dict):
+        return {key: canonical(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [canonical(item) for item in value]
+    return value
+
+
+def content_hash(node):
+    # The same hash is computed by the client (see
+    # editor/collab/content_hash.js).
+    return crc32(json.dumps(
+        canonical(node),
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    ).encode('utf-8'))
+
+
+class ContentHashes(object):
+    """
+    The hashes of the top-level parts of the contents of an open document,
+    with which clients check that their copy has not diverged. The hashes are
+    computed when they are asked for, and a json diff only clears those of the
+    parts it changes.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+
+    def get(self, contents):
+        parts = contents.get('content', [])
+        for index, part in enumerate(parts):
+            if index not in self.hashes:
+                self.hashes[index] = content_hash(part)
+        return [self.hashes[index] for index in range(len(parts))]
+
+    def update(self, json_diff):
+        for operation in json_diff:
+            for key in ['path', 'from']:
+                if key not in operation:
+                    continue
+                match = PART_PATH.match(operation[key])
+                if match:
+                    self.hashes.pop(int(match.group(1)), None)
+                else:
+                    # Parts have been added, removed or moved.
+                    self.hashes.clear()
+                    return
+
+    def clear(self):
+        self.hashes.clear()
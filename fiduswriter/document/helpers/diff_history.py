@@ -0,0 +1,66 @@
+from collections import deque
+from itertools import islice
+
+
+class DiffHistory(object):
+    """
+    The most recent confirmed diffs of an open document, keyed by the version
+    they were applied to. Appending is O(1) and the diffs since a version are
+    returned in O(k) for k diffs. The oldest diffs are dropped once there are
+    more than max_length diffs or they take up more than max_bytes.
+    """
+
+    def __init__(self, max_length=1000, max_bytes=None):
+        self.max_length = max_length
+        self.max_bytes = max_bytes
+        self.diffs = deque()
+        self.sizes = deque()
+        self.size = 0
+        # The version following the newest diff.
+        self.next_version = None
+
+    def __len__(self):
+        return len(self.diffs)
+
+    def __iter__(self):
+        return iter(self.diffs)
+
+    @property
+    def first_version(self):
+        if self.next_version is None:
+            return None
+        return self.next_version - len(self.diffs)
+
+    def append(self, version, message, size):
+        # size is the length of the message encoded as JSON, which the caller
+        # has at hand already.
+        if self.next_version is not None and version != self.next_version:
+            # The history needs to be without gaps.
+            self.clear()
+        self.diffs.append(message)
+        self.sizes.append(size)
+        self.size += size
+        self.next_version = version + 1
+        while len(self.diffs) > self.max_length or (
+            self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            self.diffs.popleft()
+            self.size -= self.sizes.popleft()
+
+    def since(self, version):
+        # Returns the diffs applied to version and the versions after it or
+        # None if they are not all available.
+        if self.next_version is None:
+            return None
+        number = self.next_version - version
+        if number < 0 or number > len(self.diffs):
+            return None
+        messages = list(islice(reversed(self.diffs), number))
+        messages.reverse()
+        return messages
+
+    def clear(self):
+        self.diffs.clear()
+        self.sizes.clear()
+        self.size = 0
+        self.next_version = None
@@ -0,0 +1,262 @@
+import logging
+import threading
+from collections import OrderedDict
+from time import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from base.json_codec import json_decode, json_encode
+from document.models import Document, DocumentBody, DocumentDiff
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceQueue(object):
+    """
+    Write-behind queue for documents that are open in the collaboration
+    server. The confirmed diffs and, from time to time, a snapshot of the
+    encoded state of a document are handed to the queue on the IOLoop and
+    written to the database by a background thread. If a document is queued
+    again before it has been written, the diffs are collected and only the
+    newest snapshot is written. A job that cannot be written is queued again,
+    together with any newer job of the document, and retried after a delay
+    that doubles with every failure up to RETRY_DELAY_MAX seconds.
+    """
+    RETRY_DELAY_MAX = 60
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread = None
+        # The id and the job of the document that is being written.
+        self.writing = None
+        self.writing_job = None
+        self.flush_count = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+        self.failure_count = 0
+
+    def enqueue(self, document_id, fields, diffs=None):
+        # fields: document fields to update. diffs: list of (version, json)
+        # pairs to add to the diff journal.
+        with self.condition:
+            if document_id in self.pending:
+                job = self.pending[document_id]
+                job['fields'].update(fields)
+            else:
+                job = {
+                    'fields': dict(fields),
+                    'diffs': [],
+                    'queued': time(),
+                    'failures': 0,
+                    'retry_at': 0
+                }
+                self.pending[document_id] = job
+            if diffs:
+                job['diffs'] += diffs
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.work,
+                    name='document-persistence'
+                )
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def next_job(self):
+        # Waits for the first job that is due. Called with the condition held.
+        while True:
+            now = time()
+            retry_at = None
+            for document_id, job in self.pending.items():
+                if job['retry_at'] <= now:
+                    del self.pending[document_id]
+                    return document_id, job
+                if retry_at is None or job['retry_at'] < retry_at:
+                    retry_at = job['retry_at']
+            self.condition.wait(None if retry_at is None else retry_at - now)
+
+    def work(self):
+        while True:
+            with self.condition:
+                document_id, job = self.next_job()
+                self.writing = document_id
+                self.writing_job = job
+            try:
+                # write changes the fields it is given.
+                self.write(document_id, dict(job['fields']), job['diffs'])
+            except Exception:
+                logger.exception('Cannot save document %d' % document_id)
+                written = False
+            else:
+                written = True
+            finally:
+                close_old_connections()
+            latency = time() - job['queued']
+            with self.condition:
+                self.writing = None
+                self.writing_job = None
+                if written:
+                    self.flush_count += 1
+                    self.last_latency = latency
+                    self.max_latency = max(self.max_latency, latency)
+                    self.total_latency += latency
+                else:
+                    self.requeue(document_id, job)
+                self.condition.notify_all()
+
+    def requeue(self, document_id, job):
+        # Called with the condition held.
+        self.failure_count += 1
+        job['failures'] += 1
+        job['retry_at'] = time() + min(
+            2 ** (job['failures'] - 1),
+            self.RETRY_DELAY_MAX
+        )
+        newer_job = self.pending.pop(document_id, None)
+        if newer_job is not None:
+            job['fields'].update(newer_job['fields'])
+            job['diffs'] += newer_job['diffs']
+        self.pending[document_id] = job
+
+    @transaction.atomic
+    def write(self, document_id, fields, diffs):
+        logger.debug('saving document # %d' % document_id)
+        if len(diffs):
+            DocumentDiff.objects.bulk_create(
+                [
+                    DocumentDiff(
+                        document_id=document_id,
+                        version=version,
+                        diff=diff
+                    ) for version, diff in diffs
+                ],
+                ignore_conflicts=True
+            )
+        body = {
+            field: fields.pop(field) for field in Document.body_fields
+            if field in fields
+        }
+        if len(body) and not DocumentBody.objects.filter(
+            document_id=document_id
+        ).update(**body):
+            DocumentBody.objects.create(document_id=document_id, **body)
+        fields['updated'] = timezone.now()
+        Document.objects.filter(id=document_id).update(**fields)
+        if 'version' in fields:
+            # A snapshot of the contents was saved. Diffs that are much older
+            # are no longer needed.
+            logger.debug('version %d' % fields['version'])
+            DocumentDiff.objects.filter(
+                document_id=document_id,
+                version__lt=fields['version'] - settings.DOC_JOURNAL_LENGTH
+            ).delete()
+
+    def drain(self, timeout=None):
+        # Wait until all queued documents have been written. Returns False if
+        # the timeout was reached before.
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: len(self.pending) == 0 and self.writing is None,
+                timeout
+            )
+
+    def flush(self, document_id, timeout=None):
+        # Wait until the queued state of a document has been written, which
+        # is moved to the front of the queue. Returns False if the timeout was
+        # reached before.
+        with self.condition:
+            if document_id in self.pending:
+                self.pending.move_to_end(document_id, last=False)
+                # A failed job is retried at once.
+                self.pending[document_id]['retry_at'] = 0
+                self.condition.notify_all()
+            return self.condition.wait_for(
+                lambda: (
+                    document_id not in self.pending and
+                    self.writing != document_id
+                ),
+                timeout
+            )
+
+    def queued_diffs(self, document_id):
+        # Returns the diffs of a document that have not been written yet.
+        with self.condition:
+            diffs = []
+            if self.writing == document_id:
+                diffs += self.writing_job['diffs']
+            if document_id in self.pending:
+                diffs += self.pending[document_id]['diffs']
+            return diffs
+
+    def stats(self):
+        with self.condition:
+            if self.flush_count:
+                average_latency = self.total_latency / self.flush_count
+            else:
+                average_latency = 0
+            return {
+                'depth': len(self.pending) + (
+                    0 if self.writing is None else 1
+                ),
+                'flushes': self.flush_count,
+                'failures': self.failure_count,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'average_latency': average_latency
+            }
+
+
+def get_journal(document_id, from_version, to_version=None):
+    # Returns the journaled diffs applied to the versions from from_version
+    # up to (excluding) to_version.
+    diffs = DocumentDiff.objects.filter(
+        document_id=document_id,
+        version__gte=from_version
+    )
+    if to_version is not None:
+        diffs = diffs.filter(version__lt=to_version)
+    return [
+        json_decode(diff) for diff in diffs.values_list('diff', flat=True)
+    ]
+
+
+def compact_journals(documents):
+    # Saves a snapshot of those of the documents whose journal has diffs that
+    # are newer than their saved contents, so that views outside of the
+    # collaboration server read their current state. documents is a queryset.
+    for document_id in DocumentDiff.objects.filter(
+        document__in=documents,
+        version__gte=F('document__version')
+    ).values_list('document_id', flat=True).distinct():
+        compact_journal(document_id)
+
+
+@transaction.atomic
+def compact_journal(document_id):
+    # The diffs are applied the same way as when the collaboration server
+    # loads the document. The journal is kept, as the collaboration server
+    # may still need it.
+    from document.ws_views import WebSocket
+    document = Document.objects.select_for_update().with_body(
+        'contents',
+        'comments',
+        'bibliography'
+    ).filter(id=document_id).first()
+    if document is None:
+        return
+    journal = get_journal(document_id, document.version)
+    if len(journal) == 0:
+        return
+    doc = WebSocket.decode_document(document)
+    WebSocket.replay_journal(doc, journal)
+    document.title = doc['title'][-255:]
+    document.version = doc['version']
+    document.contents = json_encode(doc['contents'])
+    document.comments = json_encode(doc['comments'])
+    document.bibliography = json_encode(doc['bibliography'])
+    document.save(update_fields=['title', 'version'])
@@ -0,0 +1,229 @@
+import logging
+from functools import partial
+
+from django.conf import settings
+
+from base.servers.session_broker import SessionBrokerClient
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSessionBackend(object):
+    """
+    Keeps the collaboration sessions only in the memory of this server
+    process. All collaborators on a document need to connect to the same
+    process.
+
+    The methods whose answers are needed are coroutines, as they are for the
+    session broker. The others only send a notice and return at once.
+    """
+
+    def __init__(self):
+        self.rosters = dict()
+
+    async def open_document(self, document_id, version):
+        # Returns the diffs that were confirmed elsewhere after the given
+        # version.
+        return []
+
+    def close_document(self, document_id):
+        self.rosters.pop(document_id, None)
+
+    async def submit_diff(self, document_id, version, message, user_id):
+        # The session in this process is the only one, so the diff has
+        # already been checked against the current version.
+        return True
+
+    def publish(self, document_id, message, sender_id, user_id):
+        pass
+
+    async def join(self, document_id, info):
+        roster = self.rosters.setdefault(document_id, dict())
+        if len(roster) == 0:
+            session_id = 0
+        else:
+            session_id = max(roster) + 1
+        if info is not None:
+            info['session_id'] = session_id
+        roster[session_id] = info
+        return session_id
+
+    def leave(self, document_id, session_id):
+        if document_id in self.rosters:
+            self.rosters[document_id].pop(session_id, None)
+
+    async def participants(self, document_id):
+        roster = self.rosters.get(document_id, dict())
+        return [
+            info for session_id, info in sorted(roster.items())
+            if info is not None
+        ]
+
+
+class BrokerSessionBackend(object):
+    """
+    Shares the collaboration sessions with other server processes through the
+    session broker (see base.servers.session_broker). The broker decides
+    which diff gets which version and relays diffs and other updates between
+    the processes, so that every process holds the same state of an open
+    document.
+
+    The backend remembers the version of every open document and the
+    participants that joined it from this process. If the connection to the
+    broker has to be opened again, they are registered anew. The diffs the
+    broker has seen in the meantime are handed to `receive` like the diffs of
+    other processes, followed by a 'roster' publication with the current
+    participants.
+    """
+
+    def __init__(self, path, receive):
+        self.receive = receive
+        self.channels = dict()
+        self.client = SessionBrokerClient(
+            path,
+            self.receive_publication,
+            self.get_registrations
+        )
+
+    def receive_publication(self, publication):
+        channel = self.channels.get(int(publication['channel']))
+        if channel is not None and publication['kind'] == 'diff':
+            channel['version'] = max(
+                channel['version'],
+                publication['message']['v'] + 1
+            )
+        self.receive(publication)
+
+    def get_registrations(self):
+        registrations = []
+        for document_id, channel in self.channels.items():
+            registrations.append((
+                'open',
+                {'channel': document_id, 'version': channel['version']},
+                partial(self.reopened, document_id)
+            ))
+            for session_id, info in channel['participants'].items():
+                registrations.append((
+                    'join',
+                    {
+                        'channel': document_id,
+                        'info': info,
+                        'session_id': session_id
+                    },
+                    partial(self.rejoined, document_id, session_id)
+                ))
+            registrations.append((
+                'participants',
+                {'channel': document_id},
+                partial(self.refresh_roster, document_id)
+            ))
+        return registrations
+
+    def reopened(self, document_id, response):
+        for message in response['diffs']:
+            self.receive_publication({
+                'kind': 'diff',
+                'channel': str(document_id),
+                'message': message,
+                'user': None
+            })
+
+    def rejoined(self, document_id, session_id, response):
+        if response['session_id'] != session_id:
+            logger.error(
+                'Session %d of document %d got the new id %d.' % (
+                    session_id,
+                    document_id,
+                    response['session_id']
+                )
+            )
+
+    def refresh_roster(self, document_id, response):
+        self.receive({
+            'kind': 'roster',
+            'channel': str(document_id),
+            'participants': response['participants']
+        })
+
+    async def open_document(self, document_id, version):
+        response = await self.client.request(
+            'open',
+            channel=document_id,
+            version=version
+        )
+        channel = self.channels.setdefault(
+            document_id,
+            {'version': version, 'participants': dict()}
+        )
+        channel['version'] = max(channel['version'], response['version'])
+        return response['diffs']
+
+    def close_document(self, document_id):
+        self.channels.pop(document_id, None)
+        self.client.send('close', channel=document_id)
+
+    async def submit_diff(self, document_id, version, message, user_id):
+        response = await self.client.request(
+            'submit',
+            channel=document_id,
+            version=version,
+            message=message,
+            user=user_id
+        )
+        if response.get('accepted', False) is False:
+            return False
+        if document_id in self.channels:
+            channel = self.channels[document_id]
+            channel['version'] = max(channel['version'], response['version'])
+        return True
+
+    def publish(self, document_id, message, sender_id, user_id):
+        self.client.send(
+            'publish',
+            channel=document_id,
+            message=message,
+            sender=sender_id,
+            user=user_id
+        )
+
+    async def join(self, document_id, info):
+        response = await self.client.request(
+            'join',
+            channel=document_id,
+            info=info
+        )
+        if 'error' in response:
+            raise ConnectionError(
+                'Session broker error: %s' % response['error']
+            )
+        session_id = response['session_id']
+        if info is not None:
+            info['session_id'] = session_id
+        if document_id in self.channels:
+            self.channels[document_id]['participants'][session_id] = info
+        return session_id
+
+    def leave(self, document_id, session_id):
+        if document_id in self.channels:
+            self.channels[document_id]['participants'].pop(session_id, None)
+        self.client.send(
+            'leave',
+            channel=document_id,
+            session_id=session_id
+        )
+
+    async def participants(self, document_id):
+        response = await self.client.request(
+            'participants',
+            channel=document_id
+        )
+        return response.get('participants', [])
+
+
+def get_session_backend(receive):
+    if settings.WS_SESSION_BACKEND == 'broker':
+        return BrokerSessionBackend(
+            settings.WS_SESSION_BROKER_SOCKET,
+            receive
+        )
+    return LocalSessionBackend()
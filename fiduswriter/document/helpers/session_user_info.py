@@ -1,4 +1,5 @@
-from document.models import AccessRight, Document, DocumentTemplate
+from document.models import Document, DocumentTemplate
+from document.helpers.access_rights import get_document_access
 
 
 class SessionUserInfo():
@@ -35,26 +36,16 @@ class SessionUserInfo():
         :type document_id:
         :param current_user:
         :type current_user:
-        :return: Returns document and bool value that user can access
+        :return: Returns the DocumentAccess of the document and bool value
+            that user can access
         :rtype: tuple
         """
-        can_access = False
-        document = Document.objects.filter(id=int(document_id)).first()
+        document = get_document_access(document_id, self.user)
         if document is None:
             return (False, False)
-        else:
-            self.document_id = document.id
-            if document.owner == self.user:
-                self.access_rights = 'write'
-                self.is_owner = True
-                can_access = True
-            else:
-                self.is_owner = False
-                access_rights = AccessRight.objects.filter(
-                    document=document,
-                    user=self.user
-                ).first()
-                if access_rights:
-                    self.access_rights = access_rights.rights
-                    can_access = True
-        return (document, can_access)
+        self.document_id = document.id
+        self.is_owner = document.owner_id == self.user.id
+        if document.rights is None:
+            return (document, False)
+        self.access_rights = document.rights
+        return (document, True)
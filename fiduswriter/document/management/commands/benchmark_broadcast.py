@@ -0,0 +1,69 @@
+from timeit import timeit
+
+from django.core.management.base import BaseCommand
+
+from base.json_codec import json_encode
+from base.ws_handler import encode_message
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the cost of encoding a broadcast message for every '
+        'participant with encoding it once per broadcast'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--steps',
+            dest='steps',
+            type=int,
+            default=200,
+            help='Number of steps in the diff message.',
+        )
+        parser.add_argument(
+            '--repeat',
+            dest='repeat',
+            type=int,
+            default=200,
+            help='Number of broadcasts to time.',
+        )
+
+    def handle(self, *args, **options):
+        message = {
+            'type': 'diff',
+            'v': 100,
+            'rid': 1,
+            'cid': 2,
+            'ds': [{
+                'stepType': 'replace',
+                'from': step,
+                'to': step,
+                'slice': {'content': [{'type': 'text', 'text': 'x' * 20}]}
+            } for step in range(options['steps'])]
+        }
+        self.stdout.write(
+            'Message size: %d bytes\n' % len(json_encode(message))
+        )
+        self.stdout.write(
+            '%12s %16s %16s\n' % ('participants', 'per recipient', 'once')
+        )
+        for participants in [1, 5, 10, 30, 100]:
+
+            def per_recipient():
+                for counter in range(participants):
+                    message['c'] = counter
+                    message['s'] = counter
+                    json_encode(message)
+
+            def once():
+                encoded = encode_message(message)
+                for counter in range(participants):
+                    '{"c": %d, "s": %d, %s' % (counter, counter, encoded[1:])
+
+            self.stdout.write('%12d %14.3fms %14.3fms\n' % (
+                participants,
+                timeit(per_recipient, number=options['repeat']) * 1000 /
+                options['repeat'],
+                timeit(once, number=options['repeat']) * 1000 /
+                options['repeat']
+            ))
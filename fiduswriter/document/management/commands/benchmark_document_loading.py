@@ -0,0 +1,134 @@
+import tracemalloc
+import zlib
+from timeit import timeit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.json_codec import json_encode
+from document.helpers.session_user_info import SessionUserInfo
+from document.models import Document, DocumentBody, DocumentTemplate
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the memory use and time of loading documents with and '
+        'without their body. The documents are created in a transaction that '
+        'is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--documents',
+            dest='documents',
+            type=int,
+            default=50,
+            help='Number of documents.',
+        )
+        parser.add_argument(
+            '--paragraphs',
+            dest='paragraphs',
+            type=int,
+            default=2000,
+            help='Number of paragraphs in each document.',
+        )
+        parser.add_argument(
+            '--repeat',
+            dest='repeat',
+            type=int,
+            default=20,
+            help='Number of times to load the documents.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        owner = User.objects.create(username='benchmark_document_loading')
+        template = DocumentTemplate.objects.create(title='Benchmark')
+        paragraph = {
+            'type': 'paragraph',
+            'content': [{'type': 'text', 'text': 'Lorem ipsum ' * 20}]
+        }
+        contents = json_encode({
+            'type': 'article',
+            'content': [paragraph] * options['paragraphs']
+        })
+        Document.objects.bulk_create([
+            Document(owner=owner, template=template)
+            for number in range(options['documents'])
+        ])
+        ids = list(
+            Document.objects.filter(owner=owner).values_list('id', flat=True)
+        )
+        DocumentBody.objects.bulk_create([
+            DocumentBody(
+                document_id=document_id,
+                contents=contents,
+                last_diffs=json_encode([{'type': 'diff'}] * 100),
+                comments=json_encode({'1': {'comment': paragraph}}),
+                bibliography=json_encode({'1': {'fields': paragraph}})
+            ) for document_id in ids
+        ])
+        self.stdout.write(
+            'Document size: %d bytes, %d bytes compressed\n' % (
+                len(contents),
+                len(zlib.compress(
+                    contents.encode('utf-8'),
+                    settings.DOC_BODY_COMPRESSION_LEVEL
+                ))
+            )
+        )
+        self.stdout.write(
+            '%-16s %14s %14s %12s %12s\n' % (
+                'query', 'memory (body)', 'memory (defer)', 'time (body)',
+                'time (defer)'
+            )
+        )
+
+        def list_documents(queryset):
+            return [
+                (document.id, document.title, document.updated)
+                for document in queryset.filter(owner=owner)
+            ]
+
+        def check_access(queryset):
+            session_user_info = SessionUserInfo(owner)
+            for document_id in ids:
+                session_user_info.init_access(document_id)
+                queryset.get(id=document_id).title
+
+        for name, function in [
+            ('list', list_documents),
+            ('access', check_access)
+        ]:
+            results = []
+            for queryset in [
+                Document.objects.with_body(),
+                Document.objects.all()
+            ]:
+                tracemalloc.start()
+                function(queryset)
+                results.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            for queryset in [
+                Document.objects.with_body(),
+                Document.objects.all()
+            ]:
+                results.append(
+                    timeit(
+                        lambda: function(queryset),
+                        number=options['repeat']
+                    ) * 1000 / options['repeat']
+                )
+            self.stdout.write('%-16s %12.1fMB %12.1fMB %10.2fms %10.2fms\n' % (
+                name,
+                results[0] / 1024 / 1024,
+                results[1] / 1024 / 1024,
+                results[2],
+                results[3]
+            ))
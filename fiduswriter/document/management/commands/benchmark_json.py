@@ -0,0 +1,97 @@
+import os
+from timeit import timeit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+
+from base.json_codec import CODECS, get_codec
+from document.models import Document
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the time the available JSON codecs take to encode and '
+        'decode documents. The document templates of the fixtures are used, '
+        'as well as documents of the database if their ids are given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'document_ids',
+            nargs='*',
+            type=int,
+            help='Ids of documents in the database.',
+        )
+        parser.add_argument(
+            '--scale',
+            dest='scale',
+            type=int,
+            default=100,
+            help=(
+                'The fixtures are also timed with their contents repeated '
+                'this many times.'
+            ),
+        )
+        parser.add_argument(
+            '--repeat',
+            dest='repeat',
+            type=int,
+            default=100,
+            help='Number of times to encode and decode each document.',
+        )
+
+    def get_documents(self, options):
+        standard = get_codec('json')
+        documents = []
+        with open(os.path.join(
+            settings.SRC_PATH,
+            'document/fixtures/initial_documenttemplates.json'
+        )) as fixture_file:
+            fixtures = standard.decode(fixture_file.read())
+        for fixture in fixtures:
+            definition = standard.decode(fixture['fields']['definition'])
+            documents.append((fixture['fields']['title'], definition))
+            documents.append((
+                '%s x%d' % (fixture['fields']['title'], options['scale']),
+                dict(
+                    definition,
+                    content=definition['content'] * options['scale']
+                )
+            ))
+        if options['document_ids']:
+            for document in Document.objects.filter(
+                id__in=options['document_ids']
+            ).with_body('contents'):
+                documents.append((
+                    str(document),
+                    standard.decode(document.contents)
+                ))
+        return documents
+
+    def handle(self, *args, **options):
+        codecs = []
+        for name in CODECS:
+            try:
+                codecs.append((name, get_codec(name)))
+            except ImproperlyConfigured as error:
+                self.stdout.write('%s: %s\n' % (name, error))
+        self.stdout.write('%-30s %10s %-8s %12s %12s\n' % (
+            'document', 'size', 'codec', 'encode', 'decode'
+        ))
+        for title, document in self.get_documents(options):
+            encoded = get_codec('json').encode(document)
+            for name, codec in codecs:
+                self.stdout.write('%-30s %10d %-8s %10.3fms %10.3fms\n' % (
+                    title[:30],
+                    len(encoded),
+                    name,
+                    timeit(
+                        lambda: codec.encode(document),
+                        number=options['repeat']
+                    ) * 1000 / options['repeat'],
+                    timeit(
+                        lambda: codec.decode(encoded),
+                        number=options['repeat']
+                    ) * 1000 / options['repeat']
+                ))
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.9 on 2026-10-17 21:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0019_remove_documenttemplate_definition_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentDiff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('diff', models.TextField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.Document')),
+            ],
+            options={
+                'ordering': ['version'],
+                'unique_together': {('document', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.9 on 2026-10-17 21:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0020_documentdiff'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['-updated', '-id'], name='document_do_updated_29c765_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 2.2.9 on 2026-10-17 22:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import document.models
+
+# Number of documents that are moved at once, so that not all documents are
+# held in memory.
+CHUNK_SIZE = 100
+
+BODY_FIELDS = ['contents', 'last_diffs', 'comments', 'bibliography']
+
+
+def move_bodies(apps, schema_editor):
+    # Compresses the bodies of the documents into the new table.
+    Document = apps.get_model('document', 'Document')
+    DocumentBody = apps.get_model('document', 'DocumentBody')
+    last_id = 0
+    while True:
+        documents = list(
+            Document.objects.filter(id__gt=last_id).order_by('id').values(
+                'id',
+                *BODY_FIELDS
+            )[:CHUNK_SIZE]
+        )
+        if len(documents) == 0:
+            break
+        DocumentBody.objects.bulk_create([
+            DocumentBody(
+                document_id=document['id'],
+                **{field: document[field] for field in BODY_FIELDS}
+            ) for document in documents
+        ])
+        last_id = documents[-1]['id']
+
+
+def restore_bodies(apps, schema_editor):
+    Document = apps.get_model('document', 'Document')
+    DocumentBody = apps.get_model('document', 'DocumentBody')
+    last_id = 0
+    while True:
+        bodies = list(
+            DocumentBody.objects.filter(
+                document_id__gt=last_id
+            ).order_by('document_id').values('document_id', *BODY_FIELDS)[
+                :CHUNK_SIZE
+            ]
+        )
+        if len(bodies) == 0:
+            break
+        for body in bodies:
+            Document.objects.filter(id=body['document_id']).update(
+                **{field: body[field] for field in BODY_FIELDS}
+            )
+        last_id = bodies[-1]['document_id']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0021_document_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentBody',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='document.Document')),
+                ('contents', document.models.CompressedTextField(default='{}')),
+                ('last_diffs', document.models.CompressedTextField(default='[]')),
+                ('comments', document.models.CompressedTextField(default='{}')),
+                ('bibliography', document.models.CompressedTextField(default='{}')),
+            ],
+        ),
+        migrations.RunPython(move_bodies, restore_bodies),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.9 on 2026-10-17 22:02
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0022_documentbody'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='document',
+            name='bibliography',
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='comments',
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='contents',
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='last_diffs',
+        ),
+    ]
@@ -1,9 +1,12 @@
 import uuid
+import zlib
 
 from builtins import str
 from builtins import object
 
-from django.db import models
+from django import forms
+from django.conf import settings
+from django.db import models, transaction
 from django.db.utils import OperationalError, ProgrammingError
 from django.contrib.auth.models import User
 from django.core import checks
@@ -80,9 +83,70 @@ class DocumentTemplate(models.Model):
             return []
 
 
+class CompressedTextField(models.Field):
+    """
+    Text stored compressed with zlib in a binary column. JSON as used in
+    documents typically shrinks to a fifth or less. Values are compressed when
+    they are written and decompressed when they are read, so the field is used
+    like a TextField.
+    """
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return zlib.decompress(value).decode('utf-8')
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return zlib.decompress(value).decode('utf-8')
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return value
+        return connection.Database.Binary(zlib.compress(
+            value.encode('utf-8'),
+            settings.DOC_BODY_COMPRESSION_LEVEL
+        ))
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'widget': forms.Textarea, **kwargs})
+
+
+class DocumentQuerySet(models.QuerySet):
+
+    def with_body(self, *fields):
+        # Loads the given fields of the body of the documents, or all of them
+        # if none are given, in the same query. Otherwise the body is loaded
+        # when it is first accessed.
+        return self.select_related('body').defer(*[
+            'body__' + field for field in Document.body_fields
+            if fields and field not in fields
+        ])
+
+
+def body_field(name):
+    # A field of the body of a document that can be used as if it was a field
+    # of the document itself.
+
+    def get_field(self):
+        return getattr(self.get_body(), name)
+
+    def set_field(self, value):
+        setattr(self.get_body(), name, value)
+        self.body_changed = True
+
+    return property(get_field, set_field)
+
+
 class Document(models.Model):
     title = models.CharField(max_length=255, default='', blank=True)
-    contents = models.TextField(default='{}')  # json object of content
+    # The contents, last_diffs, comments and bibliography are stored in the
+    # DocumentBody, so that they are not read when listing documents.
+    contents = body_field('contents')  # json object of content
     doc_version = models.DecimalField(
         max_digits=3,
         decimal_places=1,
@@ -94,7 +158,7 @@ class Document(models.Model):
     # files that are being uploaded. This field is only used for upgrading data
     # and is therefore not handed to the editor or document overview page.
     version = models.PositiveIntegerField(default=0)
-    last_diffs = models.TextField(default='[]')
+    last_diffs = body_field('last_diffs')
     # The last few diffs that were received and approved. The number of stored
     # diffs should always be equivalent to or more than all the diffs since the
     # last full save of the document.
@@ -105,8 +169,8 @@ class Document(models.Model):
     )
     added = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
-    comments = models.TextField(default='{}')
-    bibliography = models.TextField(default='{}')
+    comments = body_field('comments')
+    bibliography = body_field('bibliography')
     # Whether or not document is listed on document overview list page.
     # True by default and for all normal documents. Can be set to False when
     # documents are added in plugins that list these documents somewhere else.
@@ -116,6 +180,11 @@ class Document(models.Model):
         on_delete=models.deletion.CASCADE
     )
 
+    objects = DocumentQuerySet.as_manager()
+
+    body_fields = ('contents', 'last_diffs', 'comments', 'bibliography')
+    body_changed = False
+
     def __str__(self):
         if len(self.title) > 0:
             return self.title + ' (' + str(self.id) + ')'
@@ -124,20 +193,45 @@ class Document(models.Model):
 
     class Meta(object):
         ordering = ['-id']
+        indexes = [
+            # Used for the paginated document overview.
+            models.Index(fields=['-updated', '-id']),
+        ]
 
     def get_absolute_url(self):
         return "/document/%i/" % self.id
 
+    def get_body(self):
+        try:
+            return self.body
+        except DocumentBody.DoesNotExist:
+            self.body = DocumentBody()
+            return self.body
+
+    def save(self, *args, **kwargs):
+        # The body is saved along with new documents and when it has been
+        # changed.
+        new = self.pk is None
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if new or self.body_changed:
+                body = self.get_body()
+                body.document = self
+                body.save(force_insert=new)
+        self.body_changed = False
+
     def is_deletable(self):
         reverse_relations = [
             f for f in self._meta.model._meta.get_fields()
             if (f.one_to_many or f.one_to_one) and
             f.auto_created and not f.concrete and
             f.name not in [
+                'body',
                 'accessright',
                 'accessrightinvite',
                 'documentrevision',
-                'documentimage'
+                'documentimage',
+                'documentdiff'
             ]
         ]
 
@@ -176,6 +270,42 @@ class Document(models.Model):
             return []
 
 
+class DocumentBody(models.Model):
+    document = models.OneToOneField(
+        Document,
+        primary_key=True,
+        related_name='body',
+        on_delete=models.deletion.CASCADE
+    )
+    contents = CompressedTextField(default='{}')
+    last_diffs = CompressedTextField(default='[]')
+    comments = CompressedTextField(default='{}')
+    bibliography = CompressedTextField(default='{}')
+
+    def __str__(self):
+        return str(self.document_id)
+
+
+class DocumentDiff(models.Model):
+    # Journal of the diffs confirmed by the collaboration server. The contents
+    # of the document at a given version are those saved in the document
+    # (Document.version) with all the following diffs applied.
+    document = models.ForeignKey(Document, on_delete=models.deletion.CASCADE)
+    version = models.PositiveIntegerField()
+    # The version of the document the diff was applied to.
+    diff = models.TextField()  # json object of the diff message
+
+    class Meta(object):
+        unique_together = (("document", "version"),)
+        ordering = ['version']
+
+    def __str__(self):
+        return '%(version)d of %(doc_id)d' % {
+            'version': self.version,
+            'doc_id': self.document_id
+        }
+
+
 RIGHTS_CHOICES = (
     ('write', 'Writer'),
     # Can write contents and can read+write comments.
@@ -1,7 +1,15 @@
-from .models import Document
-from django.db.models.signals import post_delete
+from .models import AccessRight, Document, DocumentTemplate
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from avatar.models import Avatar
+from base.servers.invalidation import invalidation
+from style.models import DocumentStyle, DocumentStyleFile, ExportTemplate
+from usermedia.models import DocumentImage, Image
+from user.models import TeamMember
+
 
 @receiver(post_delete, sender=Document)
 def delete_unused_template(sender, instance, **kwargs):
@@ -12,3 +20,83 @@ def delete_unused_template(sender, instance, **kwargs):
     ):
         # User's document template no longer used.
         instance.template.delete()
+
+
+# Access rights are cached by document (see helpers/access_rights.py).
+
+@receiver(post_save, sender=AccessRight)
+@receiver(post_delete, sender=AccessRight)
+@receiver(post_delete, sender=Document)
+def clear_access_rights(sender, instance, **kwargs):
+    from .helpers.access_rights import clear_document_access
+    if sender == AccessRight:
+        document_id = instance.document_id
+    else:
+        document_id = instance.id
+    clear_document_access(document_id)
+    # The old rights may be read again until the transaction is committed.
+    transaction.on_commit(lambda: clear_document_access(document_id))
+
+
+@receiver(post_save, sender=Document)
+def clear_changed_owner(sender, instance, **kwargs):
+    from .helpers.access_rights import clear_document_access
+    clear_document_access(
+        instance.id,
+        instance.owner_id,
+        instance.doc_version
+    )
+
+
+# The collaboration server caches the parts of the messages it sends to
+# everyone opening a document. These are removed when the underlying data
+# changes, in all workers.
+
+@invalidation
+def clear_payloads(key, document_id=None):
+    from .ws_views import WebSocket
+    WebSocket.clear_payloads(key, document_id)
+
+
+@receiver(post_save, sender=DocumentImage)
+@receiver(post_delete, sender=DocumentImage)
+def clear_document_images(sender, instance, **kwargs):
+    clear_payloads('images', instance.document_id)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def clear_images(sender, instance, **kwargs):
+    clear_payloads('images')
+
+
+@receiver(post_save, sender=DocumentTemplate)
+@receiver(post_delete, sender=DocumentTemplate)
+@receiver(post_save, sender=DocumentStyle)
+@receiver(post_delete, sender=DocumentStyle)
+@receiver(post_save, sender=DocumentStyleFile)
+@receiver(post_delete, sender=DocumentStyleFile)
+@receiver(post_save, sender=ExportTemplate)
+@receiver(post_delete, sender=ExportTemplate)
+def clear_styles(sender, instance, **kwargs):
+    clear_payloads('styles')
+
+
+# The fields of users that appear in the owner payload.
+OWNER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=TeamMember)
+@receiver(post_delete, sender=TeamMember)
+@receiver(post_save, sender=Avatar)
+@receiver(post_delete, sender=Avatar)
+def clear_owners(sender, instance, update_fields=None, **kwargs):
+    if (
+        sender == User and
+        update_fields is not None and
+        OWNER_FIELDS.isdisjoint(update_fields)
+    ):
+        # For example the login time is saved on its own.
+        return
+    clear_payloads('owner')
@@ -106,34 +106,86 @@ export class DocumentOverview {
     }
 
     getDocumentListData() {
-        return postJson(
-            '/api/document/documentlist/'
-        ).catch(
+        // The first page of documents is shown as soon as it has arrived.
+        // The other pages are loaded one after the other and added to the
+        // table.
+        return Promise.all([
+            postJson('/api/document/documentlist/styles/'),
+            this.getDocumentListPage('')
+        ]).catch(
             error => {
                 addAlert('error', gettext('Cannot load data of documents.'))
                 throw (error)
             }
         ).then(
-            ({json}) => {
-                const ids = new Set()
-                this.documentList = json.documents.filter(doc => {
-                    if (ids.has(doc.id)) {return false}
-                    ids.add(doc.id)
-                    return true
-                })
-
-                this.teamMembers = json.team_members
+            ([{json}, {nextCursor}]) => {
                 this.documentStyles = json.document_styles
                 this.documentTemplates = json.document_templates
                 this.initTable()
                 if (Object.keys(this.documentTemplates).length > 1) {
                     this.multipleNewDocumentMenuItem()
                 }
+                deactivateWait()
+                return this.getRemainingDocumentListPages(nextCursor)
             }
+        )
+
+    }
+
+    getDocumentListPage(cursor) {
+        // Adds the documents of a page with their revisions to documentList.
+        return postJson(
+            '/api/document/documentlist/page/',
+            {cursor}
         ).then(
-            () => deactivateWait()
+            ({json}) => {
+                if (json.team_members) {
+                    this.teamMembers = json.team_members
+                }
+                const ids = new Set(this.documentList.map(doc => doc.id))
+                const docs = json.documents.filter(doc => {
+                    if (ids.has(doc.id)) {return false}
+                    ids.add(doc.id)
+                    return true
+                })
+                const nextCursor = json.next_cursor
+                if (!docs.length) {
+                    return {docs, nextCursor}
+                }
+                return postJson(
+                    '/api/document/documentlist/revisions/',
+                    {ids: docs.map(doc => doc.id).join(',')}
+                ).then(
+                    ({json}) => {
+                        docs.forEach(doc => doc.revisions = json.revisions[doc.id] || [])
+                        this.documentList = this.documentList.concat(docs)
+                        return {docs, nextCursor}
+                    }
+                )
+            }
         )
+    }
 
+    getRemainingDocumentListPages(cursor) {
+        if (!cursor) {
+            return Promise.resolve()
+        }
+        return this.getDocumentListPage(cursor).catch(
+            error => {
+                addAlert('error', gettext('Cannot load data of documents.'))
+                throw (error)
+            }
+        ).then(
+            ({docs, nextCursor}) => {
+                if (docs.length) {
+                    this.table.insert({data: docs.map(doc => this.createTableRow(doc))})
+                    if (this.userSorted) {
+                        this.table.columns().sort(this.lastSort.column, this.lastSort.dir)
+                    }
+                }
+                return this.getRemainingDocumentListPages(nextCursor)
+            }
+        )
     }
 
     onResize() {
@@ -200,9 +252,13 @@ export class DocumentOverview {
             ]
         })
         this.lastSort = {column: 0, dir: 'asc'}
+        // The pages loaded later are only sorted if the user has sorted the
+        // table, as they come in the order of the first page.
+        this.userSorted = false
 
         this.table.on('datatable.sort', (column, dir) => {
             this.lastSort = {column, dir}
+            this.userSorted = true
         })
 
         this.dtBulk.init(this.table.table)
@@ -1,7 +1,25 @@
-import {addAlert, postJson} from "../common"
+import {addAlert, post} from "../common"
 import {getSettings} from "../schema/convert"
 import {acceptAllNoInsertions} from "../editor/track"
 
+const readJsonLines = function(response, onValue) {
+    // Calls onValue with each value of a newline delimited JSON response as
+    // soon as its line has been received.
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    const read = () => reader.read().then(({done, value}) => {
+        buffer += done ? decoder.decode() : decoder.decode(value, {stream: true})
+        const lines = buffer.split('\n')
+        buffer = done ? '' : lines.pop()
+        lines.filter(line => line.length).forEach(line => onValue(JSON.parse(line)))
+        if (!done) {
+            return read()
+        }
+    })
+    return read()
+}
+
 export const getMissingDocumentListData = function(ids, documentList, schema) {
     // get extra data for the documents identified by the ids and updates the
     // documentList correspondingly.
@@ -14,28 +32,29 @@ export const getMissingDocumentListData = function(ids, documentList, schema) {
     })
 
     if (incompleteIds.length > 0) {
-        return postJson(
-            '/api/document/documentlist/extra/',
+        // The documents arrive one per line, so that each of them can be
+        // decoded and added as soon as it is there.
+        return post(
+            '/api/document/documentlist/extra/stream/',
             {
                 ids: incompleteIds.join(',')
             }
         ).then(
-            ({json}) => {
-                json.documents.forEach(
-                    extraValues => {
-                        const doc = documentList.find(entry => entry.id === extraValues.id)
-                        doc.contents = acceptAllNoInsertions(
-                            schema.nodeFromJSON(
-                                {type:'doc', content:[JSON.parse(extraValues.contents)]}
-                            )
-                        ).firstChild.toJSON()
-                        doc.comments = JSON.parse(extraValues.comments)
-                        doc.bibliography = JSON.parse(extraValues.bibliography)
-                        doc.images = extraValues.images
-                        doc.settings = getSettings(doc.contents)
-                    }
-                )
-            }
+            response => readJsonLines(
+                response,
+                extraValues => {
+                    const doc = documentList.find(entry => entry.id === extraValues.id)
+                    doc.contents = acceptAllNoInsertions(
+                        schema.nodeFromJSON(
+                            {type:'doc', content:[JSON.parse(extraValues.contents)]}
+                        )
+                    ).firstChild.toJSON()
+                    doc.comments = JSON.parse(extraValues.comments)
+                    doc.bibliography = JSON.parse(extraValues.bibliography)
+                    doc.images = extraValues.images
+                    doc.settings = getSettings(doc.contents)
+                }
+            )
         ).catch(
             () => {
                 addAlert('error', gettext('Could not obtain extra document data'))
@@ -0,0 +1,36 @@
+// Hashes of the top-level parts of a document, which the server compares
+// with its own (see document/helpers/content_hash.py).
+
+const CRC_TABLE = Array.from({length: 256}, (_, n) => {
+    let c = n
+    for (let k = 0; k < 8; k++) {
+        c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1
+    }
+    return c >>> 0
+})
+
+function crc32(string) {
+    let crc = 0xFFFFFFFF
+    new TextEncoder().encode(string).forEach(byte => {
+        crc = CRC_TABLE[(crc ^ byte) & 0xFF] ^ (crc >>> 8)
+    })
+    return (crc ^ 0xFFFFFFFF) >>> 0
+}
+
+// JSON with sorted keys, as written by the server.
+function canonicalJSON(value) {
+    if (Array.isArray(value)) {
+        return `[${value.map(item => canonicalJSON(item)).join(',')}]`
+    } else if (value && typeof value === 'object') {
+        return `{${
+            Object.keys(value).filter(key => value[key] !== undefined).sort().map(
+                key => `${JSON.stringify(key)}:${canonicalJSON(value[key])}`
+            ).join(',')
+        }}`
+    }
+    return JSON.stringify(value)
+}
+
+export function contentHashes(miniJson) {
+    return (miniJson.content || []).map(part => crc32(canonicalJSON(part)))
+}
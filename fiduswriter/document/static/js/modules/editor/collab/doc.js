@@ -7,7 +7,8 @@ import {
 } from "prosemirror-collab"
 import {
     Step,
-    Mapping
+    Mapping,
+    Transform
 } from "prosemirror-transform"
 import {
     EditorState
@@ -33,6 +34,9 @@ import {
 import {
     trackedTransaction
 } from "../track"
+import {
+    contentHashes
+} from "./content_hash"
 
 export class ModCollabDoc {
     constructor(mod) {
@@ -44,6 +48,8 @@ export class ModCollabDoc {
         this.awaitingDiffResponse = false
         this.receiving = false
         this.currentlyCheckingVersion = false
+        this.hashCheckTimer = false
+        this.hashCheckInterval = 60000 // Check that the document has not diverged at most once a minute
 
         this.trackOfflineLimit = 50 // Limit of local changes while offline for tracking to kick in when multiple users edit
         this.remoteTrackOfflineLimit = 20 // Limit of remote changes while offline for tracking to kick in when multiple users edit
@@ -94,6 +100,73 @@ export class ModCollabDoc {
         window.clearTimeout(this.sendNextDiffTimer)
         this.awaitingDiffResponse = false
         this.sendToCollaborators()
+        this.scheduleHashCheck()
+    }
+
+    scheduleHashCheck() {
+        if (this.hashCheckTimer) {
+            return
+        }
+        this.hashCheckTimer = window.setTimeout(
+            () => {
+                this.hashCheckTimer = false
+                this.checkHash()
+            },
+            this.hashCheckInterval
+        )
+    }
+
+    checkHash() {
+        // The server compares the hashes of the parts of the last confirmed
+        // version with its own and sends the parts that differ.
+        if (!this.mod.editor.ws.connected || !this.mod.editor.docInfo.confirmedJson) {
+            return
+        }
+        this.mod.editor.ws.send(() => ({
+            type: 'check_hash',
+            v: this.mod.editor.docInfo.version,
+            h: contentHashes(this.mod.editor.docInfo.confirmedJson)
+        }))
+    }
+
+    repairDocument(data) {
+        if (data.v !== this.mod.editor.docInfo.version) {
+            // Diffs have arrived in the meantime.
+            return
+        }
+        const confirmedDoc = this.mod.editor.docInfo.confirmedDoc,
+            article = confirmedDoc.firstChild,
+            schema = this.mod.editor.schema,
+            positions = [1]
+        article.forEach(part => positions.push(positions[positions.length - 1] + part.nodeSize))
+        const transform = new Transform(confirmedDoc),
+            parts = data.parts.map(([index, part]) => [index, schema.nodeFromJSON(part)])
+        // Parts at the end are added or removed first, so that the positions
+        // of the others stay the same.
+        if (data.length < article.childCount) {
+            transform.delete(positions[data.length], positions[article.childCount])
+        }
+        parts.filter(([index, _part]) => index >= article.childCount).forEach(
+            ([_index, part]) => transform.insert(transform.doc.firstChild.nodeSize - 1, part)
+        )
+        parts.filter(([index, _part]) => index < article.childCount).reverse().forEach(
+            ([index, part]) => transform.replaceWith(positions[index], positions[index + 1], part)
+        )
+        if (!transform.steps.length) {
+            return
+        }
+        this.receiving = true
+        // The steps come from the server, so they are not sent back.
+        const tr = receiveTransaction(
+            this.mod.editor.view.state,
+            transform.steps,
+            transform.steps.map(_ => 'repair')
+        )
+        tr.setMeta('remote', true)
+        this.mod.editor.view.dispatch(tr)
+        this.setConfirmedDoc(tr, transform.steps.length)
+        this.receiving = false
+        this.sendToCollaborators()
     }
 
     receiveDocument(data) {
@@ -9,6 +9,8 @@ export class ModCollab {
         editor.mod.collab = this
         this.editor = editor
         this.participants = []
+        // The participant list as sent by the server, one entry per session.
+        this.participantList = []
         this.sessionIds = false
         this.collaborativeMode = false
 
@@ -21,6 +23,11 @@ export class ModCollab {
         const allSessionIds = [],
             participantObj = {}
 
+        this.participantList = participantArray
+        // The entries are changed below.
+        participantArray = participantArray.map(
+            participant => Object.assign({}, participant)
+        )
         participantArray.forEach(participant => {
             const entry = participantObj[participant.id]
             allSessionIds.push(participant.session_id)
@@ -77,4 +84,27 @@ export class ModCollab {
         }
         this.chat.showChat(participantArray)
     }
+
+    addParticipant(participant) {
+        if (!this.sessionIds) {
+            // The full list has not arrived yet.
+            return
+        }
+        this.updateParticipantList(
+            this.participantList.filter(
+                entry => entry.session_id !== participant.session_id
+            ).concat([participant])
+        )
+    }
+
+    removeParticipant(sessionId) {
+        if (!this.sessionIds) {
+            return
+        }
+        this.updateParticipantList(
+            this.participantList.filter(
+                entry => entry.session_id !== sessionId
+            )
+        )
+    }
 }
@@ -251,11 +251,20 @@ export class Editor {
                     if (this.ws.connectionCount) {
                         message.connection = this.ws.connectionCount
                     }
+                    if (this.ws.resumeFrom) {
+                        // The server sends what has been missed since.
+                        message.resume = Object.assign(
+                            {v: this.docInfo.version},
+                            this.ws.resumeFrom
+                        )
+                    }
                     return message
                 },
-                resubScribed: () => {
+                resubScribed: resumed => {
                     this.mod.footnotes.fnEditor.renderAllFootnotes()
-                    this.mod.collab.doc.checkVersion()
+                    if (!resumed) {
+                        this.mod.collab.doc.checkVersion()
+                    }
                 },
                 restartMessage: () => ({type: 'get_document'}), // Too many messages have been lost and we need to restart
                 messagesElement: () => this.dom.querySelector('#unobtrusive_messages'),
@@ -272,6 +281,12 @@ export class Editor {
                         case 'connections':
                             this.mod.collab.updateParticipantList(data.participant_list)
                             break
+                        case 'participant_joined':
+                            this.mod.collab.addParticipant(data.participant)
+                            break
+                        case 'participant_left':
+                            this.mod.collab.removeParticipant(data.session_id)
+                            break
                         case 'styles':
                             this.mod.documentTemplate.setStyles(data.styles)
                             break
@@ -312,6 +327,9 @@ export class Editor {
                         case 'reject_diff':
                             this.mod.collab.doc.rejectDiff(data["rid"])
                             break
+                        case 'repair':
+                            this.mod.collab.doc.repairDocument(data)
+                            break
                     }
                 }
 
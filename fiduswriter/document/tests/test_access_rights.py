@@ -0,0 +1,111 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from document.helpers.access_rights import access_rights_cache, \
+    get_document_access
+from document.models import AccessRight
+from testing.document_helper import create_document
+
+
+class AccessRightsCacheTest(TestCase):
+
+    def setUp(self):
+        access_rights_cache.clear()
+        self.owner = User.objects.create(username='Owner')
+        self.reader = User.objects.create(username='Reader')
+        self.document = create_document(self.owner)
+
+    def tearDown(self):
+        access_rights_cache.clear()
+
+    def test_owner(self):
+        with CaptureQueriesContext(connection) as queries:
+            access = get_document_access(self.document.id, self.owner)
+        self.assertEqual(access.rights, 'write')
+        self.assertEqual(access.owner_id, self.owner.id)
+        # The contents of the document are not loaded.
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('contents', queries[0]['sql'])
+        with self.assertNumQueries(0):
+            get_document_access(self.document.id, self.owner)
+        self.assertIsNone(
+            get_document_access(self.document.id + 1, self.owner)
+        )
+
+    def test_access_rights(self):
+        self.assertIsNone(
+            get_document_access(self.document.id, self.reader).rights
+        )
+        with self.assertNumQueries(0):
+            get_document_access(self.document.id, self.reader)
+        access_right = AccessRight.objects.create(
+            document=self.document,
+            user=self.reader,
+            rights='read'
+        )
+        self.assertEqual(
+            get_document_access(self.document.id, self.reader).rights,
+            'read'
+        )
+        access_right.rights = 'write'
+        access_right.save()
+        self.assertEqual(
+            get_document_access(self.document.id, self.reader).rights,
+            'write'
+        )
+        access_right.delete()
+        self.assertIsNone(
+            get_document_access(self.document.id, self.reader).rights
+        )
+
+    def test_owner_change(self):
+        get_document_access(self.document.id, self.reader)
+        # Saving the document with the same owner keeps the cache.
+        self.document.title = 'Title'
+        self.document.save()
+        with self.assertNumQueries(0):
+            get_document_access(self.document.id, self.reader)
+        self.document.owner = self.reader
+        self.document.save()
+        self.assertEqual(
+            get_document_access(self.document.id, self.reader).rights,
+            'write'
+        )
+        document_id = self.document.id
+        self.document.delete()
+        self.assertIsNone(get_document_access(document_id, self.reader))
+
+    def test_cleared_during_lookup(self):
+        access_right = AccessRight.objects.create(
+            document=self.document,
+            user=self.reader,
+            rights='read'
+        )
+        access_rights_cache.clear()
+        filter_rights = AccessRight.objects.filter
+
+        def filter_and_revoke(**kwargs):
+            # The right is revoked after it has been read.
+            rights = filter_rights(**kwargs).values_list(
+                'rights',
+                flat=True
+            ).first()
+            access_right.delete()
+            queryset = Mock()
+            queryset.values_list.return_value.first.return_value = rights
+            return queryset
+
+        with patch.object(AccessRight.objects, 'filter', filter_and_revoke):
+            self.assertEqual(
+                get_document_access(self.document.id, self.reader).rights,
+                'read'
+            )
+        # The revoked right has not been cached.
+        self.assertIsNone(
+            get_document_access(self.document.id, self.reader).rights
+        )
+        self.assertEqual(access_rights_cache.lookups, {})
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, override_settings
+from tornado.escape import json_decode
+from tornado.gen import sleep
+from tornado.ioloop import IOLoop
+
+from document.ws_views import WebSocket
+
+
+def make_waiter(session_id, user_id, access_rights):
+    waiter = WebSocket.__new__(WebSocket)
+    waiter.id = session_id
+    waiter.messages = {'server': 0, 'client': 3, 'recent': []}
+    waiter.outbox = OrderedDict()
+    waiter.user_info = SimpleNamespace(
+        access_rights=access_rights,
+        user=SimpleNamespace(id=user_id),
+        document_id=1000
+    )
+    waiter.sent = []
+    waiter.send = waiter.sent.append
+    return waiter
+
+
+class BroadcastTest(SimpleTestCase):
+
+    def setUp(self):
+        self.waiters = [
+            make_waiter(0, 1, 'write'),
+            make_waiter(1, 2, 'write'),
+            make_waiter(2, 3, 'read-without-comments'),
+            make_waiter(3, 4, 'review'),
+            make_waiter(4, 5, 'read')
+        ]
+        WebSocket.sessions[1000] = {
+            'participants': {waiter.id: waiter for waiter in self.waiters},
+            'version': 3,
+            'selections': {},
+            'selection_timer': None,
+            'roster': {}
+        }
+        for waiter in self.waiters:
+            waiter.doc = WebSocket.sessions[1000]
+
+    def tearDown(self):
+        del WebSocket.sessions[1000]
+
+    def received(self, waiter):
+        return [json_decode(data) for data in waiter.sent]
+
+    def test_counters(self):
+        message = {'type': 'diff', 'v': 3, 'c': 9, 's': 9, 'comments': [1]}
+        self.waiters[1].messages['server'] = 5
+        WebSocket.send_updates(message, 1000, 0, 1, publish=False)
+        self.assertEqual(self.waiters[0].sent, [])
+        self.assertEqual(
+            self.received(self.waiters[1]),
+            [{'type': 'diff', 'v': 3, 'c': 3, 's': 6, 'comments': [1]}]
+        )
+        # Readers without comments and reviewers do not receive the comments
+        # of others.
+        self.assertEqual(
+            self.received(self.waiters[2]),
+            [{'type': 'diff', 'v': 3, 'c': 3, 's': 1, 'comments': []}]
+        )
+        self.assertEqual(
+            self.received(self.waiters[3])[0]['comments'],
+            []
+        )
+        self.assertEqual(
+            self.received(self.waiters[4])[0]['comments'],
+            [1]
+        )
+        # The shared message is not modified.
+        self.assertEqual(message['s'], 9)
+
+    def test_resend(self):
+        WebSocket.send_updates({'type': 'chat'}, 1000, 0, 1, publish=False)
+        WebSocket.send_updates({'type': 'chat'}, 1000, 0, 1, publish=False)
+        waiter = self.waiters[1]
+        IOLoop.current().run_sync(lambda: waiter.resend_messages(0))
+        self.assertEqual(
+            [message['s'] for message in self.received(waiter)],
+            [1, 2, 1, 2]
+        )
+        # Reviewers cannot chat.
+        self.assertEqual(self.waiters[3].sent, [])
+
+    @override_settings(DOC_SELECTION_INTERVAL=0.01)
+    def test_selections(self):
+        doc = WebSocket.sessions[1000]
+        for head in range(3):
+            self.waiters[0].handle_selection_change({
+                'type': 'selection_change',
+                'session_id': 0,
+                'v': 3,
+                'head': head
+            })
+        self.waiters[1].handle_selection_change({
+            'type': 'selection_change',
+            'session_id': 1,
+            'v': 3,
+            'head': 0
+        })
+        self.assertEqual(self.waiters[4].sent, [])
+        IOLoop.current().run_sync(lambda: sleep(0.05))
+        # Only the newest selection of each participant is sent.
+        self.assertEqual(
+            [
+                (message['session_id'], message['head'])
+                for message in self.received(self.waiters[4])
+            ],
+            [(0, 2), (1, 0)]
+        )
+        # A selection in a version that has been changed is dropped.
+        self.waiters[0].handle_selection_change({
+            'type': 'selection_change',
+            'session_id': 0,
+            'v': 3,
+            'head': 3
+        })
+        doc['version'] = 4
+        IOLoop.current().run_sync(lambda: sleep(0.05))
+        self.assertEqual(len(self.waiters[4].sent), 2)
+
+    def test_roster(self):
+        info = {'id': 1, 'name': 'A', 'session_id': 0}
+        WebSocket.add_to_roster(1000, info)
+        # A participant on another server process.
+        WebSocket.receive_publication({
+            'kind': 'join',
+            'info': {'id': 6, 'name': 'F', 'session_id': 5},
+            'channel': '1000'
+        })
+        self.assertEqual(
+            [
+                (message['type'], message['participant']['id'])
+                for message in self.received(self.waiters[1])
+            ],
+            [('participant_joined', 1), ('participant_joined', 6)]
+        )
+        self.assertEqual(
+            [message['type'] for message in self.received(self.waiters[0])],
+            ['participant_joined']
+        )
+        # Reviewers cannot chat.
+        self.assertEqual(self.waiters[3].sent, [])
+        # A participant that cannot communicate is not in the roster.
+        WebSocket.remove_from_roster(1000, 3)
+        WebSocket.receive_publication({
+            'kind': 'leave',
+            'session_id': 5,
+            'channel': '1000'
+        })
+        self.assertEqual(
+            self.received(self.waiters[1])[-1],
+            {'type': 'participant_left', 'session_id': 5, 'c': 3, 's': 3}
+        )
+        # The whole list is only sent to the participant that asks for it.
+        self.waiters[1].handle_participant_update()
+        self.assertEqual(
+            self.received(self.waiters[1])[-1]['participant_list'],
+            [info]
+        )
+        self.assertEqual(len(self.waiters[4].sent), 3)
+        # The roster is replaced once the connection to the session broker
+        # has been opened again.
+        other_info = {'id': 7, 'name': 'G', 'session_id': 6}
+        WebSocket.receive_publication({
+            'kind': 'roster',
+            'participants': [info, other_info],
+            'channel': '1000'
+        })
+        self.assertEqual(
+            self.received(self.waiters[1])[-1]['participant_list'],
+            [info, other_info]
+        )
+        self.assertEqual(len(self.waiters[3].sent), 0)
+
+    def test_pending_publications(self):
+        # Publications for a document that is being loaded are handled once
+        # it is in place. Diffs that were loaded with it are skipped.
+        WebSocket.pending_publications[1000] = []
+        for version in [2, 3]:
+            WebSocket.receive_publication({
+                'kind': 'diff',
+                'message': {'type': 'diff', 'v': version},
+                'user': 2,
+                'channel': '1000'
+            })
+        self.assertEqual(self.waiters[1].sent, [])
+        WebSocket.sessions[1000]['loaded'] = False
+        WebSocket.release_publications(1000)
+        self.assertEqual(
+            [message['v'] for message in self.received(self.waiters[1])],
+            [3]
+        )
+        self.assertEqual(WebSocket.sessions[1000]['version'], 4)
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from tornado.escape import json_decode
+
+from document.helpers.content_hash import ContentHashes, content_hash
+from document.helpers.diff_history import DiffHistory
+from document.ws_views import WebSocket
+
+
+def make_contents():
+    return {
+        'type': 'article',
+        'content': [
+            {'type': 'title', 'content': [{'type': 'text', 'text': 'Title'}]},
+            {'type': 'abstract', 'attrs': {'hidden': True}},
+            {'type': 'body', 'content': [{'type': 'paragraph'}]}
+        ]
+    }
+
+
+class ContentHashTest(SimpleTestCase):
+
+    def test_hash(self):
+        # Hashes as computed by the client.
+        self.assertEqual(
+            content_hash({'type': 'text', 'text': 'H\xe9llo', 'b': 2.0}),
+            content_hash({'text': 'H\xe9llo', 'b': 2, 'type': 'text'})
+        )
+        self.assertNotEqual(
+            content_hash({'type': 'text', 'text': 'Hello'}),
+            content_hash({'type': 'text', 'text': 'Hallo'})
+        )
+
+    def test_update(self):
+        contents = make_contents()
+        hashes = ContentHashes()
+        first_hashes = hashes.get(contents)
+        self.assertEqual(len(first_hashes), 3)
+        contents['content'][2]['content'].append({'type': 'paragraph'})
+        hashes.update([{
+            'op': 'add',
+            'path': '/content/2/content/1',
+            'value': {'type': 'paragraph'}
+        }])
+        self.assertEqual(sorted(hashes.hashes), [0, 1])
+        second_hashes = hashes.get(contents)
+        self.assertEqual(second_hashes[:2], first_hashes[:2])
+        self.assertNotEqual(second_hashes[2], first_hashes[2])
+        contents['content'].pop(1)
+        hashes.update([{'op': 'remove', 'path': '/content/1'}])
+        self.assertEqual(hashes.hashes, {})
+        self.assertEqual(
+            hashes.get(contents),
+            [second_hashes[0], second_hashes[2]]
+        )
+
+
+class CheckHashTest(SimpleTestCase):
+
+    def setUp(self):
+        self.waiter = WebSocket.__new__(WebSocket)
+        self.waiter.id = 0
+        self.waiter.messages = {'server': 0, 'client': 0, 'recent': []}
+        self.waiter.outbox = OrderedDict()
+        self.waiter.user_info = SimpleNamespace(document_id=1000)
+        self.waiter.sent = []
+        self.waiter.send = self.waiter.sent.append
+        self.waiter.doc = {
+            'version': 4,
+            'contents': make_contents(),
+            'last_diffs': DiffHistory(),
+            'content_hashes': ContentHashes()
+        }
+
+    def test_in_sync(self):
+        contents = make_contents()
+        self.waiter.check_hash({
+            'type': 'check_hash',
+            'v': 4,
+            'h': [content_hash(part) for part in contents['content']]
+        })
+        self.assertEqual(self.waiter.sent, [])
+
+    def test_diverged(self):
+        contents = make_contents()
+        contents['content'][0]['content'][0]['text'] = 'Titel'
+        contents['content'].pop()
+        self.waiter.check_hash({
+            'type': 'check_hash',
+            'v': 4,
+            'h': [content_hash(part) for part in contents['content']]
+        })
+        repair = json_decode(self.waiter.sent[0])
+        self.assertEqual(repair['type'], 'repair')
+        self.assertEqual(repair['length'], 3)
+        # Only the parts that differ are sent.
+        self.assertEqual(
+            [index for index, part in repair['parts']],
+            [0, 2]
+        )
+        self.assertEqual(
+            repair['parts'][0][1],
+            self.waiter.doc['contents']['content'][0]
+        )
+
+    def test_other_version(self):
+        WebSocket.apply_diff(self.waiter.doc, {
+            'type': 'diff',
+            'v': 4,
+            'jd': [{'op': 'remove', 'path': '/content/1'}]
+        }, 100)
+        self.waiter.check_hash({'type': 'check_hash', 'v': 4, 'h': []})
+        self.assertEqual(self.waiter.sent, [])
+        self.assertEqual(
+            len(self.waiter.doc['content_hashes'].get(
+                self.waiter.doc['contents']
+            )),
+            2
+        )
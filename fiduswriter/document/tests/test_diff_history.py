@@ -0,0 +1,46 @@
+from django.test import SimpleTestCase
+
+from document.helpers.diff_history import DiffHistory
+
+
+class DiffHistoryTest(SimpleTestCase):
+
+    def test_since(self):
+        history = DiffHistory(max_length=3)
+        self.assertIsNone(history.since(0))
+        for version in range(5, 10):
+            history.append(version, {'type': 'diff', 'v': version}, 10)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.first_version, 7)
+        self.assertEqual(
+            [message['v'] for message in history.since(8)],
+            [8, 9]
+        )
+        self.assertEqual(history.since(10), [])
+        # Dropped and future versions are not available.
+        self.assertIsNone(history.since(6))
+        self.assertIsNone(history.since(11))
+
+    def test_gap(self):
+        history = DiffHistory()
+        history.append(0, {'v': 0}, 10)
+        history.append(1, {'v': 1}, 10)
+        history.append(5, {'v': 5}, 10)
+        self.assertEqual(list(history), [{'v': 5}])
+        self.assertIsNone(history.since(1))
+
+    def test_max_bytes(self):
+        history = DiffHistory(max_length=100, max_bytes=25)
+        for version in range(4):
+            history.append(version, {'v': version}, 10)
+        self.assertEqual(history.size, 20)
+        self.assertEqual(history.first_version, 2)
+        # A diff larger than the limit is not kept at all.
+        history.append(4, {'v': 4}, 30)
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.size, 0)
+        self.assertEqual(history.since(5), [])
+        self.assertIsNone(history.since(4))
+        history.append(5, {'v': 5, 'ti': 'Title'}, 20)
+        self.assertEqual(history.size, 20)
+        self.assertEqual(history.since(5), [{'v': 5, 'ti': 'Title'}])
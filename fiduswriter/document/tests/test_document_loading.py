@@ -0,0 +1,77 @@
+import zlib
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from document.models import Document, DocumentBody
+from testing.document_helper import create_document
+
+
+class DocumentLoadingTest(TestCase):
+
+    def setUp(self):
+        self.document = create_document(
+            User.objects.create(username='Owner'),
+            last_diffs='[{"v": 0}]'
+        )
+
+    def test_deferred(self):
+        with CaptureQueriesContext(connection) as queries:
+            document = Document.objects.get(id=self.document.id)
+        self.assertNotIn('contents', queries[0]['sql'])
+        # The body is loaded when accessed.
+        with self.assertNumQueries(1):
+            self.assertEqual(document.last_diffs, '[{"v": 0}]')
+            self.assertEqual(document.comments, '{}')
+
+    def test_with_body(self):
+        with self.assertNumQueries(1):
+            document = Document.objects.with_body().get(id=self.document.id)
+            self.assertEqual(document.contents, self.document.contents)
+            self.assertEqual(document.last_diffs, '[{"v": 0}]')
+        document = Document.objects.filter(
+            id=self.document.id
+        ).with_body('contents').first()
+        self.assertEqual(
+            document.body.get_deferred_fields(),
+            {'last_diffs', 'comments', 'bibliography'}
+        )
+
+    def test_compressed(self):
+        contents = '{"type": "doc", "content": [%s]}' % ', '.join(
+            ['{"type": "paragraph"}'] * 100
+        )
+        document = Document.objects.get(id=self.document.id)
+        document.contents = contents
+        document.save()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT contents FROM document_documentbody '
+                'WHERE document_id = %s',
+                [self.document.id]
+            )
+            stored = bytes(cursor.fetchone()[0])
+        self.assertLess(len(stored), len(contents) / 10)
+        self.assertEqual(zlib.decompress(stored).decode('utf-8'), contents)
+
+    def test_save(self):
+        # Only the fields of the body that have been loaded are saved.
+        document = Document.objects.with_body('contents').get(
+            id=self.document.id
+        )
+        document.contents = '{"type": "doc"}'
+        DocumentBody.objects.filter(document_id=self.document.id).update(
+            last_diffs='[{"v": 1}]'
+        )
+        document.title = 'Title'
+        document.save()
+        document = Document.objects.with_body().get(id=self.document.id)
+        self.assertEqual(document.title, 'Title')
+        self.assertEqual(document.contents, '{"type": "doc"}')
+        self.assertEqual(document.last_diffs, '[{"v": 1}]')
+        # The body is not saved if it has not been changed.
+        document.title = 'Other title'
+        with self.assertNumQueries(1):
+            document.save()
@@ -0,0 +1,159 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from document.models import AccessRight, Document, DocumentRevision, \
+    DocumentTemplate
+
+
+class DocumentListQueriesTest(TestCase):
+
+    def setUp(self):
+        # Avatars are cached by user id.
+        cache.clear()
+        self.user = User.objects.create(username='Reader')
+        self.template = DocumentTemplate.objects.create(title='Standard')
+        self.client.force_login(self.user)
+
+    def add_documents(self, start, end):
+        for index in range(start, end):
+            owner = User.objects.create(username='Owner%d' % index)
+            document = Document.objects.create(
+                owner=owner,
+                template=self.template,
+                title='Shared %d' % index
+            )
+            AccessRight.objects.create(
+                document=document,
+                user=self.user,
+                rights='read'
+            )
+            DocumentRevision.objects.create(
+                document=document,
+                note='Revision of %d' % index
+            )
+            Document.objects.create(
+                owner=self.user,
+                template=self.template,
+                title='Own %d' % index
+            )
+
+    def get_documentlist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/document/documentlist/',
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['documents'], len(queries)
+
+    def test_constant_queries(self):
+        self.add_documents(0, 2)
+        documents, few_queries = self.get_documentlist()
+        self.assertEqual(len(documents), 4)
+        self.add_documents(2, 10)
+        documents, many_queries = self.get_documentlist()
+        self.assertEqual(len(documents), 20)
+        self.assertEqual(few_queries, many_queries)
+        shared = [
+            document for document in documents
+            if document['title'] == 'Shared 0'
+        ][0]
+        self.assertEqual(shared['rights'], 'read')
+        self.assertFalse(shared['is_owner'])
+        self.assertEqual(shared['owner']['name'], 'Owner0')
+        self.assertEqual(
+            [revision['note'] for revision in shared['revisions']],
+            ['Revision of 0']
+        )
+
+    def post(self, url, data={}):
+        response = self.client.post(
+            url,
+            data,
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages(self):
+        self.add_documents(0, 5)
+        titles = []
+        cursor = ''
+        while cursor is not None:
+            page = self.post('/api/document/documentlist/page/', {
+                'limit': 3,
+                'cursor': cursor
+            })
+            self.assertLessEqual(len(page['documents']), 3)
+            self.assertEqual('team_members' in page, cursor == '')
+            titles += [document['title'] for document in page['documents']]
+            cursor = page['next_cursor']
+        self.assertEqual(len(titles), 10)
+        self.assertEqual(len(set(titles)), 10)
+        # The limit is kept between 1 and the page size.
+        for limit, length in [(0, 1), (-1, 1), (100, 10)]:
+            page = self.post('/api/document/documentlist/page/', {
+                'limit': limit
+            })
+            self.assertEqual(len(page['documents']), length)
+        for data in [
+            {'limit': 'many'},
+            {'owner': 'me'},
+            {'cursor': 'last'},
+            {'cursor': 'yesterday_1'},
+            {'cursor': '2020-13-01T00:00:00_1'},
+            {'cursor': '2020-01-01T00:00:00_x'}
+        ]:
+            response = self.client.post(
+                '/api/document/documentlist/page/',
+                data,
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+            self.assertEqual(response.status_code, 400)
+        page = self.post('/api/document/documentlist/page/', {
+            'title': 'shared',
+            'rights': 'read'
+        })
+        self.assertEqual(len(page['documents']), 5)
+        page = self.post('/api/document/documentlist/page/', {
+            'owner': self.user.id,
+            'rights': 'write'
+        })
+        self.assertEqual(
+            sorted(document['title'] for document in page['documents']),
+            ['Own %d' % index for index in range(5)]
+        )
+        document_id = Document.objects.get(title='Shared 1').id
+        revisions = self.post('/api/document/documentlist/revisions/', {
+            'ids': str(document_id)
+        })['revisions']
+        self.assertEqual(
+            [revision['note'] for revision in revisions[str(document_id)]],
+            ['Revision of 1']
+        )
+
+    def test_extra_stream(self):
+        self.add_documents(0, 3)
+        ids = ','.join(
+            str(doc_id) for doc_id in
+            Document.objects.values_list('id', flat=True)
+        )
+        extra = self.post('/api/document/documentlist/extra/', {'ids': ids})
+        response = self.client.post(
+            '/api/document/documentlist/extra/stream/',
+            {'ids': ids},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            sorted(json.loads(line)['id'] for line in lines),
+            sorted(document['id'] for document in extra['documents'])
+        )
+        self.assertEqual(len(lines), 6)
@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from tornado.ioloop import IOLoop
+
+from document.ws_views import WebSocket
+from testing.document_helper import create_document
+
+
+@override_settings(DOC_IDLE_TIME=None)
+class EvictionTest(TransactionTestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='Writer')
+        self.documents = [create_document(user) for index in range(3)]
+
+    def tearDown(self):
+        for document in self.documents:
+            WebSocket.sessions.pop(document.id, None)
+            WebSocket.loaded_sessions.pop(document.id, None)
+
+    def use_document(self, document_id):
+        IOLoop.current().run_sync(
+            lambda: WebSocket.use_document(document_id)
+        )
+
+    def open_document(self, document):
+        WebSocket.sessions[document.id] = WebSocket.load_document(document)
+        self.use_document(document.id)
+        return WebSocket.sessions[document.id]
+
+    def test_reload(self):
+        doc = self.open_document(self.documents[0])
+        message = {
+            'type': 'diff',
+            'v': 0,
+            'ti': 'Evicted',
+            'jd': [{'op': 'add', 'path': '/content/0', 'value': 'x'}]
+        }
+        doc['unsaved_diffs'].append((0, '{"type": "diff", "v": 0}'))
+        WebSocket.apply_diff(doc, message, 100)
+        WebSocket.evict_document(doc['id'])
+        self.assertFalse(doc['loaded'])
+        self.assertIsNone(doc['contents'])
+        self.assertNotIn(doc['id'], WebSocket.loaded_sessions)
+        self.use_document(doc['id'])
+        self.assertTrue(doc['loaded'])
+        self.assertEqual(doc['version'], 1)
+        self.assertEqual(doc['title'], 'Evicted')
+        self.assertEqual(doc['contents']['content'], ['x'])
+
+    @override_settings(DOC_SESSIONS_MAX_SIZE=100)
+    def test_lru(self):
+        # Each document takes up 34 bytes.
+        docs = [self.open_document(document) for document in self.documents]
+        self.assertEqual(
+            [doc['loaded'] for doc in docs],
+            [False, True, True]
+        )
+        self.use_document(docs[1]['id'])
+        self.use_document(docs[0]['id'])
+        self.assertEqual(
+            [doc['loaded'] for doc in docs],
+            [True, True, False]
+        )
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+
+from django.test import SimpleTestCase, override_settings
+from tornado.concurrent import Future
+from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+
+from document.ws_views import WebSocket
+
+
+class SlowWaiter(WebSocket):
+    # A connection whose client only takes a message when it is told to.
+
+    def __init__(self):
+        self.id = 0
+        self.messages = {'server': 0, 'client': 0, 'recent': []}
+        self.outbox = OrderedDict()
+        self.writes = []
+        self.resyncs = 0
+
+    def send(self, message):
+        future = Future()
+        self.writes.append((json_decode(message), future))
+        return future
+
+    def take(self):
+        # The client takes the messages written so far.
+        for message, future in self.writes:
+            if not future.done():
+                future.set_result(None)
+        IOLoop.current().run_sync(lambda: None)
+
+    async def resync(self):
+        self.resyncs += 1
+
+
+class OutboxTest(SimpleTestCase):
+
+    def setUp(self):
+        self.waiter = SlowWaiter()
+
+    def written(self):
+        return [message for message, future in self.waiter.writes]
+
+    def test_one_at_a_time(self):
+        for number in range(3):
+            self.waiter.send_message({'type': 'diff', 'v': number})
+        self.assertEqual(len(self.waiter.writes), 1)
+        self.assertEqual(len(self.waiter.outbox), 2)
+        self.waiter.take()
+        self.waiter.take()
+        self.assertEqual(
+            [(message['v'], message['s']) for message in self.written()],
+            [(0, 1), (1, 2), (2, 3)]
+        )
+
+    def test_coalesce(self):
+        self.waiter.send_message({'type': 'diff', 'v': 0})
+        for session_id in [1, 2, 1]:
+            self.waiter.send_message({
+                'type': 'selection_change',
+                'session_id': session_id,
+                'v': 1,
+                'head': session_id
+            })
+        for participant_list in [[], [1]]:
+            self.waiter.send_message({
+                'type': 'connections',
+                'participant_list': participant_list
+            })
+            self.waiter.send_message({'type': 'diff', 'v': 1})
+        for number in range(6):
+            self.waiter.take()
+        written = self.written()
+        self.assertEqual(
+            [
+                (message['type'], message.get('session_id'))
+                for message in written
+            ],
+            [
+                ('diff', None),
+                ('selection_change', 2),
+                ('selection_change', 1),
+                ('diff', None),
+                ('connections', None),
+                ('diff', None)
+            ]
+        )
+        # The dropped messages are not counted.
+        self.assertEqual(
+            [message['s'] for message in written],
+            [1, 2, 3, 4, 5, 6]
+        )
+        self.assertEqual(written[4]['participant_list'], [1])
+        self.assertEqual(self.waiter.outbox_bytes, 0)
+
+    @override_settings(WS_OUTBOX_MESSAGES=5)
+    def test_slow_client(self):
+        for number in range(7):
+            self.waiter.send_message({'type': 'diff', 'v': number})
+        IOLoop.current().run_sync(lambda: None)
+        self.assertEqual(self.waiter.resyncs, 1)
+        self.assertTrue(self.waiter.resyncing)
+        self.assertEqual(len(self.waiter.outbox), 0)
+        # Further messages are dropped until the client has been resynced.
+        self.waiter.send_message({'type': 'diff', 'v': 7})
+        self.assertEqual(len(self.waiter.outbox), 0)
+
+    @override_settings(WS_RESEND_MESSAGE_BYTES=100)
+    def test_resend_buffer(self):
+        self.waiter.send_message({'type': 'doc_data', 'doc': {}})
+        self.waiter.take()
+        self.waiter.send_message({'type': 'chat', 'text': 'x' * 100})
+        self.waiter.take()
+        self.waiter.send_message({'type': 'diff', 'v': 0})
+        self.waiter.take()
+        # Only the type of the document and large messages is kept.
+        self.assertEqual(
+            self.waiter.messages['recent'][:2],
+            [({'type': 'doc_data'}, None), ({'type': 'chat'}, None)]
+        )
+        sent_documents = []
+
+        async def send_document():
+            sent_documents.append(True)
+
+        self.waiter.send_document = send_document
+        # The diff can be sent again.
+        IOLoop.current().run_sync(lambda: self.waiter.resend_messages(2))
+        self.assertEqual(sent_documents, [])
+        self.waiter.take()
+        self.assertEqual(self.written()[-1]['v'], 0)
+        # A client that has missed the large messages receives the document.
+        IOLoop.current().run_sync(lambda: self.waiter.resend_messages(0))
+        self.assertEqual(sent_documents, [True])
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from threading import Thread
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils import timezone
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+
+from document import ws_views
+from document.ws_views import WebSocket
+from testing.document_helper import create_document
+from user.models import TeamMember
+
+
+class PayloadCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username='Owner')
+        self.document = create_document(self.owner)
+        self.doc = WebSocket.load_document(self.document)
+        WebSocket.sessions[self.document.id] = self.doc
+        WebSocket.io_loop = IOLoop.current()
+        self.waiter = WebSocket.__new__(WebSocket)
+        self.waiter.id = 0
+        self.waiter.doc = self.doc
+        self.waiter.user = self.owner
+        self.waiter.messages = {'server': 0, 'client': 0, 'recent': []}
+        self.waiter.outbox = OrderedDict()
+        self.waiter.user_info = SimpleNamespace(
+            access_rights='write',
+            is_owner=True,
+            user=self.owner
+        )
+        self.waiter.sent = []
+        self.waiter.send = self.waiter.sent.append
+
+    def tearDown(self):
+        del WebSocket.sessions[self.document.id]
+        WebSocket.loaded_sessions.pop(self.document.id, None)
+        WebSocket.io_loop = None
+
+    def get_payloads(self):
+        return IOLoop.current().run_sync(self.waiter.get_payloads)
+
+    def test_joiners(self):
+        self.waiter.send_doc_data(self.get_payloads())
+        # The payloads are only looked up for the first participant.
+        with self.assertNumQueries(0):
+            payloads = self.get_payloads()
+            self.waiter.send_styles(payloads, {})
+            self.waiter.send_doc_data(payloads)
+        member = User.objects.create(username='Member')
+        TeamMember.objects.create(leader=self.owner, member=member)
+        IOLoop.current().run_sync(self.waiter.send_document)
+        self.assertEqual(
+            [
+                team_member['id'] for team_member in
+                json_decode(self.waiter.sent[-1])['doc_info']['owner'][
+                    'team_members'
+                ]
+            ],
+            [member.id]
+        )
+
+    def test_cleared_during_lookup(self):
+        # A payload that is removed while it is looked up is sent, but not
+        # cached.
+        get_owner_info = WebSocket.get_owner_info
+
+        def get_changed_owner_info(doc_owner):
+            owner = get_owner_info(doc_owner)
+            WebSocket.clear_payloads('owner', self.document.id)
+            return owner
+
+        with patch.object(WebSocket, 'get_owner_info', get_changed_owner_info):
+            payloads = self.get_payloads()
+        self.assertEqual(payloads['owner']['id'], self.owner.id)
+        self.assertNotIn('owner', self.doc['payloads'])
+        self.assertIn('images', self.doc['payloads'])
+
+    def test_cleared_from_thread(self):
+        self.get_payloads()
+        thread = Thread(
+            target=WebSocket.clear_payloads,
+            args=('owner', self.document.id)
+        )
+        thread.start()
+        thread.join()
+        # The payload is removed on the IOLoop.
+        self.assertIn('owner', self.doc['payloads'])
+        IOLoop.current().run_sync(lambda: gen.sleep(0))
+        self.assertNotIn('owner', self.doc['payloads'])
+
+    def test_owner_fields(self):
+        self.get_payloads()
+        self.owner.last_login = timezone.now()
+        self.owner.save(update_fields=['last_login'])
+        self.assertIn('owner', self.doc['payloads'])
+        self.owner.first_name = 'Jane'
+        self.owner.save(update_fields=['first_name'])
+        self.assertNotIn('owner', self.doc['payloads'])
+
+    def test_encoded_state(self):
+        self.doc['comments'] = {
+            '1': {'user': self.owner.id, 'comment': 'Mine'},
+            '2': {'user': self.owner.id + 1, 'comment': 'Other'}
+        }
+        payloads = self.get_payloads()
+        with patch.object(
+            ws_views,
+            'json_encode',
+            wraps=ws_views.json_encode
+        ) as json_encode:
+            for session_id in range(3):
+                self.waiter.id = session_id
+                self.waiter.send_doc_data(payloads)
+            self.waiter.user_info.access_rights = 'review'
+            self.waiter.send_doc_data(payloads)
+            # The contents are only encoded once for all participants.
+            self.assertEqual(
+                [
+                    call for call in json_encode.call_args_list
+                    if call[0][0] is self.doc['contents']
+                ],
+                [((self.doc['contents'],),)]
+            )
+        doc_data = json_decode(self.waiter.sent[2])
+        self.assertEqual(doc_data['doc_info']['session_id'], 2)
+        self.assertEqual(doc_data['doc']['contents'], self.doc['contents'])
+        self.assertEqual(doc_data['doc']['comments'], self.doc['comments'])
+        self.assertEqual(
+            json_decode(self.waiter.sent[3])['doc']['comments'],
+            {'1': self.doc['comments']['1']}
+        )
+        # The next version is encoded anew.
+        self.doc['contents'] = {'type': 'doc', 'content': []}
+        self.doc['version'] += 1
+        self.waiter.send_doc_data(payloads)
+        doc_data = json_decode(self.waiter.sent[4])
+        self.assertEqual(doc_data['doc']['v'], self.doc['version'])
+        self.assertEqual(doc_data['doc']['contents'], self.doc['contents'])
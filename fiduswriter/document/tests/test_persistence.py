@@ -0,0 +1,179 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import TransactionTestCase, override_settings
+
+from base.json_codec import json_decode
+from document.helpers.persistence import PersistenceQueue, \
+    compact_journals, get_journal
+from document.models import Document, DocumentDiff
+from document.ws_views import WebSocket
+from testing.document_helper import create_document
+
+
+class FailingQueue(PersistenceQueue):
+    # The first write fails after a newer state has been queued.
+    RETRY_DELAY_MAX = 0.05
+
+    def write(self, document_id, fields, diffs):
+        if self.failure_count == 0:
+            self.enqueue(document_id, {'title': 'Newer'}, [
+                (1, '{"type": "diff", "v": 1}')
+            ])
+            raise DatabaseError('Connection lost')
+        super().write(document_id, fields, diffs)
+
+
+class BrokenQueue(PersistenceQueue):
+    # The database cannot be written to.
+
+    def write(self, document_id, fields, diffs):
+        raise DatabaseError('Connection lost')
+
+
+class PersistenceQueueTest(TransactionTestCase):
+
+    def setUp(self):
+        self.document = create_document(
+            User.objects.create(username='Writer')
+        )
+
+    def test_write_behind(self):
+        queue = PersistenceQueue()
+        # The worker thread waits for the condition while we hold it, so both
+        # states are queued before the first write.
+        with queue.condition:
+            queue.enqueue(self.document.id, {
+                'version': 1,
+                'contents': '{"type": "article"}'
+            })
+            queue.enqueue(self.document.id, {
+                'version': 2,
+                'contents': '{"type": "article", "content": []}'
+            })
+            self.assertEqual(queue.stats()['depth'], 1)
+        self.assertTrue(queue.drain(10))
+        document = Document.objects.get(id=self.document.id)
+        self.assertEqual(document.version, 2)
+        self.assertEqual(
+            document.contents,
+            '{"type": "article", "content": []}'
+        )
+        stats = queue.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['flushes'], 1)
+        self.assertGreaterEqual(stats['max_latency'], 0)
+
+    def test_retry(self):
+        queue = FailingQueue()
+        queue.enqueue(self.document.id, {
+            'title': 'Older',
+            'contents': '{"type": "article"}'
+        }, [(0, '{"type": "diff", "v": 0}')])
+        self.assertTrue(queue.drain(10))
+        # The failed job has been written with the newer one.
+        document = Document.objects.with_body().get(id=self.document.id)
+        self.assertEqual(document.title, 'Newer')
+        self.assertEqual(document.contents, '{"type": "article"}')
+        self.assertEqual(
+            [diff['v'] for diff in get_journal(self.document.id, 0)],
+            [0, 1]
+        )
+        stats = queue.stats()
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['flushes'], 1)
+
+    @override_settings(DOC_SAVE_FLUSH_TIMEOUT=0.1)
+    def test_read_unsaved(self):
+        # A document whose changes cannot be written is read with the diffs
+        # that are still queued.
+        DocumentDiff.objects.create(
+            document_id=self.document.id,
+            version=0,
+            diff='{"type": "diff", "v": 0, "ti": "Saved"}'
+        )
+        queue = BrokenQueue()
+        queue.enqueue(self.document.id, {'title': 'Unsaved'}, [
+            (0, '{"type": "diff", "v": 0, "ti": "Saved"}'),
+            (1, '{"type": "diff", "v": 1, "ti": "Unsaved"}')
+        ])
+        with patch.object(WebSocket, 'persistence', queue):
+            doc, journal = WebSocket.read_saved_document(self.document.id)
+        self.assertEqual(
+            [(diff['v'], diff['ti']) for diff in journal],
+            [(0, 'Saved'), (1, 'Unsaved')]
+        )
+        WebSocket.replay_journal(doc, journal)
+        self.assertEqual(doc['version'], 2)
+        self.assertEqual(doc['title'], 'Unsaved')
+
+    @override_settings(DOC_JOURNAL_LENGTH=2)
+    def test_journal(self):
+        queue = PersistenceQueue()
+        queue.enqueue(self.document.id, {'title': 'Journal'}, [
+            (0, '{"type": "diff", "v": 0, "jd": []}'),
+            (1, '{"type": "diff", "v": 1, "jd": []}')
+        ])
+        queue.enqueue(self.document.id, {'title': 'Journal'}, [
+            (2, '{"type": "diff", "v": 2, "jd": []}'),
+            (3, '{"type": "diff", "v": 3, "jd": []}')
+        ])
+        self.assertTrue(queue.drain(10))
+        document = Document.objects.get(id=self.document.id)
+        # Only the diffs were written, not the contents.
+        self.assertEqual(document.version, 0)
+        self.assertEqual(document.title, 'Journal')
+        self.assertEqual(
+            [diff['v'] for diff in get_journal(self.document.id, 1, 3)],
+            [1, 2]
+        )
+        # A snapshot removes the diffs that are no longer needed.
+        queue.enqueue(self.document.id, {
+            'version': 4,
+            'contents': '{"type": "article"}'
+        })
+        self.assertTrue(queue.drain(10))
+        self.assertEqual(
+            list(DocumentDiff.objects.filter(
+                document=self.document
+            ).values_list('version', flat=True)),
+            [2, 3]
+        )
+
+    def test_compact_journal(self):
+        self.document.contents = '{"type": "article", "content": []}'
+        self.document.save()
+        DocumentDiff.objects.bulk_create([
+            DocumentDiff(
+                document=self.document,
+                version=0,
+                diff='{"type": "diff", "v": 0, "ti": "Title", "jd": [{'
+                '"op": "add", "path": "/content/0", "value": "a"}]}'
+            ),
+            DocumentDiff(
+                document=self.document,
+                version=1,
+                diff='{"type": "diff", "v": 1, "jd": [{'
+                '"op": "add", "path": "/content/1", "value": "b"}]}'
+            )
+        ])
+        # Readers outside of the collaboration server see the journaled
+        # diffs.
+        compact_journals(Document.objects.filter(id=self.document.id))
+        document = Document.objects.with_body().get(id=self.document.id)
+        self.assertEqual(document.version, 2)
+        self.assertEqual(document.title, 'Title')
+        self.assertEqual(
+            json_decode(document.contents),
+            {'type': 'article', 'content': ['a', 'b']}
+        )
+        # The journal is kept for the collaboration server.
+        self.assertEqual(len(get_journal(self.document.id, 0)), 2)
+
+    def test_maintenance_stats(self):
+        admin = User.objects.create_superuser('Admin', 'admin@a.b', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/document/document/maintenance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('depth', response.context['persistence'])
@@ -0,0 +1,96 @@
+from django.test import TransactionTestCase, override_settings
+from tornado.escape import json_decode, json_encode
+from tornado.gen import sleep
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from document.ws_views import WebSocket
+from testing.document_helper import DocumentWebSocketMixin
+
+
+@override_settings(DOC_IDLE_TIME=None)
+class ResumeTest(
+    DocumentWebSocketMixin,
+    TransactionTestCase,
+    AsyncHTTPTestCase
+):
+    """
+    A client that reconnects is only sent the messages and diffs it has
+    missed.
+    """
+
+    def tearDown(self):
+        WebSocket.detached.clear()
+        super().tearDown()
+
+    async def subscribe(self, subscription):
+        connection = await self.connect()
+        await self.read(connection, 'welcome')
+        connection.write_message(json_encode(
+            dict(subscription, type='subscribe', c=1, s=1)
+        ))
+        return connection, await self.read(connection, 'subscribed')
+
+    async def lose(self, connection):
+        connection.close()
+        while len(WebSocket.detached) == 0:
+            await sleep(0.01)
+
+    @gen_test(timeout=10)
+    async def test_resume(self):
+        writer, subscribed = await self.subscribe({})
+        await self.read(writer, 'connections')
+        other, other_subscribed = await self.subscribe({})
+        other_connections = await self.read(other, 'connections')
+        other.write_message(json_encode({
+            'type': 'chat',
+            'c': 2,
+            's': other_connections['s'],
+            'body': 'Hello'
+        }))
+        chat = await self.read(writer, 'chat')
+        other_chat = await self.read(other, 'chat')
+        other.write_message(json_encode({
+            'type': 'diff',
+            'c': 3,
+            's': other_chat['s'],
+            'v': 0,
+            'rid': 0,
+            'ti': 'Title'
+        }))
+        await self.read(writer, 'diff')
+        await self.lose(writer)
+        # The client has missed the chat message and the diff.
+        writer, resubscribed = await self.subscribe({
+            'connection': 1,
+            'resume': {
+                'token': subscribed['resume'],
+                's': chat['s'] - 1,
+                'v': 0
+            }
+        })
+        self.assertTrue(resubscribed['resumed'])
+        self.assertNotEqual(resubscribed['resume'], subscribed['resume'])
+        messages = []
+        while len(messages) == 0 or messages[-1]['type'] != 'connections':
+            messages.append(json_decode(await writer.read_message()))
+        self.assertEqual(
+            [message['type'] for message in messages],
+            ['chat', 'diff', 'confirm_version', 'connections']
+        )
+        self.assertEqual(messages[0]['body'], 'Hello')
+        self.assertEqual(messages[0]['s'], 3)
+        self.assertTrue(messages[1]['server_fix'])
+        self.assertEqual(messages[2]['v'], 1)
+        # The token can only be used once.
+        await self.lose(other)
+        other, other_resubscribed = await self.subscribe({
+            'connection': 1,
+            'resume': {
+                'token': subscribed['resume'],
+                's': 0,
+                'v': 0
+            }
+        })
+        self.assertFalse(other_resubscribed['resumed'])
+        writer.close()
+        other.close()
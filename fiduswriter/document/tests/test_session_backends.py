@@ -0,0 +1,220 @@
+import os
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from base.servers.session_broker import make_broker_server
+from document.helpers.session_backends import BrokerSessionBackend, \
+    LocalSessionBackend
+
+
+class LocalSessionBackendTest(SimpleTestCase):
+
+    def test_session_ids(self):
+        backend = LocalSessionBackend()
+
+        async def check():
+            self.assertEqual(await backend.join(1, {'id': 5}), 0)
+            self.assertEqual(await backend.join(1, None), 1)
+            self.assertEqual(await backend.join(1, {'id': 6}), 2)
+            backend.leave(1, 2)
+            self.assertEqual(
+                await backend.participants(1),
+                [{'id': 5, 'session_id': 0}]
+            )
+            self.assertTrue(await backend.submit_diff(1, 0, {'v': 0}, 5))
+            self.assertEqual(await backend.open_document(1, 0), [])
+
+        loop = IOLoop()
+        loop.run_sync(check)
+        loop.close()
+
+
+class BrokerSessionBackendTest(SimpleTestCase):
+    """
+    Two server processes sharing one document through a session broker
+    running on a Unix socket.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.socket_dir = tempfile.mkdtemp()
+        cls.socket_path = os.path.join(cls.socket_dir, 'broker.sock')
+        ready = threading.Event()
+
+        def run_broker():
+            cls.broker_loop = IOLoop()
+            cls.broker_loop.make_current()
+            cls.broker = make_broker_server(cls.socket_path)
+            ready.set()
+            cls.broker_loop.start()
+
+        cls.broker_thread = threading.Thread(target=run_broker)
+        cls.broker_thread.daemon = True
+        cls.broker_thread.start()
+        ready.wait()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.broker_loop.add_callback(cls.broker_loop.stop)
+        cls.broker_thread.join()
+        os.remove(cls.socket_path)
+        os.rmdir(cls.socket_dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.loop = IOLoop()
+        self.loop.make_current()
+        self.received = {'a': [], 'b': []}
+        self.process_a = BrokerSessionBackend(
+            self.socket_path,
+            self.received['a'].append
+        )
+        self.process_b = BrokerSessionBackend(
+            self.socket_path,
+            self.received['b'].append
+        )
+
+    def tearDown(self):
+        # The last requests are answered.
+        self.loop.run_sync(lambda: gen.sleep(0.05))
+        self.process_a.client.close()
+        self.process_b.client.close()
+        # The connections wind down.
+        self.loop.run_sync(lambda: gen.sleep(0.01))
+        self.loop.close(all_fds=True)
+
+    def restart_broker(self):
+        # The broker forgets all documents and drops all connections.
+        restarted = threading.Event()
+
+        def restart():
+            self.broker.stop()
+            for stream in list(self.broker.subscribers.values()):
+                stream.close()
+            type(self).broker = make_broker_server(self.socket_path)
+            restarted.set()
+
+        self.broker_loop.add_callback(restart)
+        restarted.wait()
+
+    def test_diff_sequencing(self):
+        diff = {'type': 'diff', 'v': 10, 'rid': 0, 'jd': []}
+        diff_b = {'type': 'diff', 'v': 11, 'rid': 0}
+
+        async def submit():
+            self.assertEqual(await self.process_a.open_document(3, 10), [])
+            self.assertTrue(await self.process_a.submit_diff(3, 10, diff, 1))
+            # Process b opens the document from the database at version 10
+            # and receives the diff that has not been saved yet.
+            self.assertEqual(
+                await self.process_b.open_document(3, 10),
+                [diff]
+            )
+            # A diff based on an outdated version is refused.
+            self.assertFalse(
+                await self.process_b.submit_diff(3, 10, diff, 2)
+            )
+            self.assertTrue(
+                await self.process_b.submit_diff(3, 11, diff_b, 2)
+            )
+            await gen.sleep(0.1)
+
+        self.loop.run_sync(submit)
+        self.assertEqual(
+            self.received['a'],
+            [{
+                'kind': 'diff',
+                'message': diff_b,
+                'user': 2,
+                'channel': '3'
+            }]
+        )
+        self.assertEqual(self.received['b'], [])
+        self.process_a.close_document(3)
+        self.process_b.close_document(3)
+
+    def test_roster(self):
+        async def join():
+            await self.process_a.open_document(4, 0)
+            await self.process_b.open_document(4, 0)
+            session_a = await self.process_a.join(4, {'id': 1, 'name': 'A'})
+            session_b = await self.process_b.join(4, {'id': 2, 'name': 'B'})
+            self.assertNotEqual(session_a, session_b)
+            self.assertEqual(
+                [info['id'] for info in await self.process_a.participants(4)],
+                [1, 2]
+            )
+            self.process_a.publish(4, {'type': 'chat'}, session_a, 1)
+            await gen.sleep(0.1)
+            return session_b
+
+        session_b = self.loop.run_sync(join)
+        self.assertEqual(
+            [(pub['kind'], pub['info']['id']) for pub in self.received['a']],
+            [('join', 2)]
+        )
+        self.assertEqual(
+            [pub['kind'] for pub in self.received['b']],
+            ['join', 'update']
+        )
+
+        # When a process goes away, its participants leave the document.
+        async def leave():
+            self.process_b.client.close()
+            await gen.sleep(0.1)
+            self.assertEqual(
+                [info['id'] for info in await self.process_a.participants(4)],
+                [1]
+            )
+
+        self.loop.run_sync(leave)
+        self.assertEqual(
+            self.received['a'][-1],
+            {'kind': 'leave', 'session_id': session_b, 'channel': '4'}
+        )
+        self.process_a.close_document(4)
+
+    def test_broker_restart(self):
+        diff = {'type': 'diff', 'v': 0, 'rid': 0}
+        diff_b = {'type': 'diff', 'v': 1, 'rid': 0}
+
+        async def restart():
+            await self.process_a.open_document(5, 0)
+            await self.process_b.open_document(5, 0)
+            session_a = await self.process_a.join(5, {'id': 1, 'name': 'A'})
+            session_b = await self.process_b.join(5, {'id': 2, 'name': 'B'})
+            self.assertTrue(await self.process_a.submit_diff(5, 0, diff, 1))
+            await gen.sleep(0.1)
+            self.restart_broker()
+            await gen.sleep(0.5)
+            # Both processes have opened the document again at the current
+            # version and their participants have kept their session ids.
+            self.assertEqual(
+                [
+                    (info['id'], info['session_id'])
+                    for info in await self.process_a.participants(5)
+                ],
+                [(1, session_a), (2, session_b)]
+            )
+            self.assertTrue(await self.process_b.submit_diff(5, 1, diff_b, 2))
+            await gen.sleep(0.1)
+
+        self.loop.run_sync(restart)
+        self.assertIn('roster', [pub['kind'] for pub in self.received['a']])
+        self.assertEqual(
+            self.received['a'][-1],
+            {'kind': 'diff', 'message': diff_b, 'user': 2, 'channel': '5'}
+        )
+        self.assertEqual(
+            [pub['kind'] for pub in self.received['b']],
+            ['join', 'diff', 'roster'] + [
+                pub['kind'] for pub in self.received['b'][3:]
+            ]
+        )
+        self.process_a.close_document(5)
+        self.process_b.close_document(5)
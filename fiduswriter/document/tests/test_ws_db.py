@@ -0,0 +1,121 @@
+import threading
+import time
+from unittest.mock import patch
+
+from django.test import TransactionTestCase, override_settings
+from tornado.escape import json_decode, json_encode
+from tornado.gen import sleep
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from document.ws_views import WebSocket
+from testing.document_helper import DocumentWebSocketMixin
+
+
+def slow_document_templates(self):
+    # A slow query.
+    time.sleep(0.3)
+    return {}
+
+
+@override_settings(DOC_IDLE_TIME=None)
+class WebSocketDatabaseTest(
+    DocumentWebSocketMixin,
+    TransactionTestCase,
+    AsyncHTTPTestCase
+):
+    """
+    The database is accessed in a thread pool, so that the other connections
+    are served in the meantime.
+    """
+
+    @gen_test(timeout=10)
+    async def test_message_order(self):
+        connection = await self.connect()
+        await self.read(connection, 'welcome')
+        with patch.object(
+            WebSocket,
+            'get_document_templates',
+            slow_document_templates
+        ):
+            connection.write_message(json_encode(
+                {'type': 'subscribe', 'c': 1, 's': 1}
+            ))
+            # Is only handled once the client has subscribed.
+            connection.write_message(json_encode(
+                {'type': 'check_version', 'c': 2, 's': 5, 'v': 0}
+            ))
+            types = []
+            for number in range(5):
+                message = json_decode(await connection.read_message())
+                types.append(message['type'])
+        self.assertEqual(
+            types,
+            [
+                'subscribed',
+                'styles',
+                'doc_data',
+                'connections',
+                'confirm_version'
+            ]
+        )
+        connection.close()
+
+    @gen_test(timeout=10)
+    async def test_latency(self):
+        writer = await self.connect()
+        await self.read(writer, 'welcome')
+        writer.write_message(json_encode(
+            {'type': 'subscribe', 'c': 1, 's': 1}
+        ))
+        await self.read(writer, 'doc_data')
+        await self.read(writer, 'connections')
+        joiner = await self.connect()
+        await self.read(joiner, 'welcome')
+        started = threading.Event()
+        release = threading.Event()
+
+        def held_document_templates(waiter):
+            started.set()
+            release.wait(10)
+            return {}
+
+        with patch.object(
+            WebSocket,
+            'get_document_templates',
+            held_document_templates
+        ):
+            joiner.write_message(json_encode(
+                {'type': 'subscribe', 'c': 1, 's': 1}
+            ))
+            while not started.is_set():
+                await sleep(0.01)
+            writer.write_message(json_encode({
+                'type': 'diff',
+                'c': 2,
+                's': 5,
+                'v': 0,
+                'rid': 0,
+                'ti': 'Title'
+            }))
+            # The diff is confirmed while the query of the joiner is still
+            # running.
+            await self.read(writer, 'confirm_diff')
+            release.set()
+            doc_data = await self.read(joiner, 'doc_data')
+        self.assertEqual(doc_data['doc']['v'], 1)
+        # The joiner receives the whole participant list, the writer only
+        # the new participant.
+        connections = await self.read(joiner, 'connections')
+        self.assertEqual(len(connections['participant_list']), 2)
+        joined = await self.read(writer, 'participant_joined')
+        self.assertEqual(
+            joined['participant']['session_id'],
+            connections['participant_list'][1]['session_id']
+        )
+        joiner.close()
+        left = await self.read(writer, 'participant_left')
+        self.assertEqual(
+            left['session_id'],
+            joined['participant']['session_id']
+        )
+        writer.close()
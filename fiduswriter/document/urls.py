@@ -8,11 +8,31 @@ urlpatterns = [
         views.get_documentlist,
         name='get_documentlist'
     ),
+    url(
+        '^documentlist/page/$',
+        views.get_documentlist_page,
+        name='get_documentlist_page'
+    ),
+    url(
+        '^documentlist/revisions/$',
+        views.get_documentlist_revisions,
+        name='get_documentlist_revisions'
+    ),
+    url(
+        '^documentlist/styles/$',
+        views.get_documentlist_styles,
+        name='get_documentlist_styles'
+    ),
     url(
         '^documentlist/extra/$',
         views.get_documentlist_extra,
         name='get_documentlist_extra'
     ),
+    url(
+        '^documentlist/extra/stream/$',
+        views.get_documentlist_extra_stream,
+        name='get_documentlist_extra_stream'
+    ),
     url('^delete/$', views.delete, name='delete'),
     url(
         '^create_doc/(?P<template_id>[0-9]+)/$',
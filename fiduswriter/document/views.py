@@ -1,9 +1,8 @@
 import time
 import os
 import bleach
-from tornado.escape import json_decode, json_encode
 from django.core import serializers
-from django.http import HttpResponse, JsonResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.core.files import File
@@ -11,12 +10,16 @@ from django.contrib.auth.models import User
 from django.utils.translation import ugettext as _
 from django.conf import settings
 from django.core.mail import send_mail
-from django.db.models import F, Q
+from django.db.models import F, Q, Prefetch
+from django.utils.dateparse import parse_datetime
 from django.contrib.admin.views.decorators import staff_member_required
 
-from user.util import get_user_avatar_url
+from base.json_codec import JsonResponse, json_decode, json_encode
+from user.util import get_user_avatar_urls
+from document.helpers.access_rights import get_document_access
+from document.helpers.persistence import compact_journals
 from document.models import Document, AccessRight, DocumentRevision, \
-    DocumentTemplate, AccessRightInvite, CAN_UPDATE_DOCUMENT, \
+    DocumentTemplate, AccessRightInvite, DocumentDiff, CAN_UPDATE_DOCUMENT, \
     FW_DOCUMENT_VERSION
 from usermedia.models import DocumentImage, Image
 from bibliography.models import Entry
@@ -26,6 +29,59 @@ from style.models import DocumentStyle
 from base.html_email import html_email
 from user.models import TeamMember
 
+# Default and maximal number of documents per page of the overview
+DOCUMENT_PAGE_SIZE = 50
+# Number of documents loaded at a time by get_documentlist_extra_stream
+DOCUMENT_EXTRA_BATCH_SIZE = 20
+
+
+def accessible_documents(user):
+    # A subquery rather than a join, so that documents shared with several
+    # users are only included once.
+    return Document.objects.filter(
+        Q(owner=user) |
+        Q(id__in=AccessRight.objects.filter(user=user).values('document_id'))
+    )
+
+
+def documents_with_images(user, ids):
+    documents = accessible_documents(user).filter(id__in=ids)
+    # Diffs of the collaboration server that are only in the journal.
+    compact_journals(documents)
+    return documents.with_body(
+        'contents',
+        'comments',
+        'bibliography'
+    ).prefetch_related(
+        Prefetch(
+            'documentimage_set',
+            queryset=DocumentImage.objects.select_related('image')
+        )
+    )
+
+
+def serialize_document_extra(doc):
+    images = {}
+    for image in doc.documentimage_set.all():
+        images[image.image.id] = {
+            'added': image.image.added,
+            'checksum': image.image.checksum,
+            'file_type': image.image.file_type,
+            'height': image.image.height,
+            'id': image.image.id,
+            'image': image.image.image.url,
+            'thumbnail': image.image.thumbnail.url,
+            'title': image.title,
+            'width': image.image.width
+        }
+    return {
+        'images': images,
+        'contents': doc.contents,
+        'comments': doc.comments,
+        'bibliography': doc.bibliography,
+        'id': doc.id
+    }
+
 
 @login_required
 def get_documentlist_extra(request):
@@ -34,30 +90,10 @@ def get_documentlist_extra(request):
     if request.is_ajax() and request.method == 'POST':
         status = 200
         ids = request.POST['ids'].split(',')
-        docs = Document.objects.filter(Q(owner=request.user) | Q(
-            accessright__user=request.user)).filter(id__in=ids)
+        docs = documents_with_images(request.user, ids)
         response['documents'] = []
         for doc in docs:
-            images = {}
-            for image in doc.documentimage_set.all():
-                images[image.image.id] = {
-                    'added': image.image.added,
-                    'checksum': image.image.checksum,
-                    'file_type': image.image.file_type,
-                    'height': image.image.height,
-                    'id': image.image.id,
-                    'image': image.image.image.url,
-                    'thumbnail': image.image.thumbnail.url,
-                    'title': image.title,
-                    'width': image.image.width
-                }
-            response['documents'].append({
-                'images': images,
-                'contents': doc.contents,
-                'comments': doc.comments,
-                'bibliography': doc.bibliography,
-                'id': doc.id
-            })
+            response['documents'].append(serialize_document_extra(doc))
     return JsonResponse(
         response,
         status=status
@@ -65,52 +101,109 @@ def get_documentlist_extra(request):
 
 
 @login_required
-def documents_list(request):
-    documents = Document.objects.filter(
-        Q(owner=request.user) | Q(accessright__user=request.user),
-        listed=True
-    ).order_by('-updated')
+def get_documentlist_extra_stream(request):
+    # Same as get_documentlist_extra, but the documents are streamed as
+    # newline delimited JSON, one document per line. The documents are loaded
+    # in batches, so memory use does not grow with the number of documents.
+    if not request.is_ajax() or request.method != 'POST':
+        return JsonResponse({}, status=405)
+    ids = request.POST['ids'].split(',')
+    user = request.user
+
+    def stream():
+        for start in range(0, len(ids), DOCUMENT_EXTRA_BATCH_SIZE):
+            for doc in documents_with_images(
+                user,
+                ids[start:start + DOCUMENT_EXTRA_BATCH_SIZE]
+            ):
+                yield json_encode(serialize_document_extra(doc)) + '\n'
+
+    return StreamingHttpResponse(
+        stream(),
+        content_type='application/x-ndjson'
+    )
+
+
+def serialize_revisions(revisions):
+    revision_list = []
+    for revision in revisions:
+        revision_list.append({
+            'date': time.mktime(revision.date.utctimetuple()),
+            'note': revision.note,
+            'file_name': revision.file_name,
+            'pk': revision.pk
+        })
+    return revision_list
+
+
+def serialize_document_list(user, documents, revisions=True):
+    # documents needs to prefetch the access rights of the user (as
+    # user_access_rights) and, if revisions are included, the revisions (as
+    # revisions).
+    owners = {}
+    for document in documents:
+        owners[document.owner.id] = document.owner
+    avatars = get_user_avatar_urls(list(owners.values()))
     output_list = []
     for document in documents:
-        if document.owner == request.user:
+        if document.owner == user:
             access_right = 'write'
         else:
-            access_right = AccessRight.objects.get(
-                user=request.user,
-                document=document
-            ).rights
-        revisions = DocumentRevision.objects.filter(document=document)
-        revision_list = []
-        for revision in revisions:
-            revision_list.append({
-                'date': time.mktime(revision.date.utctimetuple()),
-                'note': revision.note,
-                'file_name': revision.file_name,
-                'pk': revision.pk
-            })
-
+            access_right = document.user_access_rights[0].rights
         added = time.mktime(document.added.utctimetuple())
         updated = time.mktime(document.updated.utctimetuple())
         is_owner = False
-        if document.owner == request.user:
+        if document.owner == user:
             is_owner = True
-        output_list.append({
+        document_info = {
             'id': document.id,
             'title': document.title,
             'is_owner': is_owner,
             'owner': {
                 'id': document.owner.id,
                 'name': document.owner.readable_name,
-                'avatar': get_user_avatar_url(document.owner)
+                'avatar': avatars[document.owner.id]
             },
             'added': added,
             'updated': updated,
-            'rights': access_right,
-            'revisions': revision_list
-        })
+            'rights': access_right
+        }
+        if revisions:
+            document_info['revisions'] = serialize_revisions(
+                document.revisions
+            )
+        output_list.append(document_info)
     return output_list
 
 
+def listed_documents(user):
+    return accessible_documents(user).filter(
+        listed=True
+    ).select_related('owner').prefetch_related(
+        Prefetch(
+            'accessright_set',
+            queryset=AccessRight.objects.filter(user=user),
+            to_attr='user_access_rights'
+        )
+    ).only(
+        'id', 'title', 'added', 'updated', 'owner'
+    )
+
+
+@login_required
+def documents_list(request):
+    documents = listed_documents(request.user).prefetch_related(
+        Prefetch(
+            'documentrevision_set',
+            queryset=DocumentRevision.objects.only(
+                'id', 'document_id', 'date', 'note', 'file_name'
+            ),
+            to_attr='revisions'
+        )
+    ).order_by('-updated')
+    return serialize_document_list(request.user, documents)
+
+
 @login_required
 def get_access_rights(request):
     response = {}
@@ -124,13 +217,15 @@ def get_access_rights(request):
             ar_qs = ar_qs.filter(document_id__in=doc_ids)
             in_qs = in_qs.filter(document_id__in=doc_ids)
         access_rights = []
+        ar_qs = list(ar_qs.select_related('user'))
+        avatars = get_user_avatar_urls([ar.user for ar in ar_qs])
         for ar in ar_qs:
             access_rights.append({
-                'document_id': ar.document.id,
+                'document_id': ar.document_id,
                 'user_id': ar.user.id,
                 'user_name': ar.user.readable_name,
                 'rights': ar.rights,
-                'avatar': get_user_avatar_url(ar.user)
+                'avatar': avatars[ar.user.id]
             })
         response['access_rights'] = access_rights
         invites = []
@@ -314,6 +409,44 @@ def invite(request):
     )
 
 
+def team_members_list(user):
+    team_members = user.leader.select_related('member')
+    avatars = get_user_avatar_urls(
+        [team_member.member for team_member in team_members]
+    )
+    team_member_list = []
+    for team_member in team_members:
+        tm_object = {}
+        tm_object['id'] = team_member.member.id
+        tm_object['name'] = team_member.member.readable_name
+        tm_object['username'] = team_member.member.get_username()
+        tm_object['avatar'] = avatars[team_member.member.id]
+        team_member_list.append(tm_object)
+    return team_member_list
+
+
+def document_styles_and_templates(user, response):
+    serializer = PythonWithURLSerializer()
+    doc_styles = serializer.serialize(
+        DocumentStyle.objects.filter(
+            Q(document_template__user=None) |
+            Q(document_template__user=user)
+        ),
+        use_natural_foreign_keys=True,
+        fields=['title', 'slug', 'contents', 'documentstylefile_set']
+    )
+    response['document_styles'] = [obj['fields'] for obj in doc_styles]
+    doc_templates = DocumentTemplate.objects.filter(
+        Q(user=user) | Q(user=None)
+    ).order_by(F('user').desc(nulls_first=True))
+    response['document_templates'] = {}
+    for obj in doc_templates:
+        response['document_templates'][obj.import_id] = {
+            'title': obj.title,
+            'id': obj.id
+        }
+
+
 @login_required
 def get_documentlist(request):
     response = {}
@@ -321,38 +454,113 @@ def get_documentlist(request):
     if request.is_ajax() and request.method == 'POST':
         status = 200
         response['documents'] = documents_list(request)
-        response['team_members'] = []
-        for team_member in request.user.leader.all():
-            tm_object = {}
-            tm_object['id'] = team_member.member.id
-            tm_object['name'] = team_member.member.readable_name
-            tm_object['username'] = team_member.member.get_username()
-            '''
-            tm_object['avatar'] = get_user_avatar_url(
-                team_member.member
-            )['url']
-            '''
-            tm_object['avatar'] = get_user_avatar_url(team_member.member)
-            response['team_members'].append(tm_object)
-        serializer = PythonWithURLSerializer()
-        doc_styles = serializer.serialize(
-            DocumentStyle.objects.filter(
-                Q(document_template__user=None) |
-                Q(document_template__user=request.user)
-            ),
-            use_natural_foreign_keys=True,
-            fields=['title', 'slug', 'contents', 'documentstylefile_set']
+        response['team_members'] = team_members_list(request.user)
+        document_styles_and_templates(request.user, response)
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
+@login_required
+def get_documentlist_page(request):
+    # Returns one page of the document overview, newest first. Revisions,
+    # styles and templates are fetched separately. The team members are only
+    # included on the first page.
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        status = 200
+        try:
+            owner_id = request.POST.get('owner', '')
+            if len(owner_id):
+                owner_id = int(owner_id)
+            cursor = request.POST.get('cursor', '')
+            if len(cursor):
+                # The cursor is the update time and id of the last document
+                # of the previous page.
+                updated, doc_id = cursor.rsplit('_', 1)
+                updated = parse_datetime(updated)
+                doc_id = int(doc_id)
+                if updated is None:
+                    raise ValueError('Invalid cursor: %s' % cursor)
+            limit = int(request.POST.get('limit', DOCUMENT_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse(response, status=400)
+        limit = max(1, min(limit, DOCUMENT_PAGE_SIZE))
+        documents = listed_documents(request.user)
+        title = request.POST.get('title', '')
+        if len(title):
+            documents = documents.filter(title__icontains=title)
+        if owner_id != '':
+            documents = documents.filter(owner_id=owner_id)
+        rights = request.POST.get('rights', '')
+        if len(rights):
+            shared = Q(id__in=AccessRight.objects.filter(
+                user=request.user,
+                rights=rights
+            ).values('document_id'))
+            if rights == 'write':
+                documents = documents.filter(Q(owner=request.user) | shared)
+            else:
+                documents = documents.filter(shared)
+        if len(cursor):
+            documents = documents.filter(
+                Q(updated__lt=updated) |
+                Q(updated=updated, id__lt=doc_id)
+            )
+        else:
+            response['team_members'] = team_members_list(request.user)
+        page = list(documents.order_by('-updated', '-id')[:limit + 1])
+        response['documents'] = serialize_document_list(
+            request.user,
+            page[:limit],
+            False
         )
-        response['document_styles'] = [obj['fields'] for obj in doc_styles]
-        doc_templates = DocumentTemplate.objects.filter(
-            Q(user=request.user) | Q(user=None)
-        ).order_by(F('user').desc(nulls_first=True))
-        response['document_templates'] = {}
-        for obj in doc_templates:
-            response['document_templates'][obj.import_id] = {
-                'title': obj.title,
-                'id': obj.id
-            }
+        if len(page) > limit:
+            last = page[limit - 1]
+            response['next_cursor'] = '%s_%d' % (
+                last.updated.isoformat(),
+                last.id
+            )
+        else:
+            response['next_cursor'] = None
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
+@login_required
+def get_documentlist_revisions(request):
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        status = 200
+        ids = request.POST['ids'].split(',')
+        documents = listed_documents(request.user).filter(id__in=ids)
+        revisions = DocumentRevision.objects.filter(
+            document__in=documents
+        ).only('id', 'document_id', 'date', 'note', 'file_name')
+        response['revisions'] = {}
+        for doc_id in documents.values_list('id', flat=True):
+            response['revisions'][doc_id] = []
+        for revision in revisions:
+            response['revisions'][revision.document_id] += \
+                serialize_revisions([revision])
+    return JsonResponse(
+        response,
+        status=status
+    )
+
+
+@login_required
+def get_documentlist_styles(request):
+    response = {}
+    status = 405
+    if request.is_ajax() and request.method == 'POST':
+        status = 200
+        document_styles_and_templates(request.user, response)
     return JsonResponse(
         response,
         status=status
@@ -733,21 +941,19 @@ def import_doc(request):
         doc_id = request.POST['id']
         # There is a doc_id, so we overwrite an existing doc rather than
         # creating a new one.
-        document = Document.objects.get(id=int(doc_id))
-        if (
-            document.owner != request.user and
-            len(AccessRight.objects.filter(
-                document_id=doc_id,
-                user_id=request.user.id,
-                rights__in=CAN_UPDATE_DOCUMENT
-            )) == 0
-        ):
+        access = get_document_access(doc_id, request.user)
+        if access is None or access.rights not in CAN_UPDATE_DOCUMENT:
             response['error'] = 'No access to file'
             status = 403
             return JsonResponse(
                 response,
                 status=status
             )
+        document = Document.objects.with_body(
+            'contents',
+            'comments',
+            'bibliography'
+        ).get(id=int(doc_id))
         document.title = request.POST['title']
         # We need to decode/encode the following so that it has the same
         # character encoding as used the the save_document method in ws_views.
@@ -758,6 +964,12 @@ def import_doc(request):
         # document.doc_version should always be the current version, so don't
         # bother about it.
         document.save()
+        # Journaled diffs would otherwise be replayed on top of the imported
+        # contents.
+        DocumentDiff.objects.filter(
+            document=document,
+            version__gte=document.version
+        ).delete()
         response['document_id'] = document.id
         response['added'] = time.mktime(document.added.utctimetuple())
         response['updated'] = time.mktime(document.updated.utctimetuple())
@@ -776,17 +988,9 @@ def upload_revision(request):
     status = 405
     if request.is_ajax() and request.method == 'POST':
         document_id = request.POST['document_id']
-        document = Document.objects.filter(id=int(document_id)).first()
-        if document:
-            if document.owner == request.user:
-                can_save = True
-            else:
-                access_rights = AccessRight.objects.filter(
-                    document=document, user=request.user)
-                if len(access_rights) > 0 and access_rights[
-                    0
-                ].rights == 'write':
-                    can_save = True
+        access = get_document_access(document_id, request.user)
+        if access and access.rights == 'write':
+            can_save = True
         if can_save:
             status = 201
             revision = DocumentRevision()
@@ -840,17 +1044,9 @@ def delete_revision(request):
 
 
 # Check doc access rights.
-def has_doc_access(doc, user):
-    if doc.owner == user:
-        return True
-    access_rights = AccessRight.objects.filter(
-        document=doc,
-        user=user
-    ).first()
-    if access_rights:
-        return True
-    else:
-        return False
+def has_doc_access(document_id, user):
+    access = get_document_access(document_id, user)
+    return access is not None and access.rights is not None
 
 
 @login_required
@@ -870,13 +1066,13 @@ def comment_notify(request):
     )
     notification_type = request.POST['type']
     collaborator = User.objects.filter(pk=collaborator_id).first()
-    document = Document.objects.filter(pk=doc_id).first()
+    document = Document.objects.filter(pk=doc_id).only('id', 'title').first()
     if (
         not document or
         not collaborator or
         not comment_text or
         not comment_html or
-        not has_doc_access(document, request.user) or
+        not has_doc_access(document.id, request.user) or
         not notification_type
     ):
         return JsonResponse(
@@ -884,7 +1080,7 @@ def comment_notify(request):
             status=403
         )
     if (
-        not has_doc_access(document, collaborator)
+        not has_doc_access(document.id, collaborator)
     ):
         # Tagged user has no access to document and will therefore not be
         # notified
@@ -1014,13 +1210,14 @@ def get_all_old_docs(request):
     status = 405
     if request.is_ajax() and request.method == 'POST':
         status = 200
-        doc_list = Document.objects.filter(
+        doc_list = list(Document.objects.filter(
             doc_version__lt=str(FW_DOCUMENT_VERSION)
-        )[:10]
-        response['docs'] = serializers.serialize(
-            'json',
-            doc_list
-        )
+        ).with_body()[:10])
+        docs = json_decode(serializers.serialize('json', doc_list))
+        for doc, doc_db in zip(docs, doc_list):
+            for field in Document.body_fields:
+                doc['fields'][field] = getattr(doc_db, field)
+        response['docs'] = json_encode(docs)
     return JsonResponse(
         response,
         status=status
@@ -1034,7 +1231,7 @@ def save_doc(request):
     if request.is_ajax() and request.method == 'POST':
         status = 200
         doc_id = request.POST['id']
-        doc = Document.objects.get(pk=int(doc_id))
+        doc = Document.objects.with_body().get(pk=int(doc_id))
         # Only looking at fields that may have changed.
         contents = request.POST.get('contents', False)
         bibliography = request.POST.get('bibliography', False)
@@ -1053,6 +1250,8 @@ def save_doc(request):
             doc.last_diffs = last_diffs
         doc.doc_version = FW_DOCUMENT_VERSION
         doc.save()
+        # The journaled diffs belong to the old document version.
+        DocumentDiff.objects.filter(document=doc).delete()
     return JsonResponse(
         response,
         status=status
@@ -3,30 +3,78 @@ import uuid
 import atexit
 from time import mktime, time
 from copy import deepcopy
+from collections import OrderedDict
 
 from jsonpatch import apply_patch, JsonPatchConflict, JsonPointerException
 
 from document.helpers.session_user_info import SessionUserInfo
 from document.helpers.serializers import PythonWithURLSerializer
-from base.ws_handler import BaseWebSocketHandler
+from document.helpers.session_backends import get_session_backend
+from document.helpers.diff_history import DiffHistory
+from document.helpers.content_hash import ContentHashes
+from document.helpers.persistence import PersistenceQueue, get_journal
+from base.db_executor import run_in_db_thread
+from base.json_codec import json_decode, json_encode
+from base.ws_handler import BaseWebSocketHandler, encode_message, \
+    messages_since, resend_entry
 import logging
-from tornado.escape import json_decode, json_encode
 from document.models import COMMENT_ONLY, CAN_UPDATE_DOCUMENT, \
-    CAN_COMMUNICATE, FW_DOCUMENT_VERSION, DocumentTemplate
+    CAN_COMMUNICATE, FW_DOCUMENT_VERSION, Document, DocumentTemplate
 from usermedia.models import Image, DocumentImage, UserImage
-from user.util import get_user_avatar_url
+from user.util import get_user_avatar_url, get_user_avatar_urls
 
+from django.conf import settings
 from django.db.models import F, Q
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 logger = logging.getLogger(__name__)
 
 
 class WebSocket(BaseWebSocketHandler):
     sessions = dict()
+    # The ids of the sessions whose contents are in memory, least recently
+    # used first, with the size of their contents.
+    loaded_sessions = OrderedDict()
+    # Futures of the documents that are being loaded from the database.
+    opening = dict()
+    # Publications of other server processes for the documents that are being
+    # loaded or reloaded, which are handled once they are in place.
+    pending_publications = dict()
+    # The sent messages of connections that have been lost, by resume token,
+    # for WS_RESUME_TIME seconds.
+    detached = dict()
+    # Types of messages about the state of the document and its participants,
+    # which is brought up to date anew when a connection is resumed.
+    state_message_types = [
+        'subscribed',
+        'styles',
+        'doc_data',
+        'diff',
+        'confirm_diff',
+        'reject_diff',
+        'confirm_version',
+        'selection_change',
+        'connections',
+        'participant_joined',
+        'participant_left'
+    ]
+    eviction_callback = None
+    session_backend = None
+    # The IOLoop the documents are opened on. Only it changes the sessions.
+    io_loop = None
+    persistence = PersistenceQueue()
     history_length = 1000  # Only keep the last 1000 diffs
+    history_bytes = 4 * 1024 * 1024  # ... that take up at most 4 MB
 
-    def open(self, arg):
-        super().open(arg)
+    @staticmethod
+    def get_affinity(arg):
+        # With several server processes, all connections to a document are
+        # handled by the same one.
+        return int(arg.split('/')[0])
+
+    async def open(self, arg):
+        await super().open(arg)
         if len(self.args) < 2:
             self.access_denied()
             return
@@ -39,57 +87,455 @@ class WebSocket(BaseWebSocketHandler):
         }
         self.send_message(response)
 
-    def subscribe_doc(self, connection_count=0):
+    async def subscribe_doc(self, connection_count=0, resume=None):
+        # resume: the resume token of the last connection of the client, with
+        # the number of the last message it received from the server (s) and
+        # the version of its document (v).
         self.user_info = SessionUserInfo(self.user)
-        doc_db, can_access = self.user_info.init_access(
+        document, can_access = await run_in_db_thread(
+            self.user_info.init_access,
             self.document_id
         )
-        if not can_access or float(doc_db.doc_version) != FW_DOCUMENT_VERSION:
-            self.access_denied()
-            return
         if (
-            doc_db.id in WebSocket.sessions and
-            len(WebSocket.sessions[doc_db.id]['participants']) > 0
+            not can_access or
+            float(document.doc_version) != FW_DOCUMENT_VERSION
         ):
-            logger.debug("Serving already opened file")
-            self.doc = WebSocket.sessions[doc_db.id]
-            self.id = max(self.doc['participants']) + 1
-            self.doc['participants'][self.id] = self
-            logger.debug("id when opened %s" % self.id)
-        else:
-            logger.debug("Opening file")
-            self.id = 0
-            self.doc = {
-                'db': doc_db,
-                'participants': {
-                    0: self
-                },
-                'last_diffs': json_decode(doc_db.last_diffs),
-                'comments': json_decode(doc_db.comments),
-                'bibliography': json_decode(doc_db.bibliography),
-                'contents': json_decode(doc_db.contents),
-                'version': doc_db.version,
-                'title': doc_db.title,
-                'id': doc_db.id,
-                'template': {
-                    'id': doc_db.template.id,
-                    'definition': json_decode(doc_db.template.definition)
-                }
+            self.access_denied()
+            return
+        if self.can_communicate():
+            participant_info = {
+                'id': self.user_info.user.id,
+                'name': self.user_info.user.readable_name,
+                'avatar': await run_in_db_thread(
+                    get_user_avatar_url,
+                    self.user_info.user
+                )
             }
-            WebSocket.sessions[doc_db.id] = self.doc
+        else:
+            participant_info = None
+        if connection_count < 1:
+            document_templates = await run_in_db_thread(
+                self.get_document_templates
+            )
+        missed_messages = None
+        if resume is not None:
+            missed_messages = self.get_missed_messages(resume)
+        session_id = None
+        try:
+            while True:
+                self.doc = await WebSocket.open_document(document.id)
+                session_id = await WebSocket.session_backend.join(
+                    document.id,
+                    participant_info
+                )
+                payloads = await self.prepare_document()
+                if missed_messages is not None:
+                    missed_diffs = await self.get_missing_diffs(resume['v'])
+                if (
+                    self.ws_connection is None or
+                    WebSocket.sessions.get(document.id) is self.doc
+                ):
+                    break
+                # The document has been closed by the last participant while
+                # it was prepared.
+                WebSocket.session_backend.leave(document.id, session_id)
+                session_id = None
+        except ConnectionError:
+            logger.exception(
+                'Cannot open document %d with the session backend.' %
+                document.id
+            )
+            self.abandon_document(document.id, session_id)
+            self.close()
+            return
+        if self.ws_connection is None:
+            # The client has gone away in the meantime.
+            self.abandon_document(document.id, session_id)
+            return
+        # The client is added to the participants and receives the document
+        # without interruption, so that it receives no diffs before it.
+        self.id = session_id
+        self.doc['participants'][self.id] = self
+        logger.debug("id when opened %s" % self.id)
+        self.resume_token = uuid.uuid4().hex
+        resumed = missed_messages is not None and missed_diffs is not None
         self.send_message({
-            'type': 'subscribed'
+            'type': 'subscribed',
+            'resume': self.resume_token,
+            'resumed': resumed
         })
         if connection_count < 1:
-            self.send_styles()
-            self.send_document()
-        if self.can_communicate():
-            self.handle_participant_update()
+            self.send_styles(payloads, document_templates)
+            self.send_doc_data(payloads)
+        elif resumed:
+            # The client is only sent what it has missed.
+            for message, encoded in missed_messages:
+                if message['type'] not in WebSocket.state_message_types:
+                    self.send_message(message, encoded)
+            for message in missed_diffs:
+                new_message = message.copy()
+                new_message["server_fix"] = True
+                self.send_message(new_message)
+            self.send_message({
+                'type': 'confirm_version',
+                'v': self.doc['version']
+            })
+        if participant_info is not None:
+            # Only the new participant receives the whole list. The others
+            # are told about the change.
+            WebSocket.add_to_roster(document.id, participant_info)
+            self.send_participant_list()
 
-    def send_styles(self):
-        doc_db = self.doc['db']
-        response = dict()
-        response['type'] = 'styles'
+    def abandon_document(self, document_id, session_id):
+        # Undoes a subscription that could not be completed.
+        if session_id is not None:
+            WebSocket.session_backend.leave(document_id, session_id)
+        doc = getattr(self, 'doc', None)
+        if (
+            doc is not None and
+            WebSocket.sessions.get(document_id) is doc and
+            len(doc['participants']) == 0
+        ):
+            WebSocket.close_document(document_id)
+
+    def get_missed_messages(self, resume):
+        # Returns the messages sent to the last connection of the client that
+        # it has not received or None if the connection cannot be resumed.
+        detached = WebSocket.detached.pop(resume.get('token'), None)
+        if detached is None:
+            return None
+        IOLoop.current().remove_timeout(detached['timeout'])
+        if (
+            detached['document_id'] != self.user_info.document_id or
+            detached['user_id'] != self.user_info.user.id
+        ):
+            return None
+        missed_messages = messages_since(detached['messages'], resume['s'])
+        if missed_messages is None or None in [
+            encoded for message, encoded in missed_messages
+        ]:
+            # The client has to be sent the whole document.
+            return None
+        return missed_messages
+
+    def keep_for_resume(self):
+        # Keeps the messages sent to the connection after it has been lost,
+        # so that the client can resume it.
+        if self.resyncing:
+            # The client needs to be sent the whole document anyway.
+            return
+        messages = self.messages
+        # The messages that have not been written yet have been missed as
+        # well.
+        for message, encoded in self.outbox.values():
+            messages['server'] += 1
+            messages['recent'].append(resend_entry(message, encoded))
+        del messages['recent'][:-settings.WS_RESEND_MESSAGES]
+        self.outbox.clear()
+        WebSocket.detached[self.resume_token] = {
+            'document_id': self.user_info.document_id,
+            'user_id': self.user_info.user.id,
+            'messages': messages,
+            'timeout': IOLoop.current().call_later(
+                settings.WS_RESUME_TIME,
+                WebSocket.detached.pop,
+                self.resume_token,
+                None
+            )
+        }
+
+    @classmethod
+    def decode_document(cls, doc_db):
+        # The state of a document as saved in the database, which the diffs
+        # of its journal can be applied to by replay_journal.
+        return {
+            'db': doc_db,
+            'participants': {},
+            'last_diffs': DiffHistory(cls.history_length, cls.history_bytes),
+            'content_hashes': ContentHashes(),
+            'unsaved_diffs': [],
+            'comments': json_decode(doc_db.comments),
+            'bibliography': json_decode(doc_db.bibliography),
+            'contents': json_decode(doc_db.contents),
+            'version': doc_db.version,
+            'title': doc_db.title,
+            'id': doc_db.id,
+            # Parts of the styles and doc_data messages that are the same for
+            # all participants.
+            'payloads': {},
+            # Raised whenever payloads are removed, so that those looked up
+            # before are not cached.
+            'payload_generation': 0,
+            # The encoded state of the document (see get_encoded_state).
+            'encoded_state': None,
+            # The newest selection of each participant that is waiting to be
+            # sent to the others.
+            'selections': {},
+            'selection_timer': None,
+            # The participants on all server processes that can
+            # communicate, by session id.
+            'roster': {},
+            'loaded': True,
+            'used': time(),
+            # Approximate memory use of the document.
+            'size': (
+                len(doc_db.contents) +
+                len(doc_db.comments) +
+                len(doc_db.bibliography)
+            )
+        }
+
+    @classmethod
+    def read_document(cls, doc_db):
+        # Decodes a document from the database and looks up its diff
+        # journal. It runs in the database thread pool. Returns the document
+        # and the journaled diffs, which are applied by replay_journal on the
+        # IOLoop.
+        doc = cls.decode_document(doc_db)
+        doc['template'] = {
+            'id': doc_db.template.id,
+            'definition': json_decode(doc_db.template.definition)
+        }
+        journal = get_journal(
+            doc_db.id,
+            max(doc_db.version - cls.history_length, 0)
+        )
+        if len(journal) == 0:
+            # Diffs saved before the journal was introduced.
+            for message in json_decode(doc_db.last_diffs):
+                doc['last_diffs'].append(
+                    message['v'],
+                    message,
+                    len(json_encode(message))
+                )
+        return doc, journal
+
+    @classmethod
+    def read_saved_document(cls, document_id):
+        # Reads a document once its queued changes have been written. If
+        # they cannot be written within DOC_SAVE_FLUSH_TIMEOUT seconds, the
+        # diffs that are still queued are added to the journal instead. It
+        # runs in the database thread pool.
+        if cls.persistence.flush(document_id, settings.DOC_SAVE_FLUSH_TIMEOUT):
+            queued_diffs = []
+        else:
+            logger.error(
+                'Document %d could not be saved before it was read.' %
+                document_id
+            )
+            # Diffs that are written in the meantime are read twice.
+            queued_diffs = cls.persistence.queued_diffs(document_id)
+        doc, journal = cls.read_document(
+            Document.objects.with_body().select_related(
+                'template',
+                'owner'
+            ).get(id=document_id)
+        )
+        if len(queued_diffs):
+            versions = set(message['v'] for message in journal)
+            journal += [
+                json_decode(diff) for version, diff in queued_diffs
+                if version not in versions
+            ]
+            journal.sort(key=lambda message: message['v'])
+        return doc, journal
+
+    @classmethod
+    async def load_session(cls, document_id):
+        # Loads a document with the diffs that have been journaled or that
+        # other server processes have confirmed since it was saved. The
+        # publications for it are held back until release_publications is
+        # called once the document is in place.
+        cls.pending_publications.setdefault(document_id, [])
+        doc, journal = await run_in_db_thread(
+            cls.read_saved_document,
+            document_id
+        )
+        doc_db = doc['db']
+        journal += await cls.session_backend.open_document(
+            doc_db.id,
+            doc_db.version + len([
+                message for message in journal
+                if message['v'] >= doc_db.version
+            ])
+        )
+        cls.replay_journal(doc, journal)
+        return doc
+
+    @classmethod
+    def release_publications(cls, document_id):
+        for publication in cls.pending_publications.pop(document_id, []):
+            cls.receive_publication(publication)
+
+    @classmethod
+    def replay_journal(cls, doc, journal):
+        doc_db = doc['db']
+        for message in journal:
+            if message['v'] < doc['version']:
+                # The diff is already part of the saved contents.
+                message.pop('jd', None)
+                doc['last_diffs'].append(
+                    message['v'],
+                    message,
+                    len(json_encode(message))
+                )
+            elif message['v'] == doc['version']:
+                cls.apply_diff(doc, message, len(json_encode(message)))
+            else:
+                logger.error(
+                    'Diff journal of document %d is incomplete.' % doc_db.id
+                )
+                break
+
+    @classmethod
+    def load_document(cls, doc_db):
+        doc, journal = cls.read_document(doc_db)
+        cls.replay_journal(doc, journal)
+        return doc
+
+    @classmethod
+    async def open_document(cls, document_id):
+        # Returns the session of a document, which is loaded from the
+        # database if the document is not open yet.
+        while True:
+            if document_id in cls.sessions:
+                await cls.use_document(document_id)
+                if document_id in cls.sessions:
+                    return cls.sessions[document_id]
+            elif document_id in cls.opening:
+                # Another connection is loading the document.
+                await cls.opening[document_id]
+            else:
+                logger.debug("Opening file")
+                cls.io_loop = IOLoop.current()
+                cls.opening[document_id] = Future()
+                try:
+                    doc = await cls.load_session(document_id)
+                    for info in await cls.session_backend.participants(
+                        document_id
+                    ):
+                        doc['roster'][info['session_id']] = info
+                    cls.sessions[document_id] = doc
+                finally:
+                    if document_id not in cls.sessions:
+                        # The session backend may know about the document.
+                        cls.session_backend.close_document(document_id)
+                    cls.release_publications(document_id)
+                    cls.opening.pop(document_id).set_result(None)
+
+    @classmethod
+    async def use_document(cls, document_id):
+        # Marks an open document as recently used and reloads its contents if
+        # they have been evicted from memory.
+        doc = cls.sessions[document_id]
+        doc['used'] = time()
+        if doc['loaded']:
+            if document_id in cls.loaded_sessions:
+                cls.loaded_sessions.move_to_end(document_id)
+                return
+        elif doc.get('reloading') is not None:
+            # Another connection is reloading the document.
+            await doc['reloading']
+            return
+        else:
+            logger.debug('Reloading evicted document %d' % document_id)
+            doc['reloading'] = Future()
+            try:
+                # The snapshot taken on eviction may not have been written
+                # yet, which read_saved_document waits for.
+                loaded_doc = await cls.load_session(document_id)
+                if cls.sessions.get(document_id) is not doc:
+                    # The document has been closed in the meantime.
+                    if (
+                        document_id not in cls.sessions and
+                        document_id not in cls.opening
+                    ):
+                        cls.session_backend.close_document(document_id)
+                    return
+                del loaded_doc['participants']
+                del loaded_doc['selections']
+                del loaded_doc['selection_timer']
+                del loaded_doc['roster']
+                doc.update(loaded_doc)
+            finally:
+                cls.release_publications(document_id)
+                doc.pop('reloading').set_result(None)
+        cls.loaded_sessions[document_id] = doc['size']
+        cls.limit_memory(document_id)
+        if cls.eviction_callback is None and settings.DOC_IDLE_TIME:
+            cls.eviction_callback = PeriodicCallback(
+                cls.evict_idle_documents,
+                60 * 1000
+            )
+            cls.eviction_callback.start()
+
+    @classmethod
+    def limit_memory(cls, document_id):
+        # Evicts the least recently used documents other than the given one
+        # if the open documents exceed DOC_SESSIONS_MAX_SIZE.
+        while (
+            settings.DOC_SESSIONS_MAX_SIZE and
+            sum(cls.loaded_sessions.values()) >
+            settings.DOC_SESSIONS_MAX_SIZE
+        ):
+            lru_document_id = next(iter(cls.loaded_sessions))
+            if lru_document_id == document_id:
+                break
+            cls.evict_document(lru_document_id)
+
+    @classmethod
+    def evict_idle_documents(cls):
+        idle_since = time() - settings.DOC_IDLE_TIME
+        for document_id in list(cls.loaded_sessions):
+            if cls.sessions[document_id]['used'] < idle_since:
+                cls.evict_document(document_id)
+
+    @classmethod
+    def evict_document(cls, document_id):
+        # Saves the document and removes its contents from memory. It is
+        # reloaded from the database by use_document.
+        logger.debug('Evicting document %d' % document_id)
+        doc = cls.sessions[document_id]
+        cls.save_document(document_id, True)
+        if doc.get('save_timer') is not None:
+            IOLoop.current().remove_timeout(doc['save_timer'])
+            doc['save_timer'] = None
+        doc['db'] = None
+        doc['contents'] = None
+        doc['comments'] = None
+        doc['bibliography'] = None
+        doc['template'] = None
+        doc['payloads'] = {}
+        doc['payload_generation'] += 1
+        doc['encoded_state'] = None
+        doc['last_diffs'] = DiffHistory(cls.history_length, cls.history_bytes)
+        doc['content_hashes'] = ContentHashes()
+        doc['loaded'] = False
+        del cls.loaded_sessions[document_id]
+
+    @classmethod
+    def clear_payloads(cls, key, document_id=None):
+        # Removes a cached payload part of one or all open documents after
+        # the data it is based on has changed. It is called from the threads
+        # that save the data as well, and passed on to the IOLoop from there.
+        if cls.io_loop is None:
+            # No document has been opened.
+            return
+        if IOLoop.current(instance=False) is not cls.io_loop:
+            cls.io_loop.add_callback(cls.clear_payloads, key, document_id)
+            return
+        if document_id is None:
+            docs = list(cls.sessions.values())
+        elif document_id in cls.sessions:
+            docs = [cls.sessions[document_id]]
+        else:
+            return
+        for doc in docs:
+            doc['payloads'].pop(key, None)
+            doc['payload_generation'] += 1
+
+    @staticmethod
+    def get_template_styles(doc_db):
         serializer = PythonWithURLSerializer()
         export_temps = serializer.serialize(
             doc_db.template.exporttemplate_set.all(),
@@ -100,6 +546,12 @@ class WebSocket(BaseWebSocketHandler):
             use_natural_foreign_keys=True,
             fields=['title', 'slug', 'contents', 'documentstylefile_set']
         )
+        return {
+            'export_templates': [obj['fields'] for obj in export_temps],
+            'document_styles': [obj['fields'] for obj in document_styles]
+        }
+
+    def get_document_templates(self):
         document_templates = {}
         for obj in DocumentTemplate.objects.filter(
             Q(user=self.user) | Q(user=None)
@@ -108,56 +560,136 @@ class WebSocket(BaseWebSocketHandler):
                 'title': obj.title,
                 'id': obj.id
             }
+        return document_templates
 
+    @staticmethod
+    def get_owner_info(doc_owner):
+        owner = {
+            'id': doc_owner.id,
+            'name': doc_owner.readable_name,
+            'username': doc_owner.username,
+            'avatar': get_user_avatar_url(doc_owner),
+            'team_members': []
+        }
+        members = [
+            team_member.member for team_member in
+            doc_owner.leader.select_related('member')
+        ]
+        avatars = get_user_avatar_urls(members)
+        for member in members:
+            tm_object = dict()
+            tm_object['id'] = member.id
+            tm_object['name'] = member.readable_name
+            tm_object['username'] = member.get_username()
+            tm_object['avatar'] = avatars[member.id]
+            owner['team_members'].append(tm_object)
+        return owner
+
+    @staticmethod
+    def get_images(document_id):
+        images = {}
+        for dimage in DocumentImage.objects.filter(
+            document_id=document_id
+        ).select_related('image'):
+            image = dimage.image
+            field_obj = {
+                'id': image.id,
+                'title': dimage.title,
+                'image': image.image.url,
+                'file_type': image.file_type,
+                'added': mktime(image.added.timetuple()) * 1000,
+                'checksum': image.checksum,
+                'cats': []
+            }
+            if image.thumbnail:
+                field_obj['thumbnail'] = image.thumbnail.url
+                field_obj['height'] = image.height
+                field_obj['width'] = image.width
+            images[image.id] = field_obj
+        return images
+
+    async def get_payloads(self):
+        # Returns the parts of the styles and doc_data messages that are the
+        # same for all participants. Those that are not cached are looked up
+        # in the database thread pool.
+        doc_db = self.doc['db']
+        parts = {}
+        for key, function, argument in [
+            ('styles', WebSocket.get_template_styles, doc_db),
+            ('owner', WebSocket.get_owner_info, doc_db.owner),
+            ('images', WebSocket.get_images, doc_db.id)
+        ]:
+            if key in self.doc['payloads']:
+                parts[key] = self.doc['payloads'][key]
+                continue
+            generation = self.doc['payload_generation']
+            parts[key] = await run_in_db_thread(function, argument)
+            # The payload may have been read before a change that removed
+            # the cached payloads while it was looked up. It is still sent,
+            # but not cached.
+            if self.doc['payload_generation'] == generation:
+                self.doc['payloads'][key] = parts[key]
+        return parts
+
+    async def prepare_document(self):
+        # Loads everything needed to send the document. The document is in
+        # memory when it returns, so that it can be sent without awaiting
+        # anything else.
+        while True:
+            await WebSocket.use_document(self.doc['id'])
+            payloads = await self.get_payloads()
+            if self.doc['loaded']:
+                return payloads
+
+    def send_styles(self, payloads, document_templates):
+        response = dict()
+        response['type'] = 'styles'
+        styles = payloads['styles']
         response['styles'] = {
-            'export_templates': [obj['fields'] for obj in export_temps],
-            'document_styles': [obj['fields'] for obj in document_styles],
+            'export_templates': styles['export_templates'],
+            'document_styles': styles['document_styles'],
             'document_templates': document_templates
         }
         self.send_message(response)
 
-    def send_document(self):
+    def get_encoded_state(self):
+        # Returns the contents, bibliography, comments and template of the
+        # document encoded as JSON. They are encoded once per version of the
+        # document and shared by all participants it is sent to.
+        doc = self.doc
+        encoded_state = doc['encoded_state']
+        if encoded_state is None or encoded_state['v'] != doc['version']:
+            encoded_state = {
+                'v': doc['version'],
+                'contents': json_encode(doc['contents']),
+                'bibliography': json_encode(doc['bibliography']),
+                'comments': json_encode(doc['comments']),
+                'template': json_encode(doc['template'])
+            }
+            doc['encoded_state'] = encoded_state
+        return encoded_state
+
+    def send_doc_data(self, payloads):
         response = dict()
         response['type'] = 'doc_data'
-        doc_owner = self.doc['db'].owner
         response['doc_info'] = {
             'id': self.doc['id'],
             'is_owner': self.user_info.is_owner,
             'access_rights': self.user_info.access_rights,
-            'owner': {
-                'id': doc_owner.id,
-                'name': doc_owner.readable_name,
-                'username': doc_owner.username,
-                'avatar': get_user_avatar_url(doc_owner),
-                'team_members': []
-            }
+            'owner': payloads['owner']
         }
         response['doc'] = {
             'v': self.doc['version'],
             'contents': self.doc['contents'],
             'bibliography': self.doc['bibliography'],
             'template': self.doc['template'],
-            'images': {}
+            'images': payloads['images']
         }
         response['time'] = int(time()) * 1000
-        for dimage in DocumentImage.objects.filter(document_id=self.doc['id']):
-            image = dimage.image
-            field_obj = {
-                'id': image.id,
-                'title': dimage.title,
-                'image': image.image.url,
-                'file_type': image.file_type,
-                'added': mktime(image.added.timetuple()) * 1000,
-                'checksum': image.checksum,
-                'cats': []
-            }
-            if image.thumbnail:
-                field_obj['thumbnail'] = image.thumbnail.url
-                field_obj['height'] = image.height
-                field_obj['width'] = image.width
-            response['doc']['images'][image.id] = field_obj
+        encoded_state = self.get_encoded_state()
         if self.user_info.access_rights == 'read-without-comments':
             response['doc']['comments'] = []
+            comments = '[]'
         elif self.user_info.access_rights == 'review':
             # Reviewer should only get his/her own comments
             filtered_comments = {}
@@ -165,17 +697,58 @@ class WebSocket(BaseWebSocketHandler):
                 if value["user"] == self.user_info.user.id:
                     filtered_comments[key] = value
             response['doc']['comments'] = filtered_comments
+            comments = json_encode(filtered_comments)
         else:
             response['doc']['comments'] = self.doc["comments"]
-        for team_member in doc_owner.leader.all():
-            tm_object = dict()
-            tm_object['id'] = team_member.member.id
-            tm_object['name'] = team_member.member.readable_name
-            tm_object['username'] = team_member.member.get_username()
-            tm_object['avatar'] = get_user_avatar_url(team_member.member)
-            response['doc_info']['owner']['team_members'].append(tm_object)
+            comments = encoded_state['comments']
         response['doc_info']['session_id'] = self.id
-        self.send_message(response)
+        # The message is assembled around the encoded state, so that the
+        # document is not encoded again for each participant.
+        encoded = (
+            '{"type": "doc_data", "doc_info": %s, "doc": {"v": %d, '
+            '"contents": %s, "bibliography": %s, "template": %s, '
+            '"images": %s, "comments": %s}, "time": %d}'
+        ) % (
+            json_encode(response['doc_info']),
+            encoded_state['v'],
+            encoded_state['contents'],
+            encoded_state['bibliography'],
+            encoded_state['template'],
+            json_encode(payloads['images']),
+            comments,
+            response['time']
+        )
+        self.send_message(response, encoded)
+
+    async def send_document(self):
+        payloads = await self.prepare_document()
+        self.send_doc_data(payloads)
+
+    async def resync(self):
+        # The client has fallen too far behind and is sent the current state
+        # of the document instead of the waiting messages.
+        if (
+            not hasattr(self, 'doc') or
+            WebSocket.sessions.get(self.user_info.document_id) is not self.doc
+        ):
+            self.close()
+            return
+        payloads = await self.prepare_document()
+        self.resyncing = False
+        self.send_doc_data(payloads)
+        if self.can_communicate():
+            # Changes of the participant list may have been dropped.
+            self.send_participant_list()
+
+    def coalesce_key(self, message):
+        # Only the newest selection of each participant and the newest
+        # participant list are of interest. Changes to the participant list
+        # are not coalesced, as each of them is needed.
+        if message['type'] == 'selection_change':
+            return ('selection_change', message.get('session_id'))
+        elif message['type'] == 'connections':
+            return 'connections'
+        return None
 
     def reject_message(self, message):
         if (message["type"] == "diff"):
@@ -184,18 +757,22 @@ class WebSocket(BaseWebSocketHandler):
                 'rid': message['rid']
             })
 
-    def handle_message(self, message):
+    async def handle_message(self, message):
         if message["type"] == 'subscribe':
             connection_count = 0
             if 'connection' in message:
                 connection_count = message['connection']
-            self.subscribe_doc(connection_count)
+            await self.subscribe_doc(connection_count, message.get('resume'))
             return
         if self.user_info.document_id not in WebSocket.sessions:
             logger.debug('receiving message for closed document')
             return
+        if message["type"] in ['check_version', 'check_hash', 'diff']:
+            await WebSocket.use_document(self.user_info.document_id)
+            if self.user_info.document_id not in WebSocket.sessions:
+                return
         if message["type"] == 'get_document':
-            self.send_document()
+            await self.send_document()
         elif (
             message["type"] == 'participant_update' and
             self.can_communicate()
@@ -204,23 +781,27 @@ class WebSocket(BaseWebSocketHandler):
         elif message["type"] == 'chat' and self.can_communicate():
             self.handle_chat(message)
         elif message["type"] == 'check_version':
-            self.check_version(message)
+            await self.check_version(message)
+        elif message["type"] == 'check_hash':
+            self.check_hash(message)
         elif message["type"] == 'selection_change':
             self.handle_selection_change(message)
         elif message["type"] == 'diff' and self.can_update_document():
-            self.handle_diff(message)
+            await self.handle_diff(message)
 
-    def update_bibliography(self, bibliography_updates):
+    @staticmethod
+    def update_bibliography(doc, bibliography_updates):
         for bu in bibliography_updates:
             if "id" not in bu:
                 continue
             id = bu["id"]
             if bu["type"] == "update":
-                self.doc["bibliography"][id] = bu["reference"]
+                doc["bibliography"][id] = bu["reference"]
             elif bu["type"] == "delete":
-                del self.doc["bibliography"][id]
+                del doc["bibliography"][id]
 
-    def update_images(self, image_updates):
+    def update_images(self, document_id, image_updates):
+        # Runs in the database thread pool.
         for iu in image_updates:
             if "id" not in iu:
                 continue
@@ -233,7 +814,7 @@ class WebSocket(BaseWebSocketHandler):
                 ).exists():
                     continue
                 doc_image = DocumentImage.objects.filter(
-                    document_id=self.doc["id"],
+                    document_id=document_id,
                     image_id=id
                 )
                 if doc_image.exists():
@@ -241,20 +822,21 @@ class WebSocket(BaseWebSocketHandler):
                     doc_image.save()
                 else:
                     DocumentImage.objects.create(
-                        document_id=self.doc["id"],
+                        document_id=document_id,
                         image_id=id,
                         title=iu["image"]["title"]
                     )
             elif iu["type"] == "delete":
                 DocumentImage.objects.filter(
-                    document_id=self.doc["id"],
+                    document_id=document_id,
                     image_id=id
                 ).delete()
                 for image in Image.objects.filter(id=id):
                     if image.is_deletable():
                         image.delete()
 
-    def update_comments(self, comments_updates):
+    @staticmethod
+    def update_comments(doc, comments_updates):
         comments_updates = deepcopy(comments_updates)
         for cd in comments_updates:
             if "id" not in cd:
@@ -262,7 +844,7 @@ class WebSocket(BaseWebSocketHandler):
                 continue
             id = cd["id"]
             if cd["type"] == "create":
-                self.doc["comments"][id] = {
+                doc["comments"][id] = {
                     "user": cd["user"],
                     "username": cd["username"],
                     "assignedUser": cd["assignedUser"],
@@ -273,24 +855,24 @@ class WebSocket(BaseWebSocketHandler):
                     "resolved": cd["resolved"],
                 }
             elif cd["type"] == "delete":
-                del self.doc["comments"][id]
+                del doc["comments"][id]
             elif cd["type"] == "update":
-                self.doc["comments"][id]["comment"] = cd["comment"]
+                doc["comments"][id]["comment"] = cd["comment"]
                 if "isMajor" in cd:
-                    self.doc["comments"][id][
+                    doc["comments"][id][
                         "isMajor"] = cd["isMajor"]
                 if "assignedUser" in cd and "assignedUsername" in cd:
-                    self.doc["comments"][id][
+                    doc["comments"][id][
                         "assignedUser"] = cd["assignedUser"]
-                    self.doc["comments"][id][
+                    doc["comments"][id][
                         "assignedUsername"] = cd["assignedUsername"]
                 if "resolved" in cd:
-                    self.doc["comments"][id][
+                    doc["comments"][id][
                         "resolved"] = cd["resolved"]
             elif cd["type"] == "add_answer":
-                if "answers" not in self.doc["comments"][id]:
-                    self.doc["comments"][id]["answers"] = []
-                self.doc["comments"][id]["answers"].append({
+                if "answers" not in doc["comments"][id]:
+                    doc["comments"][id]["answers"] = []
+                doc["comments"][id]["answers"].append({
                     "id": cd["answerId"],
                     "user": cd["user"],
                     "username": cd["username"],
@@ -299,17 +881,17 @@ class WebSocket(BaseWebSocketHandler):
                 })
             elif cd["type"] == "delete_answer":
                 answer_id = cd["answerId"]
-                for answer in self.doc["comments"][id]["answers"]:
+                for answer in doc["comments"][id]["answers"]:
                     if answer["id"] == answer_id:
-                        self.doc["comments"][id]["answers"].remove(answer)
+                        doc["comments"][id]["answers"].remove(answer)
             elif cd["type"] == "update_answer":
                 answer_id = cd["answerId"]
-                for answer in self.doc["comments"][id]["answers"]:
+                for answer in doc["comments"][id]["answers"]:
                     if answer["id"] == answer_id:
                         answer["answer"] = cd["answer"]
 
     def handle_participant_update(self):
-        WebSocket.send_participant_list(self.user_info.document_id)
+        self.send_participant_list()
 
     def handle_chat(self, message):
         chat = {
@@ -323,8 +905,35 @@ class WebSocket(BaseWebSocketHandler):
     def handle_selection_change(self, message):
         if self.user_info.document_id in WebSocket.sessions and message[
                 "v"] == self.doc['version']:
-            WebSocket.send_updates(
-                message, self.user_info.document_id, self.id)
+            if not settings.DOC_SELECTION_INTERVAL:
+                WebSocket.send_updates(
+                    message, self.user_info.document_id, self.id)
+                return
+            self.doc['selections'][self.id] = message
+            if self.doc['selection_timer'] is None:
+                self.doc['selection_timer'] = IOLoop.current().call_later(
+                    settings.DOC_SELECTION_INTERVAL,
+                    WebSocket.send_selections,
+                    self.user_info.document_id
+                )
+
+    @classmethod
+    def send_selections(cls, document_id):
+        # Sends the newest selection of each participant that has changed it
+        # since the last time. Selections made in a version of the document
+        # that has been changed since are dropped.
+        if document_id not in cls.sessions:
+            return
+        doc = cls.sessions[document_id]
+        doc['selection_timer'] = None
+        selections = doc['selections']
+        doc['selections'] = {}
+        for session_id, message in selections.items():
+            if (
+                message["v"] == doc['version'] and
+                session_id in doc['participants']
+            ):
+                cls.send_updates(message, document_id, session_id)
 
     # Checks if the diff only contains changes to comments.
     def only_comments(self, message):
@@ -337,7 +946,7 @@ class WebSocket(BaseWebSocketHandler):
                     only_comment = False
         return only_comment
 
-    def handle_diff(self, message):
+    async def handle_diff(self, message):
         pv = message["v"]
         dv = self.doc['version']
         logger.debug("PV: %d, DV: %d" % (pv, dv))
@@ -353,50 +962,53 @@ class WebSocket(BaseWebSocketHandler):
             )
             return
         if pv == dv:
-            self.doc["last_diffs"].append(message)
-            self.doc["last_diffs"] = self.doc[
-                "last_diffs"
-            ][-self.history_length:]
-            self.doc['version'] += 1
-            if "jd" in message:  # jd = json diff
-                try:
-                    apply_patch(
-                       self.doc['contents'],
-                       message["jd"],
-                       True
-                    )
-                except (JsonPatchConflict, JsonPointerException):
-                    logger.exception("Cannot apply json diff.")
-                    logger.error(json_encode(message))
-                    logger.error(json_encode(self.doc['contents']))
-                    self.send_document()
-                # The json diff is only needed by the python backend which does
-                # not understand the steps. It can therefore be removed before
-                # broadcast to other clients.
-                del message["jd"]
-            if "ti" in message:  # ti = title
-                self.doc["title"] = message["ti"]
-            if "cu" in message:  # cu = comment updates
-                self.update_comments(message["cu"])
-            if "bu" in message:  # bu = bibliography updates
-                self.update_bibliography(message["bu"])
-            if "iu" in message:  # iu = image updates
-                self.update_images(message["iu"])
-            if self.doc['version'] % 10 == 0:
-                WebSocket.save_document(self.user_info.document_id)
+            try:
+                accepted = await WebSocket.session_backend.submit_diff(
+                    self.user_info.document_id,
+                    pv,
+                    message,
+                    self.user_info.user.id
+                )
+            except ConnectionError:
+                # The diff cannot be confirmed. The client reconnects and
+                # sends it again.
+                logger.exception('Cannot submit diff to the session backend.')
+                self.close()
+                return
+            if not accepted:
+                # Another server process has confirmed a diff for this
+                # version which has not reached this process yet. The client
+                # will receive it and send its changes again.
+                self.reject_message(message)
+                return
+            encoded = json_encode(message)
+            self.doc['unsaved_diffs'].append((pv, encoded))
+            patched = WebSocket.apply_diff(self.doc, message, len(encoded))
+            WebSocket.schedule_save(self.user_info.document_id)
             self.confirm_diff(message["rid"])
             WebSocket.send_updates(
                 message,
                 self.user_info.document_id,
                 self.id,
-                self.user_info.user.id
+                self.user_info.user.id,
+                publish=False
             )
+            # The diff has been confirmed and sent before anything else is
+            # awaited, so that the diffs of all participants stay in order.
+            if not patched:
+                await self.send_document()
+            if "iu" in message:  # iu = image updates
+                await run_in_db_thread(
+                    self.update_images,
+                    self.user_info.document_id,
+                    message["iu"]
+                )
+                WebSocket.clear_payloads('images', self.user_info.document_id)
         elif pv < dv:
-            if pv + len(self.doc["last_diffs"]) >= dv:
-                # We have enough last_diffs stored to fix it.
+            messages = await self.get_missing_diffs(pv)
+            if messages is not None:
+                # We have enough diffs stored to fix it.
                 logger.debug("can fix it")
-                number_diffs = pv - dv
-                messages = self.doc["last_diffs"][number_diffs:]
                 for message in messages:
                     new_message = message.copy()
                     new_message["server_fix"] = True
@@ -404,12 +1016,49 @@ class WebSocket(BaseWebSocketHandler):
             else:
                 logger.debug('unfixable')
                 # Client has a version that is too old to be fixed
-                self.send_document()
+                await self.send_document()
         else:
             # Client has a higher version than server. Something is fishy!
             logger.debug('unfixable')
 
-    def check_version(self, message):
+    @classmethod
+    def apply_diff(cls, doc, message, size):
+        # Applies a confirmed diff to the state of an open document. Returns
+        # False if the json diff could not be applied to the contents. size
+        # is the length of the encoded message, which is counted against the
+        # limit of the diff history.
+        patched = True
+        version = doc['version']
+        doc['version'] += 1
+        if "jd" in message:  # jd = json diff
+            try:
+                apply_patch(
+                   doc['contents'],
+                   message["jd"],
+                   True
+                )
+            except (JsonPatchConflict, JsonPointerException):
+                logger.exception("Cannot apply json diff.")
+                logger.error(json_encode(message))
+                logger.error(json_encode(doc['contents']))
+                patched = False
+                doc['content_hashes'].clear()
+            else:
+                doc['content_hashes'].update(message["jd"])
+            # The json diff is only needed by the python backend which does
+            # not understand the steps. It can therefore be removed before
+            # broadcast to other clients.
+            del message["jd"]
+        if "ti" in message:  # ti = title
+            doc["title"] = message["ti"]
+        if "cu" in message:  # cu = comment updates
+            cls.update_comments(doc, message["cu"])
+        if "bu" in message:  # bu = bibliography updates
+            cls.update_bibliography(doc, message["bu"])
+        doc["last_diffs"].append(version, message, size)
+        return patched
+
+    async def check_version(self, message):
         pv = message["v"]
         dv = self.doc['version']
         logger.debug("PV: %d, DV: %d" % (pv, dv))
@@ -420,10 +1069,9 @@ class WebSocket(BaseWebSocketHandler):
             }
             self.send_message(response)
             return
-        elif pv + len(self.doc["last_diffs"]) >= dv:
+        messages = await self.get_missing_diffs(pv)
+        if messages is not None:
             logger.debug("can fix it")
-            number_diffs = pv - dv
-            messages = self.doc["last_diffs"][number_diffs:]
             for message in messages:
                 new_message = message.copy()
                 new_message["server_fix"] = True
@@ -432,8 +1080,68 @@ class WebSocket(BaseWebSocketHandler):
         else:
             logger.debug('unfixable')
             # Client has a version that is too old
-            self.send_document()
+            await self.send_document()
+            return
+
+    def check_hash(self, message):
+        # The client sends the hashes of the top-level parts of its document
+        # (h) to make sure that it has not diverged. Only the parts that
+        # differ are sent to it.
+        pv = message["v"]
+        if pv != self.doc['version']:
+            # The client will receive the missing diffs first.
             return
+        contents = self.doc['contents']
+        hashes = self.doc['content_hashes'].get(contents)
+        client_hashes = message["h"]
+        if hashes == client_hashes:
+            return
+        logger.debug('Document %d has diverged.' % self.user_info.document_id)
+        self.send_message({
+            'type': 'repair',
+            'v': pv,
+            'length': len(hashes),
+            'parts': [
+                [index, part] for index, part in
+                enumerate(contents.get('content', []))
+                if (
+                    index >= len(client_hashes) or
+                    client_hashes[index] != hashes[index]
+                )
+            ]
+        })
+
+    async def get_missing_diffs(self, pv):
+        # Returns the diffs needed to bring a client from version pv to the
+        # current version or None if they are no longer available.
+        dv = self.doc['version']
+        if pv > dv:
+            return None
+        history = self.doc["last_diffs"]
+        messages = history.since(pv)
+        if messages is not None:
+            return messages
+        # Older diffs may still be found in the journal. The diffs in memory
+        # include all that have not been saved yet.
+        if len(history):
+            first_version = history.first_version
+        else:
+            first_version = dv
+        messages = await run_in_db_thread(
+            get_journal,
+            self.doc['id'],
+            pv,
+            first_version
+        )
+        if len(messages) != first_version - pv:
+            return None
+        # More diffs may have been confirmed in the meantime.
+        newer_messages = self.doc["last_diffs"].since(first_version)
+        if newer_messages is None:
+            return None
+        for message in messages:
+            message.pop('jd', None)
+        return messages + newer_messages
 
     def can_update_document(self):
         return self.user_info.access_rights in CAN_UPDATE_DOCUMENT
@@ -453,44 +1161,144 @@ class WebSocket(BaseWebSocketHandler):
             ]['participants']
         ):
             del self.doc['participants'][self.id]
+            self.keep_for_resume()
+            WebSocket.session_backend.leave(
+                self.user_info.document_id,
+                self.id
+            )
             if len(self.doc['participants']) == 0:
-                WebSocket.save_document(self.user_info.document_id)
-                del WebSocket.sessions[self.user_info.document_id]
-                logger.debug("noone left")
+                WebSocket.close_document(self.user_info.document_id)
             else:
-                WebSocket.send_participant_list(self.user_info.document_id)
+                WebSocket.remove_from_roster(
+                    self.user_info.document_id,
+                    self.id
+                )
 
     @classmethod
-    def send_participant_list(cls, document_id):
-        if document_id in WebSocket.sessions:
-            participant_list = []
-            for session_id, waiter in list(cls.sessions[
-                document_id
-            ]['participants'].items()):
-                access_rights = waiter.user_info.access_rights
-                if access_rights not in CAN_COMMUNICATE:
-                    continue
-                participant_list.append({
-                    'session_id': session_id,
-                    'id': waiter.user_info.user.id,
-                    'name': waiter.user_info.user.readable_name,
-                    'avatar': get_user_avatar_url(waiter.user_info.user)
-                })
-            message = {
-                "participant_list": participant_list,
-                "type": 'connections'
+    def close_document(cls, document_id):
+        doc = cls.sessions[document_id]
+        if doc.get('selection_timer') is not None:
+            IOLoop.current().remove_timeout(doc['selection_timer'])
+        cls.save_document(document_id, True)
+        del cls.sessions[document_id]
+        cls.loaded_sessions.pop(document_id, None)
+        cls.session_backend.close_document(document_id)
+        logger.debug("noone left")
+
+    def send_participant_list(self):
+        self.send_message({
+            "participant_list": list(self.doc['roster'].values()),
+            "type": 'connections'
+        })
+
+    @classmethod
+    def add_to_roster(cls, document_id, info):
+        # Other server processes learn about the participant from the session
+        # backend.
+        cls.sessions[document_id]['roster'][info['session_id']] = info
+        cls.send_updates(
+            {
+                'type': 'participant_joined',
+                'participant': info
+            },
+            document_id,
+            info['session_id'],
+            publish=False
+        )
+
+    @classmethod
+    def remove_from_roster(cls, document_id, session_id):
+        if cls.sessions[document_id]['roster'].pop(session_id, None) is None:
+            # The participant cannot communicate.
+            return
+        cls.send_updates(
+            {
+                'type': 'participant_left',
+                'session_id': session_id
+            },
+            document_id,
+            publish=False
+        )
+
+    @classmethod
+    def receive_publication(cls, publication):
+        # Handles diffs and updates from participants connected to other
+        # server processes.
+        document_id = int(publication['channel'])
+        if document_id in cls.pending_publications:
+            cls.pending_publications[document_id].append(publication)
+            return
+        if document_id not in cls.sessions:
+            return
+        doc = cls.sessions[document_id]
+        if publication['kind'] == 'diff':
+            message = publication['message']
+            if message['v'] < doc['version']:
+                # The diff was loaded with the document.
+                return
+            if not doc['loaded']:
+                # The diff will be loaded with the document when it is used
+                # again.
+                doc['version'] += 1
+                message.pop('jd', None)
+            elif not cls.apply_diff(doc, message, len(json_encode(message))):
+                logger.error('Diverged from session broker.')
+            cls.send_updates(
+                message,
+                document_id,
+                user_id=publication['user'],
+                publish=False
+            )
+        elif publication['kind'] == 'update':
+            cls.send_updates(
+                publication['message'],
+                document_id,
+                publication['sender'],
+                publication['user'],
+                publish=False
+            )
+        elif publication['kind'] == 'join':
+            cls.add_to_roster(document_id, publication['info'])
+        elif publication['kind'] == 'leave':
+            cls.remove_from_roster(document_id, publication['session_id'])
+        elif publication['kind'] == 'roster':
+            # The connection to the session broker has been opened again and
+            # participants may have come and gone in the meantime.
+            doc['roster'] = {
+                info['session_id']: info
+                for info in publication['participants']
             }
-            WebSocket.send_updates(message, document_id)
+            for waiter in list(doc['participants'].values()):
+                if waiter.can_communicate():
+                    waiter.send_participant_list()
 
     @classmethod
-    def send_updates(cls, message, document_id, sender_id=None, user_id=None):
+    def send_updates(
+        cls,
+        message,
+        document_id,
+        sender_id=None,
+        user_id=None,
+        publish=True
+    ):
+        if publish:
+            cls.session_backend.publish(
+                document_id,
+                message,
+                sender_id,
+                user_id
+            )
         logger.debug(
             "Sending message to %d waiters",
             len(cls.sessions[document_id]['participants'])
         )
+        # The message is encoded once for all recipients that receive the
+        # same version of it.
+        payloads = {}
         for waiter in list(cls.sessions[document_id]['participants'].values()):
             if waiter.id != sender_id:
                 access_rights = waiter.user_info.access_rights
+                with_comments = True
                 if "comments" in message and len(message["comments"]) > 0:
                     # Filter comments if needed
                     if access_rights == 'read-without-comments':
@@ -499,8 +1307,7 @@ class WebSocket(BaseWebSocketHandler):
                         # sent to the reviewer. We still need to send the rest
                         # of the message as it may contain other diff
                         # information.
-                        message = deepcopy(message)
-                        message['comments'] = []
+                        with_comments = False
                     elif (
                         access_rights == 'review' and
                         user_id != waiter.user_info.user.id
@@ -511,10 +1318,14 @@ class WebSocket(BaseWebSocketHandler):
                         # that are not from them. We still need to sned the
                         # rest of the message as it may contain other diff
                         # information.
-                        message = deepcopy(message)
-                        message['comments'] = []
+                        with_comments = False
                 elif (
-                    message['type'] in ["chat", "connections"] and
+                    message['type'] in [
+                        "chat",
+                        "connections",
+                        "participant_joined",
+                        "participant_left"
+                    ] and
                     access_rights not in CAN_COMMUNICATE
                 ):
                     continue
@@ -524,28 +1335,87 @@ class WebSocket(BaseWebSocketHandler):
                     user_id != waiter.user_info.user.id
                 ):
                     continue
-                waiter.send_message(message)
+                if with_comments not in payloads:
+                    if with_comments:
+                        payload = message
+                    else:
+                        payload = dict(message, comments=[])
+                    payloads[with_comments] = (
+                        payload,
+                        encode_message(payload)
+                    )
+                waiter.send_message(*payloads[with_comments])
 
     @classmethod
-    def save_document(cls, document_id):
+    def schedule_save(cls, document_id):
+        # Save once DOC_SAVE_VERSIONS unsaved versions have accumulated, but
+        # not later than DOC_SAVE_DELAY seconds after the first unsaved one.
         doc = cls.sessions[document_id]
+        if len(doc['unsaved_diffs']) >= settings.DOC_SAVE_VERSIONS:
+            cls.save_document(document_id)
+        elif doc.get('save_timer') is None:
+            doc['save_timer'] = IOLoop.current().call_later(
+                settings.DOC_SAVE_DELAY,
+                cls.save_timeout,
+                document_id
+            )
+
+    @classmethod
+    def save_timeout(cls, document_id):
+        if document_id in cls.sessions:
+            cls.sessions[document_id]['save_timer'] = None
+            cls.save_document(document_id)
+
+    @classmethod
+    def save_document(cls, document_id, snapshot=False):
+        # Hands the new diffs to the persistence queue. A snapshot of the
+        # whole document is only saved every DOC_SNAPSHOT_VERSIONS versions
+        # or if requested. The state is encoded here, as it keeps changing on
+        # the IOLoop.
+        doc = cls.sessions[document_id]
+        if not doc['loaded']:
+            # Saved on eviction.
+            return
         doc_db = doc['db']
+        diffs = doc['unsaved_diffs']
+        doc['unsaved_diffs'] = []
+        if (
+            doc['version'] - doc_db.version >= settings.DOC_SNAPSHOT_VERSIONS
+        ):
+            snapshot = True
         if doc_db.version == doc['version']:
+            snapshot = False
+        if len(diffs) == 0 and not snapshot:
             return
         doc_db.title = doc['title'][-255:]
-        doc_db.version = doc['version']
-        doc_db.contents = json_encode(doc['contents'])
-        doc_db.last_diffs = json_encode(doc['last_diffs'])
-        doc_db.comments = json_encode(doc['comments'])
-        doc_db.bibliography = json_encode(doc['bibliography'])
-        logger.debug('saving document # %d' % doc_db.id)
-        logger.debug('version %d' % doc_db.version)
-        doc_db.save()
+        fields = {
+            'title': doc_db.title
+        }
+        if snapshot:
+            doc_db.version = doc['version']
+            fields['version'] = doc_db.version
+            fields['contents'] = json_encode(doc['contents'])
+            fields['comments'] = json_encode(doc['comments'])
+            fields['bibliography'] = json_encode(doc['bibliography'])
+            doc['size'] = (
+                len(fields['contents']) +
+                len(fields['comments']) +
+                len(fields['bibliography'])
+            )
+            if document_id in cls.loaded_sessions:
+                cls.loaded_sessions[document_id] = doc['size']
+        cls.persistence.enqueue(doc_db.id, fields, diffs)
 
     @classmethod
     def save_all_docs(cls):
         for document_id in cls.sessions:
-            cls.save_document(document_id)
+            cls.save_document(document_id, True)
+        if not cls.persistence.drain(settings.DOC_SAVE_SHUTDOWN_TIMEOUT):
+            logger.error('Not all documents could be saved before shutdown.')
+
 
+WebSocket.session_backend = get_session_backend(
+    WebSocket.receive_publication
+)
 
 atexit.register(WebSocket.save_all_docs)
@@ -1,4 +1,4 @@
-from django.http import JsonResponse
+from base.json_codec import JsonResponse
 
 from feedback.models import Feedback
 
@@ -1,9 +1,9 @@
-from django.http import JsonResponse
 from django.core.exceptions import ValidationError
 from django.contrib.auth.decorators import login_required
 from document.helpers.serializers import PythonWithURLSerializer
 from django.utils.translation import ugettext as _
 
+from base.json_codec import JsonResponse
 from .models import DocumentStyle, DocumentStyleFile, ExportTemplate
 from document.models import DocumentTemplate
 
@@ -0,0 +1,66 @@
+import base64
+
+from django.contrib.auth.models import User
+from tornado.escape import json_decode
+from tornado.httpclient import HTTPRequest
+from tornado.web import Application
+from tornado.websocket import websocket_connect
+
+from base.auth_cache import auth_cache
+from document.helpers.access_rights import access_rights_cache
+from document.models import Document, DocumentTemplate
+from document.ws_views import WebSocket
+
+
+def create_document(owner, **fields):
+    # Creates an empty document with a template of its own. The fields of
+    # the document can be given.
+    if 'template' not in fields:
+        fields['template'] = DocumentTemplate.objects.create(title='Standard')
+    fields.setdefault('contents', '{"type": "doc", "content": []}')
+    return Document.objects.create(owner=owner, **fields)
+
+
+class DocumentWebSocketMixin(object):
+    """
+    Connects to the collaboration server of a document owned by the user
+    Writer. To be used with TransactionTestCase and AsyncHTTPTestCase.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.document = create_document(
+            User.objects.create_user(username='Writer', password='secret')
+        )
+
+    def tearDown(self):
+        WebSocket.sessions.pop(self.document.id, None)
+        WebSocket.loaded_sessions.pop(self.document.id, None)
+        # The user and the document are deleted without signals.
+        auth_cache.clear()
+        access_rights_cache.clear()
+        super().tearDown()
+
+    def get_app(self):
+        return Application([
+            ('/ws/document/([^?]*)', WebSocket)
+        ])
+
+    def connect(self):
+        url = 'ws://127.0.0.1:%d/ws/document/%d/' % (
+            self.get_http_port(),
+            self.document.id
+        )
+        return websocket_connect(HTTPRequest(url, headers={
+            'Origin': 'http://127.0.0.1',
+            'Authorization': 'Basic %s' % base64.b64encode(
+                b'Writer:secret'
+            ).decode()
+        }))
+
+    async def read(self, connection, message_type):
+        # Returns the next message of the type, skipping the others.
+        while True:
+            message = json_decode(await connection.read_message())
+            if message['type'] == message_type:
+                return message
@@ -14,7 +14,9 @@ from django.test.testcases import TransactionTestCase
 
 from tornado.ioloop import IOLoop
 
+from base.auth_cache import auth_cache
 from base.servers.tornado_django_hybrid import make_tornado_server
+from document.helpers.access_rights import access_rights_cache
 
 try:
     from asyncio import set_event_loop_policy
@@ -182,6 +184,13 @@ class LiveTornadoTestCase(TransactionTestCase):
                     conn.settings_dict['NAME'] == ':memory:'):
                 conn.allow_thread_sharing = False
 
+    def _fixture_teardown(self):
+        super(LiveTornadoTestCase, self)._fixture_teardown()
+        # The database is emptied without sending signals, so the caches of
+        # the server would outlive the users and documents.
+        auth_cache.clear()
+        access_rights_cache.clear()
+
     @classmethod
     def tearDownClass(cls):
         cls._tearDownClassInternal()
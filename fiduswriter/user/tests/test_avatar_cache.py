@@ -0,0 +1,77 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from base.servers.invalidation import InvalidationChannel, \
+    bind_invalidation_socket
+from user.util import (
+    avatar_cache_key,
+    clear_avatar_url_cache,
+    get_user_avatar_url,
+    get_user_avatar_urls
+)
+
+
+class AvatarCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username='User%d' % number)
+            for number in range(3)
+        ]
+
+    def test_bulk(self):
+        with self.assertNumQueries(1):
+            avatar_urls = get_user_avatar_urls(self.users)
+        self.assertEqual(
+            sorted(avatar_urls),
+            [user.id for user in self.users]
+        )
+        self.assertFalse(avatar_urls[self.users[0].id]['uploaded'])
+        self.assertIn('>U<', avatar_urls[self.users[0].id]['html'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_avatar_urls(self.users), avatar_urls)
+            self.assertEqual(
+                get_user_avatar_url(self.users[1]),
+                avatar_urls[self.users[1].id]
+            )
+
+    def test_clear(self):
+        get_user_avatar_urls(self.users)
+        clear_avatar_url_cache(self.users[2])
+        # Only the user whose cache has been cleared is looked up.
+        with self.assertNumQueries(1):
+            get_user_avatar_urls(self.users)
+        with self.assertNumQueries(0):
+            get_user_avatar_url(self.users[2])
+
+    def test_clear_in_all_workers(self):
+        # Two workers in one process, sharing the cache of the process.
+        sockets = [bind_invalidation_socket() for index in range(2)]
+        ports = [sock.getsockname()[1] for sock in sockets]
+        channels = [
+            InvalidationChannel(ports, index, sock)
+            for index, sock in enumerate(sockets)
+        ]
+        loop = IOLoop()
+        loop.make_current()
+        channels[1].listen()
+        channels[0].listen()
+        try:
+            get_user_avatar_urls(self.users)
+            clear_avatar_url_cache(self.users[2])
+            # The entry is cached again before the other worker clears it.
+            get_user_avatar_url(self.users[2])
+            loop.run_sync(lambda: gen.sleep(0.05))
+            self.assertIsNone(cache.get(avatar_cache_key(self.users[2].id)))
+            self.assertIsNotNone(
+                cache.get(avatar_cache_key(self.users[1].id))
+            )
+        finally:
+            for channel in channels:
+                channel.stop()
+                channel.socket.close()
+            loop.close()
@@ -1,4 +1,9 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from avatar.models import Avatar
 from avatar.utils import get_primary_avatar, get_default_avatar_url
+from base.servers.invalidation import invalidation
 
 
 def string_to_color(username):
@@ -13,8 +18,67 @@ def string_to_color(username):
     return 'rgb(' + r + ',' + g + ',' + b + ')'
 
 
+def avatar_cache_key(user_id):
+    return 'avatar_url_%d' % user_id
+
+
 def get_user_avatar_url(user):
-    avatar = get_primary_avatar(user, 80)
+    key = avatar_cache_key(user.id)
+    avatar_url = cache.get(key)
+    if avatar_url is None:
+        avatar = get_primary_avatar(user, 80)
+        avatar_url = avatar_url_info(user, avatar)
+        cache.set(key, avatar_url, settings.AVATAR_URL_CACHE_TIME)
+    return avatar_url
+
+
+def get_user_avatar_urls(users):
+    # Same as get_user_avatar_url for several users, using one query for
+    # those that are not cached. Returns a dict with the user ids as keys.
+    keys = {avatar_cache_key(user.id): user.id for user in users}
+    avatar_urls = {
+        keys[key]: avatar_url
+        for key, avatar_url in cache.get_many(list(keys)).items()
+    }
+    missing_users = [user for user in users if user.id not in avatar_urls]
+    if len(missing_users) == 0:
+        return avatar_urls
+    avatars = {}
+    for avatar in Avatar.objects.filter(
+        user__in=missing_users
+    ).order_by('user_id', '-primary', '-date_uploaded'):
+        # The primary or else most recently uploaded avatar comes first.
+        if avatar.user_id not in avatars:
+            avatars[avatar.user_id] = avatar
+    new_avatar_urls = {}
+    for user in missing_users:
+        avatar = avatars.get(user.id)
+        if avatar and not avatar.thumbnail_exists(80):
+            avatar.create_thumbnail(80)
+        new_avatar_urls[user.id] = avatar_url_info(user, avatar)
+    cache.set_many(
+        {
+            avatar_cache_key(user_id): avatar_url
+            for user_id, avatar_url in new_avatar_urls.items()
+        },
+        settings.AVATAR_URL_CACHE_TIME
+    )
+    avatar_urls.update(new_avatar_urls)
+    return avatar_urls
+
+
+def clear_avatar_url_cache(user):
+    clear_avatar_url(user.id)
+
+
+@invalidation
+def clear_avatar_url(user_id):
+    # Unless CACHES configures a shared cache, each server process has its
+    # own.
+    cache.delete(avatar_cache_key(user_id))
+
+
+def avatar_url_info(user, avatar):
     if avatar:
         url = avatar.avatar_url(80)
         return {
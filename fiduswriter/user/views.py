@@ -1,12 +1,10 @@
-import json
-
-from django.http import JsonResponse
 from django.contrib.auth import logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.shortcuts import HttpResponseRedirect
 
+from base.json_codec import JsonResponse, json_decode
 from .forms import UserForm, TeamMemberForm
 from . import util as userutil
 from document.models import AccessRight, AccessRightInvite
@@ -227,6 +225,7 @@ def upload_avatar(request):
                 user=request.user,
                 avatar=avatar
             )
+            userutil.clear_avatar_url_cache(request.user)
             response['avatar'] = userutil.get_user_avatar_url(
                 request.user
             )['url']
@@ -261,6 +260,7 @@ def delete_avatar(request):
                     )
                     break
             Avatar.objects.filter(pk=aid).delete()
+            userutil.clear_avatar_url_cache(request.user)
             response['avatar'] = userutil.get_user_avatar_url(
                 request.user
             )['url']
@@ -304,7 +304,7 @@ def save_profile(request):
     response = {}
     status = 405
     if request.is_ajax() and request.method == 'POST':
-        form_data = json.loads(request.POST['form_data'])
+        form_data = json_decode(request.POST['form_data'])
         user_object = User.objects.get(pk=request.user.pk)
         user_form = UserForm(form_data['user'], instance=user_object)
         if user_form.is_valid():
@@ -345,14 +345,15 @@ def list_team_members(request):
     if request.is_ajax() and request.method == 'POST':
         status = 200
         response['team_members'] = []
-
-        for member in User.objects.filter(member__leader=request.user):
+        members = list(User.objects.filter(member__leader=request.user))
+        avatars = userutil.get_user_avatar_urls(members)
+        for member in members:
             team_member = {
                 'id': member.id,
                 'name': member.readable_name,
                 'username': member.get_username(),
                 'email': member.email,
-                'avatar': userutil.get_user_avatar_url(member)
+                'avatar': avatars[member.id]
             }
             response['team_members'].append(team_member)
     return JsonResponse(
@@ -1,7 +1,7 @@
-from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 
+from base.json_codec import JsonResponse
 from document.models import DocumentTemplate
 from document.helpers.serializers import PythonWithURLSerializer
 
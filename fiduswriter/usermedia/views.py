@@ -3,10 +3,10 @@ from builtins import filter
 from time import mktime
 
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
 from django.core.serializers.python import Serializer
 from django.utils.translation import ugettext as _
 
+from base.json_codec import JsonResponse
 from usermedia.models import Image, ImageCategory, UserImage
 from .models import ALLOWED_FILETYPES
 
@@ -102,7 +102,8 @@ setuptools.setup(
         "mysql": read('fiduswriter/mysql-requirements.txt').splitlines(),
         "postgresql": read(
             'fiduswriter/postgresql-requirements.txt'
-        ).splitlines()
+        ).splitlines(),
+        "orjson": read('fiduswriter/orjson-requirements.txt').splitlines()
     },
     entry_points={
         "console_scripts": [